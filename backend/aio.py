@@ -0,0 +1,111 @@
+from itertools import islice
+from starlette.concurrency import run_in_threadpool
+
+# Thin async facades over the blocking pymongo / redis clients.
+# They expose the subset of the Motor / redis.asyncio API the routes use, so
+# ASYNC_IO=0 runs the exact same route code with every call pushed onto the
+# threadpool (what FastAPI does for plain `def` routes).
+
+
+class ThreadedCursor:
+    def __init__(self, open_cursor):
+        self._open = open_cursor
+        self._cursor = None
+
+    def _chain(self, name, *args, **kwargs):
+        previous = self._open
+        self._open = lambda: getattr(previous(), name)(*args, **kwargs)
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self._chain("sort", *args, **kwargs)
+
+    def limit(self, *args, **kwargs):
+        return self._chain("limit", *args, **kwargs)
+
+    def skip(self, *args, **kwargs):
+        return self._chain("skip", *args, **kwargs)
+
+    def batch_size(self, *args, **kwargs):
+        return self._chain("batch_size", *args, **kwargs)
+
+    def hint(self, *args, **kwargs):
+        return self._chain("hint", *args, **kwargs)
+
+    def _fetch(self, n):
+        if self._cursor is None:
+            self._cursor = self._open()
+        return list(islice(self._cursor, n))
+
+    async def to_list(self, length=None):
+        return await run_in_threadpool(self._fetch, length)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            batch = await run_in_threadpool(self._fetch, 100)
+            if not batch:
+                return
+            for doc in batch:
+                yield doc
+
+
+class ThreadedCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return ThreadedCursor(lambda: self._collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return ThreadedCursor(lambda: self._collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(method, *args, **kwargs)
+        return call
+
+
+class ThreadedDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return ThreadedCollection(self._database[name])
+
+    def __getattr__(self, name):
+        method = getattr(self._database, name)
+
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(method, *args, **kwargs)
+        return call
+
+
+class ThreadedClient:
+    def __init__(self, client):
+        self._client = client
+
+    def __getitem__(self, name):
+        return ThreadedDatabase(self._client[name])
+
+    def close(self):
+        pass
+
+
+class ThreadedRedis:
+    def __init__(self, redis):
+        self._redis = redis
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(method, *args, **kwargs)
+        return call
+
+    async def close(self):
+        pass
@@ -0,0 +1,88 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+from metrics import HASH_LATENCY, HASH_QUEUE_DEPTH, HASH_REJECTED
+
+# bcrypt runs in a small pool of processes per API worker, so a burst of
+# logins cannot take every threadpool thread (and the GIL) away from the
+# dashboard routes. At most HASH_QUEUE_SIZE hashes wait or run at once per
+# worker; past that requests are turned away with a 503 right away.
+# HASH_WORKERS=0 hashes on the threadpool instead.
+
+# Cost of new hashes. Existing hashes with another cost are redone on the
+# next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_pool = None
+_in_flight = 0
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
+# Spawned rather than forked: the API process holds Mongo/Redis client threads
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run(operation: str, fn, *args):
+    global _in_flight
+    if _in_flight >= HASH_QUEUE_SIZE:
+        HASH_REJECTED.inc()
+        raise HTTPException(
+            status_code=503, detail="Too many sign-ins in progress, try again shortly", headers={"Retry-After": "1"}
+        )
+
+    _in_flight += 1
+    HASH_QUEUE_DEPTH.inc()
+    start = time.perf_counter()
+    try:
+        if HASH_WORKERS:
+            return await asyncio.get_running_loop().run_in_executor(pool(), fn, *args)
+        return await run_in_threadpool(fn, *args)
+    except BrokenProcessPool:
+        # A worker died, start a fresh pool for the next request. The broken
+        # one is shut down first so its surviving workers don't linger.
+        shutdown()
+        raise HTTPException(status_code=503, detail="Password hashing unavailable, try again shortly")
+    finally:
+        _in_flight -= 1
+        HASH_QUEUE_DEPTH.dec()
+        HASH_LATENCY.labels(operation).observe(time.perf_counter() - start)
+
+
+async def hash_password_async(password: str) -> str:
+    return await run("hash", hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run("verify", verify_password, plain_password, hashed_password)
@@ -1,21 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
+from fastapi import APIRouter, HTTPException, Depends, Body, Request, BackgroundTasks
 from auth.models import UserCreate, UserLogin, UserProfileUpdate, ChangePasswordRequest
-from auth.utils import hash_password, verify_password, create_access_token, get_current_user
-from database import db_users, redis
+from auth.utils import (
+    create_access_token, get_current_user, oauth2_scheme, revoke_token,
+    check_login_throttle, record_login_failure, clear_login_failures, rehash_password
+)
+from auth.hashing import hash_password_async, verify_password_async
+from database import adb_users
+from cache import invalidate_user
 from datetime import timedelta
+import time
 
 router = APIRouter()
 
 # Register a new user
 @router.post("/register")
-def register(user: UserCreate = Body(...)):
-    if db_users.find_one({"email": user.email}):
+async def register(user: UserCreate = Body(...)):
+    if await adb_users.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user_doc = {
         "email": user.email,
         "username": user.username,
-        "hashed_password": hash_password(user.password),
+        "hashed_password": await hash_password_async(user.password),
         "role": user.role
     }
 
@@ -27,28 +33,34 @@ def register(user: UserCreate = Body(...)):
             "tracked_products": []
         })
 
-    db_users.insert_one(user_doc)
+    await adb_users.insert_one(user_doc)
     return {"msg": f"{user.role.capitalize()} user registered successfully"}
 
 # Login a user and return a JWT token
 @router.post("/login")
-def login(user: UserLogin):
-    db_user = db_users.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+async def login(user: UserLogin, request: Request, background: BackgroundTasks):
+    ip = request.client.host if request.client else None
+    await check_login_throttle(user.email, ip)
+    db_user = await adb_users.find_one({"email": user.email})
+    # bcrypt is CPU bound, it runs in the hash pool
+    if not db_user or not await verify_password_async(user.password, db_user["hashed_password"]):
+        await record_login_failure(user.email, ip)
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    await clear_login_failures(user.email)
+    background.add_task(rehash_password, user.email, user.password, db_user["hashed_password"])
     token = create_access_token({"sub": user.email}, expires_delta=timedelta(minutes=60))
     return {"access_token": token, "token_type": "bearer"}
 
 # Logout a user
 @router.post("/logout")
-def logout(current_user: dict = Depends(get_current_user)):
-    cache_key = f"user:{current_user['email'].lower()}"
-    redis.delete(cache_key)
+async def logout(current_user: dict = Depends(get_current_user), token: str = Depends(oauth2_scheme)):
+    await revoke_token(token)
+    await invalidate_user(current_user["email"])
     return {"message": "User logged out successfully"}
 
 
 @router.get("/me")
-def read_users_me(current_user: dict = Depends(get_current_user)):
+async def read_users_me(current_user: dict = Depends(get_current_user)):
     result = {
         "username": current_user["username"],
         "email": current_user["email"],
@@ -66,7 +78,7 @@ def read_users_me(current_user: dict = Depends(get_current_user)):
 
 # Edit user profile
 @router.put("/me")
-def update_profile(
+async def update_profile(
     updates: UserProfileUpdate,
     current_user: dict = Depends(get_current_user)
 ):
@@ -74,23 +86,31 @@ def update_profile(
     if not update_fields:
         raise HTTPException(status_code=400, detail="No valid fields to update")
     
-    db_users.update_one({"email": current_user["email"]}, {"$set": update_fields})
-    cache_key = f"user:{current_user['email'].lower()}"
-    redis.delete(cache_key)
+    await adb_users.update_one({"email": current_user["email"]}, {"$set": update_fields})
+    await invalidate_user(current_user["email"])
     return {"msg": "Profile updated successfully"}
 
 
 # Change password
 @router.post("/change-password")
-def change_password(
+async def change_password(
     payload: ChangePasswordRequest,
-    current_user: dict = Depends(get_current_user)
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    token: str = Depends(oauth2_scheme)
 ):
-    if not verify_password(payload.old_password, current_user["hashed_password"]):
+    ip = request.client.host if request.client else None
+    await check_login_throttle(current_user["email"], ip)
+    if not await verify_password_async(payload.old_password, current_user["hashed_password"]):
+        await record_login_failure(current_user["email"], ip)
         raise HTTPException(status_code=401, detail="Old password is incorrect")
     
-    new_hashed = hash_password(payload.new_password)
-    db_users.update_one({"email": current_user["email"]}, {"$set": {"hashed_password": new_hashed}})
-    cache_key = f"user:{current_user['email'].lower()}"
-    redis.delete(cache_key)
+    new_hashed = await hash_password_async(payload.new_password)
+    # Sign out every session that logged in with the old password
+    await adb_users.update_one(
+        {"email": current_user["email"]},
+        {"$set": {"hashed_password": new_hashed, "tokens_valid_after": time.time()}}
+    )
+    await revoke_token(token)
+    await invalidate_user(current_user["email"])
     return {"msg": "Password changed successfully"}
@@ -1,31 +1,33 @@
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
-from database import db_users, redis
-from bson import json_util
+from database import adb_users, aredis
+from cache import LOCAL_CACHE_TTL, drop_local, get_user, invalidate_user, local_cache, set_user
+from metrics import timed
+from auth.hashing import hash_password, verify_password, hash_password_async, needs_rehash
+import hashlib
 import os
+import time
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
-
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
+# Failed password checks allowed per email and per client IP within
+# LOGIN_WINDOW seconds, 0 turns a limit off
+LOGIN_WINDOW = int(os.getenv("LOGIN_WINDOW", "900"))
+LOGIN_EMAIL_FAILURES = int(os.getenv("LOGIN_EMAIL_FAILURES", "5"))
+LOGIN_IP_FAILURES = int(os.getenv("LOGIN_IP_FAILURES", "50"))
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=60))
-    to_encode.update({"exp": expire})
+    # Sub-second iat, compared against tokens_valid_after
+    to_encode.update({"exp": expire, "iat": time.time()})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -36,34 +38,122 @@ def decode_access_token(token: str):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    payload = decode_access_token(token)
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Verified claims are kept in the local cache (never past the token's exp),
+# so repeated requests with the same token skip the signature check
+async def verify_token(token: str) -> dict:
+    digest = token_hash(token)
+    key = f"token:{digest}"
+    payload = local_cache.get(key)
+    if payload is not None:
+        return payload
+
+    with timed("jwt_decode"):
+        payload = decode_access_token(token)
+    if await aredis.exists(f"revoked:{digest}"):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        local_cache.set(key, payload, len(token), ttl=min(expires_in, LOCAL_CACHE_TTL))
+    return payload
+
+
+# Reject this token until it would have expired anyway
+async def revoke_token(token: str):
+    payload = await verify_token(token)
+    digest = token_hash(token)
+    expires_in = int(payload.get("exp", 0) - time.time()) + 1
+    if expires_in > 0:
+        await aredis.set(f"revoked:{digest}", 1, ex=expires_in)
+    await drop_local(f"token:{digest}")
+
+
+def failure_limits(email: str, ip: str | None) -> list[tuple[str, int]]:
+    limits = [(f"login:failures:email:{email.lower()}", LOGIN_EMAIL_FAILURES)]
+    if ip:
+        limits.append((f"login:failures:ip:{ip}", LOGIN_IP_FAILURES))
+    return [(key, limit) for key, limit in limits if limit]
+
+
+# Checked before any bcrypt work, so a blocked client costs one MGET
+async def check_login_throttle(email: str, ip: str | None):
+    limits = failure_limits(email, ip)
+    if not limits:
+        return
+    counts = await aredis.mget([key for key, _ in limits])
+    for (key, limit), count in zip(limits, counts):
+        if count and int(count) >= limit:
+            retry_after = await aredis.ttl(key)
+            raise HTTPException(
+                status_code=429, detail="Too many failed attempts, try again later",
+                headers={"Retry-After": str(max(retry_after, 1))}
+            )
+
+
+async def record_login_failure(email: str, ip: str | None):
+    for key, _ in failure_limits(email, ip):
+        if await aredis.incr(key) == 1:
+            await aredis.expire(key, LOGIN_WINDOW)
+
+
+async def clear_login_failures(email: str):
+    await aredis.delete(f"login:failures:email:{email.lower()}")
+
+
+# Re-hash with the current BCRYPT_ROUNDS after a successful login. Skipped
+# when the pool is busy (the next login tries again) or when the password
+# changed in the meantime.
+async def rehash_password(email: str, password: str, old_hash: str):
+    if not needs_rehash(old_hash):
+        return
+    try:
+        new_hash = await hash_password_async(password)
+    except HTTPException:
+        return
+    result = await adb_users.update_one(
+        {"email": email, "hashed_password": old_hash}, {"$set": {"hashed_password": new_hash}}
+    )
+    if result.modified_count:
+        await invalidate_user(email)
+
+
+# Cached user document, loaded from Mongo on a miss
+async def user_by_email(email: str) -> dict:
+    user = await get_user(email)
+    if not user:
+        user = await adb_users.find_one({"email": email})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        await set_user(user)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    payload = await verify_token(token)
     email = payload.get("sub")
     if email is None:
         raise HTTPException(status_code=401, detail="Invalid token payload")
 
-    cache_key = f"user:{email.lower()}"
-    cached = redis.get(cache_key)
-    if cached:
-        # print("Used cache")
-        return json_util.loads(cached)
-    
-    # print("Calling DB")
-    user = db_users.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    redis.set(cache_key, json_util.dumps(user), ex=3600)
+    user = await user_by_email(email)
+
+    # Tokens issued before the last password change are no longer valid.
+    # Older tokens and users carry whole seconds, so a tie counts as before.
+    if payload.get("iat", 0) <= user.get("tokens_valid_after", 0):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
     return user
 
 
-def require_enterprise(current_user: dict = Depends(get_current_user)):
+async def require_enterprise(current_user: dict = Depends(get_current_user)):
     user = current_user
     if user and (user.get("role") == "enterprise" or user.get("role") == "admin"):
         return user
     raise HTTPException(status_code=403, detail="Enterprise access required")
 
 
-def require_admin(current_user: dict = Depends(get_current_user)):
+async def require_admin(current_user: dict = Depends(get_current_user)):
     user = current_user
     if user and user.get("role") == "admin":
         return user
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from database import adb
+from sentiment.rollups import normalize_product
+
+# Stand-in for the crawl service, for exercising the job queue locally:
+#
+#   uvicorn bench.fake_crawler:app --port 8090
+#
+# Every /crawl sleeps FAKE_CRAWL_DELAY seconds, fails with a 503 at
+# FAKE_CRAWL_FAILURE_RATE, and otherwise writes `limit` made-up comments to
+# the requester's collection, like the real crawler does.
+
+FAKE_CRAWL_DELAY = float(os.getenv("FAKE_CRAWL_DELAY", "2"))
+FAKE_CRAWL_FAILURE_RATE = float(os.getenv("FAKE_CRAWL_FAILURE_RATE", "0"))
+DAYS = {"week": 7, "month": 30, "year": 365}
+PREDICTIONS = ["Positive", "Neutral", "Negative", "Irrelevant"]
+
+app = FastAPI()
+
+
+class CrawlRequest(BaseModel):
+    requester_id: str
+    keyword: str
+    subreddits: list[str] = []
+    limit: int = 30
+    time_filter: str = "week"
+
+
+@app.post("/crawl")
+async def crawl(request: CrawlRequest):
+    await asyncio.sleep(FAKE_CRAWL_DELAY)
+    if random.random() < FAKE_CRAWL_FAILURE_RATE:
+        raise HTTPException(status_code=503, detail="Fake crawler failure")
+
+    today = datetime.utcnow()
+    days = DAYS.get(request.time_filter, 7)
+    docs = [
+        {
+            "product": request.keyword,
+            "product_key": normalize_product(request.keyword),
+            "text": f"Fake comment {i} about {request.keyword}",
+            "author": f"fake_user_{random.randint(1, 1000)}",
+            "score": random.randint(0, 500),
+            "created": (today - timedelta(days=random.randrange(days))).strftime("%Y-%m-%d"),
+            "prediction": random.choice(PREDICTIONS),
+        }
+        for i in range(request.limit)
+    ]
+    if docs:
+        await adb[f"reddits_{request.requester_id}"].insert_many(docs)
+    return {"message": "Crawl finished", "inserted": len(docs)}
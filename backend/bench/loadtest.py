@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import httpx
+
+# Small closed-loop load generator for comparing ASYNC_IO=1 against ASYNC_IO=0.
+#
+#   ASYNC_IO=1 uvicorn main:app --workers 1 &
+#   python -m bench.loadtest --email a@b.c --password secret --product "switch 2"
+#
+# Every worker coroutine sends one request at a time, so --concurrency is the
+# number of requests in flight.
+
+DEFAULT_PATHS = [
+    "/auth/me",
+    "/sentiment/summary?product={product}",
+    "/sentiment/top-comments?product={product}",
+    "/sentiment/weekly?product={product}",
+    "/sentiment/monthly?product={product}",
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def login(http: httpx.AsyncClient, email: str, password: str) -> str:
+    res = await http.post("/auth/login", json={"email": email, "password": password})
+    res.raise_for_status()
+    return res.json()["access_token"]
+
+
+async def run(base_url: str, token: str, paths: list[str], concurrency: int, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as http:
+        deadline = time.perf_counter() + duration
+
+        async def worker(offset: int):
+            i = offset
+            while time.perf_counter() < deadline:
+                path = paths[i % len(paths)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    res = await http.get(path)
+                    if res.status_code >= 400:
+                        errors[path] += 1
+                        continue
+                except httpx.HTTPError:
+                    errors[path] += 1
+                    continue
+                latencies[path].append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [l for values in latencies.values() for l in values]
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "routes": {path: summarize(latencies[path], errors[path], elapsed) for path in paths},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Drive the API at a fixed concurrency and report latency percentiles")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", help="Bearer token (otherwise --email/--password are used to log in)")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    parser.add_argument("--product", default="switch 2")
+    parser.add_argument("--path", action="append", help="Path to request, may be repeated ({product} is substituted)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--out", help="Write the result as JSON to this file")
+    args = parser.parse_args()
+
+    token = args.token
+    if not token and args.email:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as http:
+            token = await login(http, args.email, args.password)
+
+    paths = [p.format(product=args.product) for p in (args.path or DEFAULT_PATHS)]
+    result = await run(args.base_url, token, paths, args.concurrency, args.duration)
+
+    total = result["total"]
+    print(f"{total['requests']} requests in {result['duration_s']}s at concurrency {args.concurrency}: "
+          f"{total['rps']} req/s, p50 {total['p50_ms']}ms, p95 {total['p95_ms']}ms, p99 {total['p99_ms']}ms, "
+          f"{total['errors']} errors")
+    for path, stats in result["routes"].items():
+        print(f"  {path}: {stats['rps']} req/s, p50 {stats['p50_ms']}ms, p99 {stats['p99_ms']}ms, {stats['errors']} errors")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import date, timedelta
+from bench.loadtest import percentile
+from bench.seed import DRIFT_REPORT_FILE
+from bench.suite import git_commit
+
+# In-process micro-benchmarks for the code behind the sentiment and monitor
+# routes, without HTTP or caching in the way:
+#
+#   python -m bench.micro                  # pure functions and cache codecs
+#   python -m bench.micro --db --out micro.json
+#
+# --db also times the read functions against the database seeded by
+# bench.seed. The JSON output can be compared with bench.suite compare.
+# The codec group compares the cache format of codec.py with the JSON text
+# entries used before it: bytes kept in Redis and CPU per cache hit
+# (decode the stored value and render the response).
+
+
+def measure(fn, runs: int) -> dict:
+    fn()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return stats(timings)
+
+
+async def ameasure(fn, runs: int) -> dict:
+    await fn()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return stats(timings)
+
+
+def stats(timings: list[float]) -> dict:
+    return {
+        "runs": len(timings),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+    }
+
+
+def pure_benchmarks(runs: int) -> dict:
+    from sentiment.rollups import histogram, weekly_buckets, monthly_buckets
+    from sentiment.ingest import content_hash
+    from sentiment.utils import encode_cursor, decode_cursor
+    from monitor.reports import parse_report, metric_points
+    from bson import ObjectId
+
+    today = date.today()
+    rows = [
+        {"day": (today - timedelta(days=d)).isoformat(), "prediction": p, "count": d + 1}
+        for d in range(365) for p in ("Positive", "Neutral", "Negative")
+    ]
+    with open(DRIFT_REPORT_FILE) as f:
+        report = {**json.load(f), "_id": ObjectId(), "timestamp": "2025-05-01T00:00:00"}
+    record = parse_report("data-drift", report)
+    cursor = encode_cursor({"_id": ObjectId(), "score": 42})
+
+    return {
+        "weekly_buckets(365 days)": measure(lambda: weekly_buckets(rows), runs),
+        "monthly_buckets(365 days)": measure(lambda: monthly_buckets(rows), runs),
+        "histogram(day, 365 days)": measure(lambda: histogram(rows, "day", today - timedelta(days=364), today), runs),
+        "content_hash": measure(lambda: content_hash("switch 2", "someone", "2025-04-23", "A comment " * 20), runs),
+        "decode_cursor": measure(lambda: decode_cursor(cursor), runs),
+        "parse_report(drift_report_3)": measure(lambda: parse_report("data-drift", report), runs),
+        "metric_points(drift_report_3)": measure(lambda: metric_points(record), runs),
+    }
+
+
+def codec_payloads() -> dict:
+    from sentiment.rollups import weekly_buckets, histogram
+    from bson import ObjectId
+
+    today = date.today()
+    rows = [
+        {"day": (today - timedelta(days=d)).isoformat(), "prediction": p, "count": d + 1}
+        for d in range(365) for p in ("Positive", "Neutral", "Negative")
+    ]
+    series = histogram(rows, "week", today - timedelta(days=84), today)
+    with open(DRIFT_REPORT_FILE) as f:
+        report = json.load(f)
+    return {
+        "summary": {"product": "Switch 2", "total": 1200, "positive": 700, "neutral": 300, "negative": 150, "irrelevant": 50},
+        "weekly": weekly_buckets(rows),
+        "compare(20 products)": [
+            {"product": f"Product {i}", "summary": {"total": 100, "positive": 50, "neutral": 30, "negative": 20}, "series": series}
+            for i in range(20)
+        ],
+        "drift report": {**report, "_id": str(ObjectId())},
+    }
+
+
+def codec_benchmarks(runs: int) -> dict:
+    from fastapi.responses import JSONResponse
+    from codec import Entry, FastJSONResponse, pack_entry, unpack_entry
+
+    results = {}
+    for name, value in codec_payloads().items():
+        legacy = json.dumps({"v": value, "fresh_until": time.time() + 3600})
+        packed = pack_entry(Entry.of(value, 3600))
+        results[f"{name} json hit"] = {
+            **measure(lambda: JSONResponse(content=json.loads(legacy)["v"]).body, runs),
+            "bytes": len(legacy.encode()),
+        }
+        results[f"{name} codec hit"] = {
+            **measure(lambda: FastJSONResponse(content=unpack_entry(packed).fragment()).body, runs),
+            "bytes": len(packed),
+        }
+    return results
+
+
+async def db_benchmarks(runs: int) -> dict:
+    from database import db
+    from sentiment.utils import get_new_sentiments, get_weekly, get_monthly, get_comment_page, get_dashboard, get_comparison
+    from bench.seed import BENCH_USERS
+
+    seed = db["bench_meta"].find_one({"_id": "seed"})
+    if not seed:
+        raise SystemExit("No bench_meta.seed document, run python -m bench.seed first")
+    user = db["users"].find_one({"email": BENCH_USERS["enterprise"][0]})
+    user_id = f"reddits_{user['_id']}"
+    product = seed["products"][0]
+    today = date.today()
+
+    return {
+        "get_new_sentiments": await ameasure(lambda: get_new_sentiments(product, user_id), runs),
+        "get_weekly": await ameasure(lambda: get_weekly(product, user_id), runs),
+        "get_monthly": await ameasure(lambda: get_monthly(product, user_id), runs),
+        "get_comment_page": await ameasure(lambda: get_comment_page(product, user_id, 20), runs),
+        "get_dashboard": await ameasure(lambda: get_dashboard(product, user_id), runs),
+        "get_comparison(20 products)": await ameasure(
+            lambda: get_comparison(user["tracked_products"], user_id, "week", today - timedelta(days=84), today), runs
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the functions behind the routes in-process")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--db", action="store_true", help="Also time the database reads against the seeded corpus")
+    parser.add_argument("--out", help="Write the result as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"pure": pure_benchmarks(args.runs), "codec": codec_benchmarks(args.runs)}
+    if args.db:
+        results["db"] = asyncio.run(db_benchmarks(args.runs))
+
+    for group, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            size = f", {result['bytes']} bytes" if "bytes" in result else ""
+            print(f"{group} {name}: p50 {result['p50_ms']}ms, p95 {result['p95_ms']}ms, p99 {result['p99_ms']}ms{size}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": {"commit": git_commit(), "runs": args.runs}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from database import MONGO_URI, db, db_comments, db_rollups, db_users, db_model, db_datadrift, db_datasummary, db_alert, verify_indexes
+from auth.utils import hash_password
+from cache import SHARED_TENANT
+from sentiment.rollups import normalize_product, rollup_key, rollup_ops
+
+# Seeds a local MongoDB with a synthetic corpus shaped like
+# frontend/src/data/main.reddits.json, for bench.suite and bench.micro:
+#
+#   python -m bench.seed --size 1m --drop
+#
+# Comments go to the `comments` collection: every product gets shared
+# comments, and each of --tenants private tenants gets comments for a handful
+# of products. Product popularity is Zipf-like, scores are Pareto-like like
+# the real crawl. Rollups are written from the same counts, so the API can be
+# benchmarked without running the tailer. Two users are created, see
+# BENCH_USERS, and the parameters are kept in bench_meta for the suite.
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+SAMPLE_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "frontend", "src", "data", "main.reddits.json")
+DRIFT_REPORT_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "frontend", "src", "data", "drift_report_3.json")
+BRANDS = [
+    "Switch", "Pixel", "Galaxy", "iPhone", "Steam Deck", "Xbox", "PlayStation", "Kindle", "ThinkPad", "Surface",
+    "MacBook", "iPad", "Quest", "Vision", "Zenbook", "Legion", "Rog Ally", "Fire TV", "Echo", "Nest",
+]
+PREDICTIONS = ["Positive", "Neutral", "Negative", "Irrelevant"]
+BENCH_USERS = {
+    "enterprise": ("bench-enterprise@bench.local", "bench-password"),
+    "admin": ("bench-admin@bench.local", "bench-password"),
+}
+PRIVATE_PRODUCTS = 10
+BATCH_SIZE = 10_000
+
+
+def load_samples() -> list[dict]:
+    try:
+        with open(SAMPLE_FILE) as f:
+            return json.load(f)
+    except OSError:
+        return [{"text": "Sample comment", "author": "someone", "prediction": p} for p in PREDICTIONS]
+
+
+def product_names(n: int) -> list[str]:
+    return [f"{BRANDS[i % len(BRANDS)]} {i // len(BRANDS) + 1}" for i in range(n)]
+
+
+def comment(rng: random.Random, samples: list[dict], tenant: str, product: str, days: int) -> dict:
+    sample = rng.choice(samples)
+    created = date.today() - timedelta(days=rng.randrange(days))
+    return {
+        "tenant": tenant,
+        "product": product,
+        "product_key": normalize_product(product),
+        "text": sample["text"],
+        "author": sample["author"],
+        "score": min(int(rng.paretovariate(1.1)), 50_000),
+        "created": created.isoformat(),
+        "created_at": datetime(created.year, created.month, created.day),
+        "prediction": sample["prediction"],
+    }
+
+
+def seed_users(products: list[str]) -> dict:
+    ids = {}
+    for role, (email, password) in BENCH_USERS.items():
+        user = {"email": email, "username": f"bench-{role}", "hashed_password": hash_password(password), "role": role}
+        if role == "enterprise":
+            user.update({"company_name": "Bench", "business_address": "-", "tax_id": "-", "tracked_products": products[:20]})
+        db_users.update_one({"email": email}, {"$set": user}, upsert=True)
+        ids[role] = str(db_users.find_one({"email": email})["_id"])
+    return ids
+
+
+def seed_comments(rng: random.Random, total: int, products: list[str], tenants: list[str], days: int) -> int:
+    samples = load_samples()
+    popularity = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(products))))
+    # Each private tenant crawls a few products of its own
+    tenant_products = {tenant: rng.sample(products, min(PRIVATE_PRODUCTS, len(products))) for tenant in tenants}
+    counts = {}
+    written = 0
+    started = time.perf_counter()
+    while written < total:
+        batch = []
+        for _ in range(min(BATCH_SIZE, total - written)):
+            # 70% shared comments, the rest spread over the tenants
+            if not tenants or rng.random() < 0.7:
+                tenant, product = SHARED_TENANT, rng.choices(products, cum_weights=popularity)[0]
+            else:
+                tenant = rng.choice(tenants)
+                product = rng.choice(tenant_products[tenant])
+            batch.append(comment(rng, samples, tenant, product, days))
+        db_comments.insert_many(batch, ordered=False)
+        for doc in batch:
+            counts.setdefault(doc["tenant"], Counter())[rollup_key(doc)] += 1
+        written += len(batch)
+        print(f"\r{written}/{total} comments ({written / (time.perf_counter() - started):.0f}/s)", end="", flush=True)
+    print()
+
+    for tenant, tenant_counts in counts.items():
+        ops = rollup_ops(tenant, tenant_counts)
+        for i in range(0, len(ops), 1000):
+            db_rollups.bulk_write(ops[i:i + 1000], ordered=False)
+    return written
+
+
+def seed_reports(n: int):
+    try:
+        with open(DRIFT_REPORT_FILE) as f:
+            report = json.load(f)
+    except OSError:
+        report = {"metrics": [], "tests": []}
+    now = datetime.utcnow()
+    for collection in (db_model, db_datadrift, db_datasummary):
+        collection.insert_many([{**report, "timestamp": now - timedelta(hours=i)} for i in range(n)])
+    db_alert.insert_many([
+        {
+            "timestamp": now - timedelta(hours=i),
+            "type": "data_drift",
+            "test_case": f"Drift check {i}",
+            "description": "Synthetic alert",
+            "status": ["FAIL", "WARNING", "SUCCESS"][i % 3],
+        }
+        for i in range(n)
+    ])
+
+
+def drop():
+    for collection in (db_comments, db_rollups, db["rollup_state"], db["bench_meta"], db_model, db_datadrift, db_datasummary, db_alert):
+        collection.drop()
+    db.client["reports"]["parsed_reports"].drop()
+    db.client["reports"]["metric_points"].drop()
+    db_users.delete_many({"email": {"$in": [email for email, _ in BENCH_USERS.values()]}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a local MongoDB with a synthetic comment corpus")
+    parser.add_argument("--size", choices=list(SIZES), default="10k")
+    parser.add_argument("--docs", type=int, help="Exact number of comments (overrides --size)")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--tenants", type=int, default=20, help="Private tenants besides the bench enterprise user")
+    parser.add_argument("--days", type=int, default=365, help="Spread comments over this many past days")
+    parser.add_argument("--reports", type=int, default=50, help="Monitor reports and alerts of each kind")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drop", action="store_true", help="Drop the comment, rollup and monitor collections first")
+    parser.add_argument("--force", action="store_true", help="Allow a MONGO_URI that does not look local")
+    args = parser.parse_args()
+
+    if not any(host in MONGO_URI for host in ("localhost", "127.0.0.1")) and not args.force:
+        raise SystemExit(f"Refusing to seed {MONGO_URI}, pass --force if this really is a scratch database")
+
+    if args.drop:
+        drop()
+    verify_indexes(create=True)
+
+    rng = random.Random(args.seed)
+    products = product_names(args.products)
+    users = seed_users(products)
+    tenants = [users["enterprise"]] + [f"bench-tenant-{i}" for i in range(args.tenants)]
+    total = args.docs or SIZES[args.size]
+    seed_comments(rng, total, products, tenants, args.days)
+    seed_reports(args.reports)
+
+    db["bench_meta"].replace_one({"_id": "seed"}, {
+        "docs": total,
+        "products": products,
+        "tenants": len(tenants),
+        "days": args.days,
+        "seed": args.seed,
+        "created": datetime.utcnow(),
+    }, upsert=True)
+    print(f"Seeded {total} comments for {len(products)} products and {len(tenants)} tenants. "
+          f"Flush Redis (or run bench.suite, which does) before benchmarking.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from datetime import datetime
+from urllib.parse import quote
+import httpx
+from database import MONGO_URI, REDIS_HOST, db, redis
+from cache import INVALIDATION_CHANNEL
+from bench.loadtest import login, summarize
+from bench.seed import BENCH_USERS
+
+# Drives every read route of /auth, /sentiment and /monitor against a
+# database seeded by bench.seed, first with the caches cold and then warm:
+#
+#   python -m bench.seed --size 1m --drop
+#   uvicorn main:app --workers 1 &
+#   python -m bench.suite run --concurrency 50 --duration 30 --out results/1m.json
+#   python -m bench.suite compare results/before.json results/after.json
+#
+# Cold: Redis is flushed (and every worker told to drop its local tier), then
+# each (route, product) request is sent exactly once, so every request pays
+# for its aggregation. Warm: the same requests are replayed in a closed loop
+# for --duration seconds. Logins are measured on their own since bcrypt
+# dominates them. Routes that write (register, ingest, track, crawl jobs)
+# are left out so runs stay comparable.
+
+ENTERPRISE_ROUTES = [
+    "/auth/me",
+    "/sentiment/summary?product={product}",
+    "/sentiment/top-comments?product={product}",
+    "/sentiment/comments?product={product}&limit=20",
+    "/sentiment/weekly?product={product}",
+    "/sentiment/monthly?product={product}",
+    "/sentiment/timeseries?product={product}&granularity=week",
+    "/sentiment/dashboard?products={product}",
+    "/sentiment/compare",
+    "/sentiment/tracked-products",
+]
+ADMIN_ROUTES = [
+    "/monitor/model?fields=timestamp",
+    "/monitor/dataset-drift?fields=timestamp",
+    "/monitor/dataset-summary?fields=timestamp",
+    "/monitor/alerts",
+    "/monitor/snapshot",
+    "/monitor/reports?kind=data-drift",
+    "/monitor/metrics?kind=model",
+    "/monitor/metrics/series?metric_id=Accuracy()",
+    "/monitor/cache-stats",
+]
+
+
+# (route template, path) for every route, once per product where it takes one
+def expand(routes: list[str], products: list[str]) -> list[tuple[str, str]]:
+    requests = []
+    for route in routes:
+        if "{product}" in route:
+            requests.extend((route, route.format(product=quote(p))) for p in products)
+        else:
+            requests.append((route, route))
+    return requests
+
+
+async def drive(
+    base_url: str, token: str, requests: list[tuple[str, str]], concurrency: int, duration: float | None = None
+) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+    routes = list(dict.fromkeys(route for route, _ in requests))
+    latencies = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    queue = list(requests)
+    random.shuffle(queue)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as http:
+        deadline = time.perf_counter() + duration if duration else None
+        position = 0
+
+        async def worker():
+            nonlocal position
+            while True:
+                if deadline is None:
+                    # Cold: every request exactly once
+                    if position >= len(queue):
+                        return
+                elif time.perf_counter() >= deadline:
+                    return
+                route, path = queue[position % len(queue)]
+                position += 1
+                start = time.perf_counter()
+                try:
+                    res = await http.get(path)
+                    if res.status_code >= 400:
+                        errors[route] += 1
+                        continue
+                except httpx.HTTPError:
+                    errors[route] += 1
+                    continue
+                latencies[route].append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [l for values in latencies.values() for l in values]
+    return {
+        "duration_s": round(elapsed, 2),
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "routes": {route: summarize(latencies[route], errors[route], elapsed) for route in routes},
+    }
+
+
+async def drive_logins(base_url: str, concurrency: int, count: int) -> dict:
+    email, password = BENCH_USERS["enterprise"]
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+        async def worker(n: int):
+            nonlocal errors
+            for _ in range(n):
+                start = time.perf_counter()
+                try:
+                    await login(http, email, password)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(count // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"duration_s": round(elapsed, 2), "total": summarize(latencies, errors, elapsed)}
+
+
+def flush_caches():
+    redis.flushdb()
+    redis.publish(INVALIDATION_CHANNEL, "*")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_result(name: str, result: dict):
+    total = result["total"]
+    print(f"{name}: {total['requests']} requests, {total['rps']} req/s, p50 {total['p50_ms']}ms, "
+          f"p95 {total['p95_ms']}ms, p99 {total['p99_ms']}ms, {total['errors']} errors")
+    for route, stats in result.get("routes", {}).items():
+        print(f"  {route}: p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms, p99 {stats['p99_ms']}ms, {stats['errors']} errors")
+
+
+async def run(args) -> dict:
+    seed = db["bench_meta"].find_one({"_id": "seed"})
+    if not seed:
+        raise SystemExit("No bench_meta.seed document, run python -m bench.seed first")
+    products = seed["products"][:args.products]
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as http:
+        tokens = {role: await login(http, email, password) for role, (email, password) in BENCH_USERS.items()}
+
+    groups = {
+        "enterprise": (tokens["enterprise"], expand(ENTERPRISE_ROUTES, products)),
+        "admin": (tokens["admin"], expand(ADMIN_ROUTES, products)),
+    }
+    results = {}
+    for name, (token, requests) in groups.items():
+        flush_caches()
+        # Give the workers' invalidation listeners a moment to drop their local tier
+        await asyncio.sleep(0.5)
+        cold = await drive(args.base_url, token, requests, args.concurrency)
+        print_result(f"{name} cold", cold)
+        warm = await drive(args.base_url, token, requests, args.concurrency, args.duration)
+        print_result(f"{name} warm", warm)
+        results[name] = {"cold": cold, "warm": warm}
+
+    results["login"] = await drive_logins(args.base_url, args.login_concurrency, args.logins)
+    print_result("login", results["login"])
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started": datetime.utcnow().isoformat(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "products": len(products),
+            "dataset": {k: seed[k] for k in ("docs", "tenants", "days", "seed")},
+        },
+        "results": results,
+    }
+
+
+# {"a": {"b": {"p50_ms": ...}}} -> {"a / b": {"p50_ms": ...}}
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        name = f"{prefix} / {key}" if prefix else key
+        if "p50_ms" in value:
+            flat[name] = value
+        else:
+            flat.update(flatten(value, name))
+    return flat
+
+
+def compare(before_file: str, after_file: str):
+    with open(before_file) as f:
+        before = flatten(json.load(f)["results"])
+    with open(after_file) as f:
+        after = flatten(json.load(f)["results"])
+    print(f"{'':60} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    for name in sorted(set(before) & set(after)):
+        cells = []
+        for stat in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = before[name][stat], after[name][stat]
+            change = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+            cells.append(f"{old:>7} > {new:<7} {change:>5}")
+        print(f"{name[:60]:60} {' '.join(cells)}")
+    for name in sorted(set(before) ^ set(after)):
+        print(f"{name}: only in {'the first' if name in before else 'the second'} run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API routes against a seeded database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="Run the suite and report p50/p95/p99 per route, cache cold and warm")
+    p_run.add_argument("--base-url", default="http://localhost:8000")
+    p_run.add_argument("--concurrency", type=int, default=50)
+    p_run.add_argument("--duration", type=float, default=30.0, help="Seconds of warm traffic per group")
+    p_run.add_argument("--products", type=int, default=50, help="Most popular products to spread requests over")
+    p_run.add_argument("--logins", type=int, default=200)
+    p_run.add_argument("--login-concurrency", type=int, default=10)
+    p_run.add_argument("--out", help="Write the result as JSON to this file")
+    p_run.add_argument("--force", action="store_true", help="Allow flushing a Redis/Mongo that does not look local")
+
+    p_compare = sub.add_parser("compare", help="Compare two result files")
+    p_compare.add_argument("before")
+    p_compare.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.before, args.after)
+        return
+
+    local = all(any(host in uri for host in ("localhost", "127.0.0.1")) for uri in (MONGO_URI, REDIS_HOST))
+    if not local and not args.force:
+        raise SystemExit(f"Refusing to flush Redis at {REDIS_HOST}, pass --force if this is a scratch setup")
+    result = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from functools import partial
+from typing import Awaitable, Callable, Optional
+from database import aredis, aredis_raw, redis
+from codec import Entry, pack_entry, unpack_entry, pack_document, unpack_document
+
+# Cached aggregates are scoped and versioned:
+#
+#   <family>:<scope>:<product_key>:<shared gen>.<tenant gen>
+#
+# scope is "shared" for users that cannot own private crawl data and
+# "t:<user_id>" for enterprise/admin users, whose results merge in their
+# private comments. Results over several products (a portfolio) are stored
+# once under
+#
+#   <family>:<scope>:portfolio:<hash of the product keys and their gens>
+#
+# Every entry embeds the current generation of
+# the tags it depends on, so bumping a generation (one INCR) orphans exactly
+# the affected entries; they are never read again and expire on their TTL.
+#
+#   gen:p:<product_key>              shared comments of a product changed
+#   gen:t:<tenant>:p:<product_key>   a tenant's private comments changed
+#
+# Values are stored in the binary format of codec.py. Each worker keeps a
+# bounded in-process LRU in front of Redis for user documents, generations
+# and hot aggregates. Invalidations are published on
+# INVALIDATION_CHANNEL so every worker drops its local copy.
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+# Fresh lifetimes are shortened by up to this fraction so entries written
+# together do not all expire together
+CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", "0.1"))
+# Stale-while-revalidate: serve an expired entry for up to CACHE_STALE_TTL
+# seconds while a single background task refreshes it
+CACHE_SWR = os.getenv("CACHE_SWR", "1") == "1"
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "600"))
+# How long a recompute may hold the cross-worker lock, and how long other
+# workers wait for its result before computing it themselves
+CACHE_LOCK_TIMEOUT = int(os.getenv("CACHE_LOCK_TIMEOUT", "30"))
+CACHE_WAIT_TIMEOUT = float(os.getenv("CACHE_WAIT_TIMEOUT", "5"))
+
+SHARED_SCOPE = "shared"
+SHARED_TENANT = "shared"
+
+# In-process tier: entry/size bounds, and a TTL that caps staleness should
+# an invalidation message be missed
+LOCAL_CACHE_ENTRIES = int(os.getenv("LOCAL_CACHE_ENTRIES", "10000"))
+LOCAL_CACHE_BYTES = int(os.getenv("LOCAL_CACHE_BYTES", str(64 * 1024 * 1024)))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "60"))
+INVALIDATION_CHANNEL = "cache:invalidate"
+USER_TTL = 3600
+
+STAT_EVENTS = ("hits", "local_hits", "misses", "stale", "coalesced", "prewarmed")
+# (family, event) -> count, for this worker
+stats = Counter()
+# (tenant, product_key) -> reads since this worker last flushed them to the
+# prewarm scheduler, for at most MAX_ACCESS_KEYS pairs
+accesses = Counter()
+MAX_ACCESS_KEYS = int(os.getenv("MAX_ACCESS_KEYS", "10000"))
+_inflight: dict[str, asyncio.Task] = {}
+# The tasks of _inflight started by a background refresh. They return None
+# when another worker holds the lock, so callers waiting for a value do not
+# share them.
+_background: set[asyncio.Task] = set()
+
+
+class LocalCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[2]
+
+    def set(self, key: str, value, size: int = 1, ttl: Optional[float] = None):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), size, value)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: str):
+        self.size -= self._entries.pop(key)[1]
+
+
+local_cache = LocalCache(LOCAL_CACHE_ENTRIES, LOCAL_CACHE_BYTES, LOCAL_CACHE_TTL)
+
+
+def tenant_of(user: Optional[dict]) -> Optional[str]:
+    if user and user.get("role") in ("enterprise", "admin"):
+        return str(user["_id"])
+    return None
+
+
+def generation_key(product_key: str, tenant: str = SHARED_TENANT) -> str:
+    if tenant == SHARED_TENANT:
+        return f"gen:p:{product_key}"
+    return f"gen:t:{tenant}:p:{product_key}"
+
+
+def generation_keys(product_key: str, tenant: Optional[str]) -> list[str]:
+    keys = [generation_key(product_key)]
+    if tenant:
+        keys.append(generation_key(product_key, tenant))
+    return keys
+
+
+# variant tells apart entries of one family that take extra parameters
+async def entry_keys(family: str, product_keys: list[str], user: Optional[dict], variant: str = "") -> list[str]:
+    tenant = tenant_of(user)
+    scope = f"t:{tenant}" if tenant else SHARED_SCOPE
+    per_product = [generation_keys(product_key, tenant) for product_key in product_keys]
+    gens = await get_generations([key for keys in per_product for key in keys])
+
+    entries = []
+    i = 0
+    for product_key, keys in zip(product_keys, per_product):
+        version = ".".join(g or "0" for g in gens[i:i + len(keys)])
+        i += len(keys)
+        entries.append(f"{family}:{scope}:{product_key}:{version}" + (f":{variant}" if variant else ""))
+    return entries
+
+
+async def portfolio_key(family: str, product_keys: list[str], user: Optional[dict], variant: str = "") -> str:
+    tenant = tenant_of(user)
+    scope = f"t:{tenant}" if tenant else SHARED_SCOPE
+    per_product = [generation_keys(product_key, tenant) for product_key in product_keys]
+    gens = await get_generations([key for keys in per_product for key in keys])
+    digest = hashlib.sha1("\x1f".join(product_keys + [".".join(g or "0" for g in gens), variant]).encode()).hexdigest()
+    return f"{family}:{scope}:portfolio:{digest}"
+
+
+async def get_generations(keys: list[str]) -> list:
+    gens = [local_cache.get(key) for key in keys]
+    missing = [i for i, gen in enumerate(gens) if gen is None]
+    if missing:
+        fetched = await aredis.mget([keys[i] for i in missing])
+        for i, gen in zip(missing, fetched):
+            gens[i] = gen or "0"
+            local_cache.set(keys[i], gens[i])
+    return gens
+
+
+def cache_stats() -> dict:
+    output = {}
+    for (family, event), n in stats.items():
+        output.setdefault(family, {e: 0 for e in STAT_EVENTS})[event] = n
+    output["local"] = {"entries": len(local_cache), "bytes": local_cache.size}
+    return output
+
+
+def _jittered(ttl: int) -> int:
+    return max(1, int(ttl * (1 - CACHE_TTL_JITTER * random.random())))
+
+
+# Entries stay in Redis for CACHE_STALE_TTL seconds past fresh_until so they
+# can be served stale
+async def _store(key: str, value, ttl: int) -> Entry:
+    fresh_for = _jittered(ttl)
+    entry = Entry.of(value, fresh_for)
+    await aredis_raw.set(key, pack_entry(entry), ex=fresh_for + CACHE_STALE_TTL)
+    local_cache.set(key, entry, len(entry.body))
+    return entry
+
+
+# Recompute one entry. Across workers only the holder of lock:<key> runs the
+# aggregation; the others poll for its result for up to CACHE_WAIT_TIMEOUT.
+async def _recompute(family: str, key: str, compute: Callable[[], Awaitable], ttl: int, wait: bool = True):
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+    if await aredis.set(lock_key, token, nx=True, px=CACHE_LOCK_TIMEOUT * 1000):
+        try:
+            return await _store(key, await compute(), ttl)
+        finally:
+            if await aredis.get(lock_key) == token:
+                await aredis.delete(lock_key)
+
+    if not wait:
+        # Background refresh: whoever holds the lock is already refreshing
+        return None
+    stats[(family, "coalesced")] += 1
+    deadline = time.monotonic() + CACHE_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entry = unpack_entry(await aredis_raw.get(key))
+        if entry and entry.fresh():
+            return entry
+    return Entry.of(await compute(), 0)
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        print(f"Cache refresh failed: {task.exception()}")
+
+
+# A follow-up task may have replaced the finished one in _inflight
+def _forget(key: str, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+
+
+# A waiting caller that finds a background refresh in flight lets it finish,
+# then recomputes (or waits on the lock holder) if it gave up
+async def _after_background(family: str, key: str, background: asyncio.Task, compute: Callable[[], Awaitable], ttl: int):
+    entry = await asyncio.shield(background)
+    return entry or await _recompute(family, key, compute, ttl)
+
+
+# Within a process, concurrent requests for the same key share one task
+def _single_flight(family: str, key: str, compute: Callable[[], Awaitable], ttl: int, wait: bool = True) -> asyncio.Task:
+    task = _inflight.get(key)
+    if task is not None and not (wait and task in _background):
+        if wait:
+            stats[(family, "coalesced")] += 1
+        return task
+    if task is not None:
+        task = asyncio.ensure_future(_after_background(family, key, task, compute, ttl))
+    else:
+        task = asyncio.ensure_future(_recompute(family, key, compute, ttl, wait))
+    if not wait:
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    _inflight[key] = task
+    task.add_done_callback(partial(_forget, key))
+    task.add_done_callback(_log_failure)
+    return task
+
+
+# Return the cached value for each key. Misses are computed concurrently
+# (once per key), stale entries are served while one refresh runs in the
+# background when CACHE_SWR is on. With raw=True the values are returned as
+# their JSON (orjson.Fragment), ready to be put in a FastJSONResponse.
+async def cached_keys(
+    family: str, keys: list[str], computes: list[Callable[[], Awaitable]], ttl: int, raw: bool = False
+) -> list:
+    entries = [local_cache.get(key) for key in keys]
+    local = {i for i, entry in enumerate(entries) if entry and entry.fresh()}
+    remote = [i for i in range(len(keys)) if i not in local]
+    if remote:
+        stored = await aredis_raw.mget([keys[i] for i in remote])
+        for i, value in zip(remote, stored):
+            entries[i] = unpack_entry(value)
+            if entries[i] and entries[i].fresh():
+                local_cache.set(keys[i], entries[i], len(entries[i].body))
+
+    pending = {}
+    for i, (key, entry, recompute) in enumerate(zip(keys, entries, computes)):
+        if i in local:
+            stats[(family, "local_hits")] += 1
+        elif entry and entry.fresh():
+            stats[(family, "hits")] += 1
+        elif entry and CACHE_SWR:
+            stats[(family, "stale")] += 1
+            _single_flight(family, key, recompute, ttl, wait=False)
+        else:
+            stats[(family, "misses")] += 1
+            pending[i] = _single_flight(family, key, recompute, ttl)
+
+    results = await asyncio.gather(*(asyncio.shield(task) for task in pending.values()))
+    for i, entry in zip(pending, results):
+        entries[i] = entry
+    return [entry.fragment() if raw else entry.value for entry in entries]
+
+
+# Pairs first read after the counter is full are dropped until the next flush
+def count_accesses(tenant: str, product_keys: list[str]):
+    for product_key in product_keys:
+        if (tenant, product_key) in accesses or len(accesses) < MAX_ACCESS_KEYS:
+            accesses[(tenant, product_key)] += 1
+
+
+async def cached_many(
+    family: str,
+    product_keys: list[str],
+    user: Optional[dict],
+    compute: Callable[[str], Awaitable],
+    ttl: int = CACHE_TTL,
+    variant: str = "",
+    raw: bool = False,
+) -> list:
+    tenant = tenant_of(user)
+    if tenant:
+        count_accesses(tenant, product_keys)
+    keys = await entry_keys(family, product_keys, user, variant)
+    return await cached_keys(family, keys, [partial(compute, product_key) for product_key in product_keys], ttl, raw)
+
+
+# One entry for a whole set of products, recomputed when any of them changes
+async def cached_portfolio(
+    family: str,
+    product_keys: list[str],
+    user: Optional[dict],
+    compute: Callable[[], Awaitable],
+    ttl: int = CACHE_TTL,
+    variant: str = "",
+    raw: bool = False,
+):
+    key = await portfolio_key(family, product_keys, user, variant)
+    values = await cached_keys(family, [key], [compute], ttl, raw)
+    return values[0]
+
+
+async def cached(
+    family: str,
+    product_key: str,
+    user: Optional[dict],
+    compute: Callable[[], Awaitable],
+    ttl: int = CACHE_TTL,
+    variant: str = "",
+    raw: bool = False,
+):
+    values = await cached_many(family, [product_key], user, lambda _: compute(), ttl, variant, raw)
+    return values[0]
+
+
+# Recompute an entry ahead of time if it is missing or goes stale within
+# `ahead` seconds. Returns whether it was recomputed here; False when it was
+# still fresh or another worker holds its lock.
+async def refresh(
+    family: str,
+    product_key: str,
+    user: Optional[dict],
+    compute: Callable[[], Awaitable],
+    ahead: float,
+    ttl: int = CACHE_TTL,
+) -> bool:
+    [key] = await entry_keys(family, [product_key], user)
+    entry = local_cache.get(key) or unpack_entry(await aredis_raw.get(key))
+    if entry and entry.fresh_until - time.time() > ahead:
+        return False
+    if await _single_flight(family, key, compute, ttl, wait=False) is None:
+        return False
+    stats[(family, "prewarmed")] += 1
+    return True
+
+
+# Invalidate every cached entry that depends on a product's shared comments
+# (tenant=None) or on one tenant's private comments of that product
+async def invalidate(product_key: str, tenant: Optional[str] = None):
+    key = generation_key(product_key, tenant or SHARED_TENANT)
+    await aredis.incr(key)
+    await drop_local(key)
+
+
+# Same, for the blocking tools (rollup tailer, CLIs)
+def invalidate_sync(product_key: str, tenant: Optional[str] = None):
+    key = generation_key(product_key, tenant or SHARED_TENANT)
+    redis.incr(key)
+    redis.publish(INVALIDATION_CHANNEL, key)
+
+
+# ---- User documents ----
+
+def user_key(email: str) -> str:
+    return f"user:{email.lower()}"
+
+
+async def get_user(email: str) -> Optional[dict]:
+    key = user_key(email)
+    user = local_cache.get(key)
+    if user is not None:
+        stats[("user", "local_hits")] += 1
+        return dict(user)
+    raw = await aredis_raw.get(key)
+    user = unpack_document(raw)
+    if user is None:
+        stats[("user", "misses")] += 1
+        return None
+    stats[("user", "hits")] += 1
+    local_cache.set(key, user, len(raw))
+    return dict(user)
+
+
+async def set_user(user: dict):
+    key = user_key(user["email"])
+    raw = pack_document(user)
+    await aredis_raw.set(key, raw, ex=USER_TTL)
+    local_cache.set(key, user, len(raw))
+
+
+# Call after anything that changes the user document (profile, password,
+# tracked products) or on logout
+async def invalidate_user(email: str):
+    key = user_key(email)
+    await aredis.delete(key)
+    await drop_local(key)
+
+
+# ---- Cross-worker invalidation ----
+
+# Drop a key from this worker's local tier and tell the other workers to do the same
+async def drop_local(key: str):
+    local_cache.delete(key)
+    await aredis.publish(INVALIDATION_CHANNEL, key)
+
+
+def listen_for_invalidations(stop: threading.Event):
+    while not stop.is_set():
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages may have been missed while (re)connecting
+            local_cache.clear()
+            while not stop.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message and message["type"] == "message":
+                    if message["data"] == "*":
+                        local_cache.clear()
+                    else:
+                        local_cache.delete(message["data"])
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+            local_cache.clear()
+            stop.wait(1)
+        finally:
+            pubsub.close()
+
+
+def start_invalidation_listener(stop: threading.Event):
+    threading.Thread(target=listen_for_invalidations, args=(stop,), daemon=True).start()
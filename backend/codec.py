@@ -0,0 +1,192 @@
+import os
+import struct
+import time
+import anyio
+import brotli
+import bson
+import orjson
+import zstandard
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+from metrics import timed
+
+# How cached values and responses are encoded.
+#
+# Cached aggregates are kept as the JSON bytes of their value, so a cache hit
+# can be sent as-is (orjson.Fragment) instead of being decoded and encoded
+# again. In Redis an entry is
+#
+#   b"j" <fresh_until, 8-byte double> <JSON>
+#   b"z" <fresh_until, 8-byte double> <zstd(JSON)>   JSON of CACHE_COMPRESS_MIN bytes or more
+#
+# and a user document is b"b" <BSON>, which keeps ObjectIds and datetimes.
+# Anything else in a cache key is treated as a miss.
+
+# zstd-compress cached JSON from this many bytes on, 0 turns it off
+CACHE_COMPRESS_MIN = int(os.getenv("CACHE_COMPRESS_MIN", "4096"))
+CACHE_ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+# Responses from this size on are compressed when the client accepts it,
+# brotli preferred over gzip
+RESPONSE_COMPRESS_MIN = int(os.getenv("RESPONSE_COMPRESS_MIN", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+JSON_ENTRY = b"j"
+ZSTD_ENTRY = b"z"
+BSON_DOCUMENT = b"b"
+HEADER = struct.Struct("<d")
+
+# Only used from the event loop thread
+_compressor = zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+_missing = object()
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+loads = orjson.loads
+
+
+# One cached value: its JSON bytes, decoded only when somebody needs the object
+class Entry:
+    __slots__ = ("body", "fresh_until", "_value")
+
+    def __init__(self, body: bytes, fresh_until: float, value=_missing):
+        self.body = body
+        self.fresh_until = fresh_until
+        self._value = value
+
+    @classmethod
+    def of(cls, value, fresh_for: float) -> "Entry":
+        with timed("cache_encode"):
+            body = dumps(value)
+        return cls(body, time.time() + fresh_for, value)
+
+    @property
+    def value(self):
+        if self._value is _missing:
+            self._value = loads(self.body)
+        return self._value
+
+    def fragment(self) -> orjson.Fragment:
+        return orjson.Fragment(self.body)
+
+    def fresh(self) -> bool:
+        return self.fresh_until > time.time()
+
+
+def pack_entry(entry: Entry) -> bytes:
+    if CACHE_COMPRESS_MIN and len(entry.body) >= CACHE_COMPRESS_MIN:
+        return ZSTD_ENTRY + HEADER.pack(entry.fresh_until) + _compressor.compress(entry.body)
+    return JSON_ENTRY + HEADER.pack(entry.fresh_until) + entry.body
+
+
+def unpack_entry(raw):
+    if not raw:
+        return None
+    marker = raw[:1]
+    if marker in (JSON_ENTRY, ZSTD_ENTRY):
+        (fresh_until,) = HEADER.unpack_from(raw, 1)
+        body = raw[1 + HEADER.size:]
+        return Entry(_decompressor.decompress(body) if marker == ZSTD_ENTRY else body, fresh_until)
+    return None
+
+
+def pack_document(doc: dict) -> bytes:
+    return BSON_DOCUMENT + bson.encode(doc)
+
+
+def unpack_document(raw):
+    if raw and raw[:1] == BSON_DOCUMENT:
+        return bson.decode(raw[1:])
+    return None
+
+
+# JSONResponse rendered by orjson. Cached values passed as orjson.Fragment
+# are copied into the body without being parsed.
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return dumps(content)
+
+
+# ---- Response compression ----
+
+# Whether an Accept-Encoding header allows this coding (q=0 refuses it)
+def accepts(accept_encoding: str, coding: str) -> bool:
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int, thread_minimum_size: int, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self.compressor = brotli.Compressor(quality=quality)
+        self.thread_minimum_size = thread_minimum_size
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= self.thread_minimum_size:
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if more_body:
+            return self.compressor.process(body) + self.compressor.flush()
+        return self.compressor.process(body) + self.compressor.finish()
+
+
+# A response that may be compressed depends on Accept-Encoding. Its ETag is
+# kept for the identity body and made weak for the compressed ones, so caches
+# never take a gzip and a brotli body for the same bytes.
+def vary_on_encoding(send):
+    async def wrapped(message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(scope=message)
+            vary = [v.strip().lower() for v in headers.get("vary", "").split(",") if v.strip()]
+            if "accept-encoding" not in vary:
+                headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and headers.get("content-encoding") and not etag.startswith("W/"):
+                headers["etag"] = "W/" + etag
+        await send(message)
+    return wrapped
+
+
+# Starlette's GZipMiddleware, answering with brotli when the client takes it.
+# Event streams are left alone. IdentityResponder and apply_compression are
+# Starlette internals, hence the starlette pin in requirements.txt.
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(
+        self, app, minimum_size: int = RESPONSE_COMPRESS_MIN, gzip_level: int = GZIP_LEVEL,
+        brotli_quality: int = BROTLI_QUALITY
+    ):
+        super().__init__(app, minimum_size, compresslevel=gzip_level)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            send = vary_on_encoding(send)
+        if scope["type"] == "http" and accepts(Headers(scope=scope).get("accept-encoding", ""), "br"):
+            responder = BrotliResponder(
+                self.app, self.minimum_size, self.brotli_quality, self.thread_minimum_size,
+                exclude_content_types=self.exclude_content_types,
+            )
+            await responder(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -1,7 +1,10 @@
 import os
-import redis as redis_py
-from pymongo import MongoClient
+import redis.asyncio as aioredis
+from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from aio import ThreadedClient, ThreadedRedis
+from metrics import MongoCommandTimer, TimedRedis, TimedAsyncRedis
 
 try:
     print("Loading environment vars")
@@ -16,11 +19,63 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis-master.redis.svc.cluster.local")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "password")
 
+# ASYNC_IO=1 serves the routes from Motor + redis.asyncio, ASYNC_IO=0 runs
+# the blocking clients on the threadpool (kept for throughput comparisons)
+ASYNC_IO = os.getenv("ASYNC_IO", "1") == "1"
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "100"))
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "100"))
+
+# ENSURE_INDEXES=0 only reports missing indexes at startup instead of building them
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "1") == "1"
+
+# Comments of every tenant live in one collection; each query is scoped to one
+# tenant or to {"$in": ["shared", <user_id>]}, so every index starts with it
+COMMENT_INDEXES = {
+    "tenant_product_prediction_created_at": [("tenant", ASCENDING), ("product_key", ASCENDING), ("prediction", ASCENDING), ("created_at", ASCENDING)],
+    "tenant_product_score_id": [("tenant", ASCENDING), ("product_key", ASCENDING), ("score", DESCENDING), ("_id", DESCENDING)],
+    "tenant_product_created_at": [("tenant", ASCENDING), ("product_key", ASCENDING), ("created_at", DESCENDING)],
+    # Tails new public comments (sentiment/trending.py)
+    "tenant_inserted_at_id": [("tenant", ASCENDING), ("inserted_at", ASCENDING), ("_id", ASCENDING)],
+    # Full-text search within a product (sentiment/search.py). Fields before a
+    # text index need an equality match, so this one starts at product_key and
+    # the tenants are filtered after it.
+    "product_text": [("product_key", ASCENDING), ("text", TEXT)],
+    # De-duplicates ingested comments (sentiment/ingest.py)
+    "tenant_content_hash": [("tenant", ASCENDING), ("content_hash", ASCENDING)],
+}
+ROLLUP_INDEXES = {
+    "tenant_product_day_prediction": [("tenant", ASCENDING), ("product_key", ASCENDING), ("day", ASCENDING), ("prediction", ASCENDING)],
+}
+# Raw monitor reports and alerts, always read newest first
+MONITOR_INDEXES = {
+    "timestamp_desc": [("timestamp", DESCENDING)],
+}
+# Parsed monitor reports (monitor/reports.py)
+REPORT_INDEXES = {
+    "kind_timestamp": [("kind", ASCENDING), ("timestamp", DESCENDING)],
+    "kind_id": [("kind", ASCENDING), ("_id", DESCENDING)],
+}
+METRIC_POINT_INDEXES = {
+    "metric_label_timestamp": [("metric_id", ASCENDING), ("label", ASCENDING), ("timestamp", ASCENDING)],
+    "column_name_timestamp": [("column", ASCENDING), ("name", ASCENDING), ("timestamp", ASCENDING)],
+}
+INDEX_OPTIONS = {
+    "tenant_product_day_prediction": {"unique": True},
+    # Crawled comments may carry a "language" field Mongo doesn't know
+    "product_text": {"default_language": "english", "language_override": "text_language"},
+    # Comments written by the crawler have no hash
+    "tenant_content_hash": {"unique": True, "partialFilterExpression": {"content_hash": {"$exists": True}}},
+}
+
 try:
-    client = MongoClient(MONGO_URI)
+    client = MongoClient(MONGO_URI, maxPoolSize=MONGO_POOL_SIZE, event_listeners=[MongoCommandTimer()])
     db = client["main"]
     db_users = db["users"]
-    db_reddits = db["reddits"]
+    db_comments = db["comments"]
+
+    # Pre-aggregated per-(product, day, prediction) counts
+    db_rollups = db["sentiment_rollups"]
+    db_rollup_state = db["rollup_state"]
 
     # Model monitoring database
     dbr = client["reports"]
@@ -28,17 +83,95 @@ try:
     db_datadrift = dbr["data_drift"]
     db_alert = dbr["alerts"]
     db_datasummary = dbr["dataset_summary"]
-    
+    db_parsed_reports = dbr["parsed_reports"]
+    db_metric_points = dbr["metric_points"]
+
     print("Connected to MongoDB: ", client)
 
     # Connect to Redis (use environment variable or secrets for password)
-    redis = redis_py.Redis(
+    redis = TimedRedis(
         host=REDIS_HOST,
         port=REDIS_PORT,
         password=REDIS_PASSWORD,
         decode_responses=True  # Automatically decode UTF-8
     )
     print("Connected to Redis: ", redis)
+    # Same server, without decoding: cached values are binary (codec.py)
+    redis_raw = TimedRedis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD)
+
+    # Async handles used by the API routes, sharing one pool per process
+    if ASYNC_IO:
+        aclient = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MONGO_POOL_SIZE, event_listeners=[MongoCommandTimer()])
+        aredis = TimedAsyncRedis(
+            connection_pool=aioredis.BlockingConnectionPool(
+                max_connections=REDIS_POOL_SIZE,
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                password=REDIS_PASSWORD,
+                decode_responses=True
+            )
+        )
+        aredis_raw = TimedAsyncRedis(
+            connection_pool=aioredis.BlockingConnectionPool(
+                max_connections=REDIS_POOL_SIZE,
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                password=REDIS_PASSWORD
+            )
+        )
+    else:
+        aclient = ThreadedClient(client)
+        aredis = ThreadedRedis(redis)
+        aredis_raw = ThreadedRedis(redis_raw)
+
+    adb = aclient["main"]
+    adb_users = adb["users"]
+    adb_comments = adb["comments"]
+    adb_rollups = adb["sentiment_rollups"]
+
+    adbr = aclient["reports"]
+    adb_model = adbr["model_drift"]
+    adb_datadrift = adbr["data_drift"]
+    adb_alert = adbr["alerts"]
+    adb_datasummary = adbr["dataset_summary"]
+    adb_parsed_reports = adbr["parsed_reports"]
+    adb_metric_points = adbr["metric_points"]
+    print(f"Async I/O: {'motor + redis.asyncio' if ASYNC_IO else 'threadpool'}")
 
 except Exception as e:
     print(f"An error occurred: {e}")
+
+
+async def close_async_clients():
+    aclient.close()
+    await aredis.close()
+    await aredis_raw.close()
+
+
+# The crawler still writes to reddits / reddits_<user_id>; the rollup tailer
+# copies those comments into `comments`
+def legacy_comment_collections() -> list[str]:
+    names = db.list_collection_names(filter={"name": {"$regex": "^reddits(_.+)?$"}})
+    return sorted(names)
+
+
+def verify_indexes(create: bool = ENSURE_INDEXES) -> list[str]:
+    expected = [(db_comments, COMMENT_INDEXES)]
+    expected.append((db_rollups, ROLLUP_INDEXES))
+    expected.extend((collection, MONITOR_INDEXES) for collection in (db_model, db_datadrift, db_alert, db_datasummary))
+    expected.append((db_parsed_reports, REPORT_INDEXES))
+    expected.append((db_metric_points, METRIC_POINT_INDEXES))
+
+    missing = []
+    for collection, indexes in expected:
+        existing = collection.index_information()
+        for name, keys in indexes.items():
+            if name in existing:
+                continue
+            if create:
+                collection.create_index(keys, name=name, **INDEX_OPTIONS.get(name, {}))
+                print(f"Created index {collection.name}.{name}")
+            else:
+                missing.append(f"{collection.name}.{name}")
+                print(f"Missing index {collection.name}.{name}")
+    return missing
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from typing import Optional
+import asyncio
+import json
+import os
+import secrets
+from auth.utils import get_current_user, user_by_email
+from database import aredis
+from events.utils import hub, channels_for, HubFull
+from sentiment.rollups import normalize_product
+
+router = APIRouter()
+
+HEARTBEAT_INTERVAL = 15
+MAX_STREAM_PRODUCTS = 50
+# Lifetime of a stream ticket, which is only good for opening one stream
+STREAM_TICKET_TTL = int(os.getenv("STREAM_TICKET_TTL", "30"))
+
+optional_oauth2 = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
+
+
+def ticket_key(ticket: str) -> str:
+    return f"stream-ticket:{ticket}"
+
+
+# EventSource can't send headers, and a bearer token in the URL ends up in
+# access logs and browser history. The client trades its token for a
+# short-lived, single-use ticket and opens the stream with ?ticket=.
+@router.post("/ticket")
+async def create_ticket(user = Depends(get_current_user)):
+    ticket = secrets.token_urlsafe(32)
+    await aredis.set(ticket_key(ticket), user["email"], ex=STREAM_TICKET_TTL)
+    return {"ticket": ticket, "expires_in": STREAM_TICKET_TTL}
+
+
+# Clients that can set headers may still use the bearer header
+async def get_stream_user(
+    header_token: Optional[str] = Depends(optional_oauth2),
+    ticket: Optional[str] = Query(None)
+):
+    if header_token:
+        return await get_current_user(header_token)
+    if not ticket:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    email = await aredis.getdel(ticket_key(ticket))
+    if email is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    return await user_by_email(email)
+
+
+def sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+# Server-Sent Events for the user's crawl jobs, their tracked products (plus
+# any ?products= being viewed) and, for admins, new monitor alerts
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    products: list[str] = Query([], max_length=MAX_STREAM_PRODUCTS),
+    user = Depends(get_stream_user)
+):
+    tracked = user.get("tracked_products") or []
+    product_keys = {normalize_product(p) for p in products + tracked if p.strip()}
+    if hub.full():
+        raise HTTPException(status_code=503, detail="Too many event streams on this server", headers={"Retry-After": "30"})
+
+    # Subscribed only once the body is iterated, so a response that is never
+    # sent doesn't leave its subscriber behind
+    async def body():
+        try:
+            subscriber = hub.subscribe(channels_for(user, sorted(product_keys)))
+        except HubFull:
+            return
+        try:
+            yield sse({"type": "ready", "products": sorted(product_keys)})
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield sse(event)
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import threading
+from pymongo import DESCENDING
+from database import redis, aredis, adb_alert
+
+# Push channel for dashboards and the Monitor page. Producers publish JSON
+# events on Redis channels:
+#
+#   events:user:<user_id>       a user's crawl jobs and private sentiment updates
+#   events:product:<product_key> shared sentiment for a product changed
+#   events:alerts               a new monitor alert (admins only)
+#
+# Each API worker holds one pattern subscription and fans the events out to
+# its SSE connections. Alerts are written by the monitoring pipeline rather
+# than by this app, so every worker polls the newest alert _id instead.
+
+MAX_EVENT_CONNECTIONS = int(os.getenv("MAX_EVENT_CONNECTIONS", "1000"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+ALERT_POLL_INTERVAL = float(os.getenv("ALERT_POLL_INTERVAL", "5"))
+
+CHANNEL_PREFIX = "events:"
+ALERTS_CHANNEL = "events:alerts"
+
+
+def user_channel(user_id: str) -> str:
+    return f"events:user:{user_id}"
+
+
+def product_channel(product_key: str) -> str:
+    return f"events:product:{product_key}"
+
+
+def publish_event(channel: str, event: dict):
+    redis.publish(channel, json.dumps(event, default=str))
+
+
+async def apublish_event(channel: str, event: dict):
+    await aredis.publish(channel, json.dumps(event, default=str))
+
+
+class HubFull(Exception):
+    pass
+
+
+class Subscriber:
+    def __init__(self, channels: set[str], queue_size: int):
+        self.channels = channels
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    # A client that can't keep up loses its backlog and is told to refetch,
+    # instead of the worker buffering for it without bound
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class EventHub:
+    def __init__(self, max_connections: int, queue_size: int):
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.by_channel = {}
+        self.loop = None
+
+    def full(self) -> bool:
+        return len(self.subscribers) >= self.max_connections
+
+    def subscribe(self, channels: set[str]) -> Subscriber:
+        if self.full():
+            raise HubFull()
+        subscriber = Subscriber(channels, self.queue_size)
+        self.subscribers.add(subscriber)
+        for channel in channels:
+            self.by_channel.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        for channel in subscriber.channels:
+            listeners = self.by_channel.get(channel)
+            if listeners is not None:
+                listeners.discard(subscriber)
+                if not listeners:
+                    del self.by_channel[channel]
+
+    # Runs on the event loop
+    def dispatch(self, channel: str, event: dict):
+        for subscriber in list(self.by_channel.get(channel, ())):
+            subscriber.push(event)
+
+    def listen(self, stop: threading.Event):
+        while not stop.is_set():
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                while not stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message or message["type"] != "pmessage":
+                        continue
+                    # Only channels someone on this worker listens to
+                    if message["channel"] in self.by_channel:
+                        event = json.loads(message["data"])
+                        self.loop.call_soon_threadsafe(self.dispatch, message["channel"], event)
+            except Exception as e:
+                print(f"Event listener error: {e}")
+                stop.wait(1)
+            finally:
+                pubsub.close()
+
+    async def newest_alert_id(self):
+        newest = await adb_alert.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+        return newest["_id"] if newest else None
+
+    async def watch_alerts(self, stop: threading.Event):
+        watching = False
+        last_id = None
+        while not stop.is_set():
+            await asyncio.sleep(ALERT_POLL_INTERVAL)
+            # Nobody on this worker listens: don't query, start from the newest alert later
+            if ALERTS_CHANNEL not in self.by_channel:
+                watching = False
+                continue
+            try:
+                if not watching:
+                    last_id = await self.newest_alert_id()
+                    watching = True
+                    continue
+                query = {"_id": {"$gt": last_id}} if last_id else {}
+                alerts = await adb_alert.find(query).sort("_id", 1).limit(20).to_list(None)
+            except Exception as e:
+                print(f"Alert watch error: {e}")
+                continue
+            for alert in alerts:
+                last_id = alert["_id"]
+                alert["_id"] = str(alert["_id"])
+                self.dispatch(ALERTS_CHANNEL, {"type": "alert", "alert": alert})
+
+    def start(self, stop: threading.Event) -> asyncio.Task:
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self.listen, args=(stop,), daemon=True).start()
+        return asyncio.create_task(self.watch_alerts(stop))
+
+
+hub = EventHub(MAX_EVENT_CONNECTIONS, EVENT_QUEUE_SIZE)
+
+
+def channels_for(user: dict, product_keys: list[str]) -> set[str]:
+    channels = {user_channel(str(user["_id"]))}
+    channels.update(product_channel(key) for key in product_keys)
+    if user.get("role") == "admin":
+        channels.add(ALERTS_CHANNEL)
+    return channels
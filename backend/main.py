@@ -1,11 +1,69 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from auth.routes import router as auth_router
 from sentiment.routes import router as sentiment_router
 from monitor.routes import router as monitor_router
+from events.routes import router as events_router
+from events.utils import hub
+from sentiment import jobs, prewarm, rollups, trending
+from auth import hashing
+from monitor import reports
+from database import close_async_clients, verify_indexes
+from cache import start_invalidation_listener
+from metrics import MetricsMiddleware, render_metrics
+from codec import CompressionMiddleware
 
-app = FastAPI()
+# Copy crawled comments into `comments` and roll them up from inside the API
+# process. Every read goes through them, so set ROLLUP_WATCH=0 only when
+# `python -m sentiment.rollups watch` runs as a sidecar.
+ROLLUP_WATCH = os.getenv("ROLLUP_WATCH", "1") == "1"
+# Run the crawl job dispatcher inside the API process (python -m sentiment.jobs otherwise)
+CRAWL_DISPATCHER = os.getenv("CRAWL_DISPATCHER", "1") == "1"
+# Keep tracked products' cached aggregates warm (python -m sentiment.prewarm otherwise)
+PREWARM = os.getenv("PREWARM", "1") == "1"
+# Track trending products inside the API process; one worker holds the
+# consumer lock. Set TRENDING_WATCH=0 when `python -m sentiment.trending`
+# runs as a sidecar.
+TRENDING_WATCH = os.getenv("TRENDING_WATCH", "1") == "1"
+# Parse new monitor reports in the background (python -m monitor.reports watch otherwise)
+REPORT_SYNC = os.getenv("REPORT_SYNC", "1") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    verify_indexes()
+    start_invalidation_listener(stop)
+    alert_watch = hub.start(stop)
+    if ROLLUP_WATCH:
+        threading.Thread(target=rollups.watch, kwargs={"stop": stop}, daemon=True).start()
+    if TRENDING_WATCH:
+        threading.Thread(target=trending.watch, kwargs={"stop": stop}, daemon=True).start()
+    stop_tasks = asyncio.Event()
+    tasks = []
+    if CRAWL_DISPATCHER:
+        tasks.append(asyncio.create_task(jobs.dispatch(stop_tasks)))
+    if PREWARM:
+        tasks.append(asyncio.create_task(prewarm.schedule(stop_tasks)))
+    else:
+        tasks.append(asyncio.create_task(prewarm.flush_loop(stop_tasks)))
+    if REPORT_SYNC:
+        tasks.append(asyncio.create_task(reports.sync_loop(stop_tasks)))
+    yield
+    stop.set()
+    alert_watch.cancel()
+    stop_tasks.set()
+    await asyncio.gather(*tasks)
+    hashing.shutdown()
+    await close_async_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for local dev
 app.add_middleware(
@@ -14,8 +72,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+# gzip/brotli for responses the client accepts compressed (SSE excluded)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(sentiment_router, prefix="/sentiment", tags=["Sentiment"])
 app.include_router(monitor_router, prefix="/monitor", tags=["Monitor"])
+app.include_router(events_router, prefix="/events", tags=["Events"])
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
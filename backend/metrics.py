@@ -0,0 +1,178 @@
+import os
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+from pyinstrument import Profiler
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily
+import redis as redis_py
+import redis.asyncio as aioredis
+
+# Prometheus metrics for the API, served on /metrics:
+#
+#   http_request_duration_seconds{method, route, status}
+#   http_response_size_bytes{route}
+#   mongo_command_duration_seconds{command, status}   pymongo command monitoring
+#   redis_command_duration_seconds{command}
+#   stage_duration_seconds{stage}                     jwt_decode, serialize, cache_encode
+#   password_hash_duration_seconds{operation}          bcrypt hash/verify, queue wait included
+#   password_hash_queue_depth                          hashes waiting or running
+#   password_hash_rejected_total                       turned away with a 503
+#   cache_events_total{family, event}                 from cache.stats
+#
+# Routes are labelled by their template (/sentiment/jobs/{job_id}) so the
+# label set stays bounded. Each worker process keeps its own numbers.
+
+# PROFILE_REQUESTS=1 lets a request ask for a profile with the X-Profile: 1
+# header; the HTML report lands in PROFILE_DIR. pyinstrument samples every
+# PROFILE_INTERVAL seconds and only records the request's own task, so other
+# requests on the event loop are neither slowed much nor mixed in. Work the
+# request hands to the threadpool shows up as time waiting on it.
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to send the whole response", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body size", ["route"], buckets=SIZE_BUCKETS)
+MONGO_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round trips", ["command", "status"], buckets=LATENCY_BUCKETS
+)
+REDIS_LATENCY = Histogram("redis_command_duration_seconds", "Redis command round trips", ["command"], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram("stage_duration_seconds", "Time spent in one step of a request", ["stage"], buckets=LATENCY_BUCKETS)
+HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify including the wait for the pool", ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+HASH_QUEUE_DEPTH = Gauge("password_hash_queue_depth", "Password hashes waiting for or running in the pool")
+HASH_REJECTED = Counter("password_hash_rejected", "Requests turned away because the hash pool was full")
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.labels(event.command_name, "ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_LATENCY.labels(event.command_name, "error").observe(event.duration_micros / 1e6)
+
+
+class TimedRedis(redis_py.Redis):
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            REDIS_LATENCY.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+
+
+class TimedAsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_LATENCY.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+
+
+# The cache already counts its hits and misses per family, export those
+class CacheCollector:
+    def family(self) -> CounterMetricFamily:
+        return CounterMetricFamily("cache_events", "Cache lookups per key family", labels=["family", "event"])
+
+    # Lets the registry check names without importing cache (which imports database, which imports us)
+    def describe(self):
+        yield self.family()
+
+    def collect(self):
+        from cache import stats
+        family = self.family()
+        for (name, event), n in list(stats.items()):
+            family.add_metric([name, event], n)
+        yield family
+
+
+REGISTRY.register(CacheCollector())
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def start_profile() -> Profiler:
+    profile = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+    profile.start()
+    return profile
+
+
+def stop_profile(profile: Profiler, route: str) -> str:
+    profile.stop()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{route.strip('/').replace('/', '_') or 'root'}-{int(time.time() * 1000)}.html")
+    with open(path, "w") as f:
+        f.write(profile.output_html())
+    return path
+
+
+# The matched route's template. Included routers may only know their path
+# below the prefix, so the prefix is taken from the request path.
+def route_template(scope) -> str:
+    route = getattr(scope.get("route"), "path", None)
+    if route is None:
+        return "unmatched"
+    parts = scope["path"].split("/")
+    prefix = "/".join(parts[:max(1, len(parts) - len(route.split("/")) + 1)])
+    return prefix + route
+
+
+# ASGI middleware: latency and size per route, and the optional profile.
+# Works on raw ASGI messages so streamed responses (NDJSON, SSE) are timed
+# until their last chunk.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        profile = None
+        if PROFILE_REQUESTS and (b"x-profile", b"1") in scope.get("headers", []):
+            profile = start_profile()
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_template(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
+            RESPONSE_SIZE.labels(route).observe(size)
+            if profile:
+                print(f"Profile of {scope['method']} {scope['path']} written to {stop_profile(profile, route)}")
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import math
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from database import (
+    adb_model, adb_datadrift, adb_datasummary, adb_parsed_reports, adb_metric_points, aclient, aredis
+)
+
+# The Evidently reports are large and their metric ids encode the parameters
+# as text, e.g. "ValueDrift(column=text_length,method=K-S p_value,threshold=0.05)".
+# Every report is parsed once into a compact record in reports.parsed_reports:
+#
+#   {_id: <report _id>, kind, timestamp,
+#    summary: {metrics, tests, failed_tests, drifted_columns, drift_share},
+#    metrics: [{id, metric_id, name, column, method, threshold, quantile, value, drifted}],
+#    tests: [{id, name, description, status, column}]}
+#
+# and every numeric metric value also becomes a point in reports.metric_points,
+# which backs the time-series endpoint (dict values such as F1ByLabel or
+# DriftedColumnsCount give one point per label):
+#
+#   {_id: "<report _id>:<metric index>:<label>", report_id, kind, timestamp,
+#    metric_id, name, column, label, value}
+
+REPORT_SOURCES = {
+    "model": adb_model,
+    "data-drift": adb_datadrift,
+    "dataset-summary": adb_datasummary,
+}
+METRIC_ID = re.compile(r"^(\w+)\((.*)\)$")
+
+# New reports are parsed by a background task (sync_loop), so the API reads
+# never write. One worker syncs per interval.
+REPORT_SYNC_INTERVAL = int(os.getenv("REPORT_SYNC_INTERVAL", "60"))
+SYNC_LOCK_KEY = "monitor:reports:sync"
+
+
+def parse_value(raw: str):
+    if raw in ("True", "False"):
+        return raw == "True"
+    if raw == "None":
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        return raw
+
+
+# "Name(a=1,b=x)" -> ("Name", {"a": 1.0, "b": "x"})
+def parse_metric_id(metric_id: str) -> tuple[str, dict]:
+    match = METRIC_ID.match(metric_id or "")
+    if not match:
+        return metric_id, {}
+    name, args = match.groups()
+    params = {}
+    for arg in args.split(","):
+        key, sep, value = arg.partition("=")
+        if sep:
+            params[key.strip()] = parse_value(value.strip())
+    return name, params
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_metric(metric: dict) -> dict:
+    name, params = parse_metric_id(metric.get("metric_id"))
+    value = metric.get("value")
+    threshold = params.get("threshold")
+    drifted = None
+    if name == "ValueDrift" and is_number(value) and is_number(threshold):
+        drifted = value > threshold
+    return {
+        "id": metric.get("id"),
+        "metric_id": metric.get("metric_id"),
+        "name": name,
+        "column": params.get("column"),
+        "method": params.get("method"),
+        "threshold": threshold if is_number(threshold) else None,
+        "quantile": params.get("quantile"),
+        "value": value,
+        "drifted": drifted,
+    }
+
+
+def parse_test(test: dict) -> dict:
+    params = (test.get("metric_config") or {}).get("params") or {}
+    return {
+        "id": test.get("id"),
+        "name": test.get("name"),
+        "description": test.get("description"),
+        "status": test.get("status"),
+        "column": params.get("column"),
+    }
+
+
+def parse_report(kind: str, doc: dict) -> dict:
+    metrics = [parse_metric(m) for m in doc.get("metrics") or []]
+    tests = [parse_test(t) for t in doc.get("tests") or []]
+
+    drift = next((m["value"] for m in metrics if m["name"] == "DriftedColumnsCount"), None)
+    drift_checks = [m["drifted"] for m in metrics if m["drifted"] is not None]
+    summary = {
+        "metrics": len(metrics),
+        "tests": len(tests),
+        "failed_tests": sum(1 for t in tests if t["status"] == "FAIL"),
+        "drifted_columns": sum(drift_checks) if drift_checks else None,
+        "drift_share": drift.get("share") if isinstance(drift, dict) else None,
+    }
+    return {
+        "_id": doc["_id"],
+        "kind": kind,
+        "timestamp": doc.get("timestamp"),
+        "summary": summary,
+        "metrics": metrics,
+        "tests": tests,
+    }
+
+
+def report_time(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def metric_points(record: dict) -> list[dict]:
+    timestamp = report_time(record["timestamp"])
+    if timestamp is None:
+        return []
+    points = []
+    for i, metric in enumerate(record["metrics"]):
+        value = metric["value"]
+        values = value.items() if isinstance(value, dict) else [(None, value)]
+        for label, v in values:
+            if not is_number(v):
+                continue
+            points.append({
+                "_id": f"{record['_id']}:{i}:{label or ''}",
+                "report_id": record["_id"],
+                "kind": record["kind"],
+                "timestamp": timestamp,
+                "metric_id": metric["metric_id"],
+                "name": metric["name"],
+                "column": metric["column"],
+                "label": label,
+                "value": float(v),
+            })
+    return points
+
+
+async def write_records(records: list[dict]):
+    await adb_parsed_reports.bulk_write(
+        [ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in records], ordered=False
+    )
+    points = [ReplaceOne({"_id": p["_id"]}, p, upsert=True) for r in records for p in metric_points(r)]
+    if points:
+        await adb_metric_points.bulk_write(points, ordered=False)
+
+
+# Parse the reports of a kind that were inserted since the last sync. Cheap
+# when nothing is new (two indexed lookups).
+async def sync_reports(kind: str, batch_size: int = 50) -> int:
+    source = REPORT_SOURCES[kind]
+    last = await adb_parsed_reports.find_one({"kind": kind}, {"_id": 1}, sort=[("_id", DESCENDING)])
+    query = {"_id": {"$gt": last["_id"]}} if last else {}
+
+    parsed = 0
+    batch = []
+    async for doc in source.find(query).sort("_id", 1).batch_size(batch_size):
+        batch.append(parse_report(kind, doc))
+        if len(batch) >= batch_size:
+            await write_records(batch)
+            parsed += len(batch)
+            batch = []
+    if batch:
+        await write_records(batch)
+        parsed += len(batch)
+    return parsed
+
+
+async def sync_all() -> dict:
+    counts = await asyncio.gather(*(sync_reports(kind) for kind in REPORT_SOURCES))
+    return dict(zip(REPORT_SOURCES, counts))
+
+
+async def sync_loop(stop: asyncio.Event, interval: int = REPORT_SYNC_INTERVAL):
+    print(f"Report sync started (every {interval}s)")
+    while not stop.is_set():
+        try:
+            if await aredis.set(SYNC_LOCK_KEY, uuid.uuid4().hex, nx=True, ex=interval):
+                parsed = await sync_all()
+                if any(parsed.values()):
+                    print(f"Parsed reports: {parsed}")
+        except Exception as e:
+            print(f"Report sync error: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def list_reports(kind: str, limit: int = 10) -> list[dict]:
+    cursor = (
+        adb_parsed_reports.find({"kind": kind}, {"metrics": 0, "tests": 0})
+        .sort("timestamp", DESCENDING)
+        .limit(limit)
+    )
+    return await cursor.to_list(None)
+
+
+async def get_report(report_id, fields: Optional[list[str]] = None) -> Optional[dict]:
+    projection = None
+    if fields:
+        projection = {"kind": 1, "timestamp": 1}
+        projection.update({field: 1 for field in fields})
+    return await adb_parsed_reports.find_one({"_id": report_id}, projection)
+
+
+# Names of the series that can be charted, per kind
+async def list_series(kind: str) -> list[dict]:
+    pipeline = [
+        {"$match": {"kind": kind}},
+        {"$group": {
+            "_id": {"metric_id": "$metric_id", "label": "$label"},
+            "name": {"$first": "$name"},
+            "column": {"$first": "$column"},
+        }},
+        {"$sort": {"_id.metric_id": 1, "_id.label": 1}},
+    ]
+    rows = await adb_metric_points.aggregate(pipeline).to_list(None)
+    return [
+        {"metric_id": r["_id"]["metric_id"], "label": r["_id"].get("label"), "name": r["name"], "column": r["column"]}
+        for r in rows
+    ]
+
+
+# Downsample one series to at most `buckets` equal-width buckets between
+# date_from and date_to, each with min/max/mean/last of the points in it.
+# Select the series either by metric_id (+ label) or by column (+ metric name).
+async def get_series(
+    date_from: datetime,
+    date_to: datetime,
+    buckets: int,
+    metric_id: Optional[str] = None,
+    label: Optional[str] = None,
+    column: Optional[str] = None,
+    name: Optional[str] = None,
+) -> list[dict]:
+    match = {"timestamp": {"$gte": date_from, "$lt": date_to}}
+    if metric_id:
+        match.update({"metric_id": metric_id, "label": label})
+    else:
+        match.update({"column": column, "name": name or "ValueDrift"})
+        if label is not None:
+            match["label"] = label
+
+    width = max(1, math.ceil((date_to - date_from).total_seconds() * 1000 / buckets))
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"timestamp": ASCENDING}},
+        {"$group": {
+            "_id": {"$floor": {"$divide": [{"$subtract": ["$timestamp", date_from]}, width]}},
+            "min": {"$min": "$value"},
+            "max": {"$max": "$value"},
+            "mean": {"$avg": "$value"},
+            "last": {"$last": "$value"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"_id": ASCENDING}},
+    ]
+    rows = await adb_metric_points.aggregate(pipeline).to_list(None)
+    return [
+        {
+            "start": date_from + timedelta(milliseconds=row["_id"] * width),
+            "min": row["min"],
+            "max": row["max"],
+            "mean": row["mean"],
+            "last": row["last"],
+            "count": row["count"],
+        }
+        for row in rows
+    ]
+
+
+async def run(command: str, kinds: list[str]):
+    if command == "watch":
+        await sync_loop(asyncio.Event())
+        return
+    for kind in kinds:
+        if command == "rebuild":
+            await adb_parsed_reports.delete_many({"kind": kind})
+            await adb_metric_points.delete_many({"kind": kind})
+        print(f"{kind}: {await sync_reports(kind)} reports parsed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse monitor reports into reports.parsed_reports and reports.metric_points")
+    parser.add_argument("command", choices=["sync", "rebuild", "watch"])
+    parser.add_argument("--kind", choices=list(REPORT_SOURCES), help="Only this kind of report")
+    args = parser.parse_args()
+
+    kinds = [args.kind] if args.kind else list(REPORT_SOURCES)
+    asyncio.run(run(args.command, kinds))
+    aclient.close()
+
+
+if __name__ == "__main__":
+    main()
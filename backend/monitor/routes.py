@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
+from fastapi import APIRouter, Query, Depends, HTTPException, Header, Response
+from codec import FastJSONResponse
 from pymongo import DESCENDING
-from database import db_model, db_datadrift, db_alert, db_datasummary
-from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from database import adb_model, adb_datadrift, adb_alert, adb_datasummary, adb_parsed_reports
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
+import asyncio
+import hashlib
 from auth.utils import require_admin
+from cache import cache_stats
+from monitor.reports import list_reports, get_report, list_series, get_series
 
 router = APIRouter()
 
@@ -13,41 +21,190 @@ def serialize_report(doc):
         doc["timestamp"] = doc["timestamp"].isoformat()
     return doc
 
+
+async def recent_reports(collection, limit: int, projection: Optional[dict] = None) -> list[dict]:
+    reports_cursor = collection.find({}, projection).sort("timestamp", DESCENDING).limit(limit)
+    return [serialize_report(doc) for doc in await reports_cursor.to_list(None)]
+
+
+# ?fields=timestamp,tests -> only return those fields of the raw reports
+def report_projection(fields: Optional[str]) -> Optional[dict]:
+    if not fields:
+        return None
+    projection = {"timestamp": 1}
+    projection.update({field.strip(): 1 for field in fields.split(",") if field.strip()})
+    return projection
+
+
 @router.get("/model")
-def get_reports(admin = Depends(require_admin)):
+async def get_reports(
+    fields: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    admin = Depends(require_admin)
+):
     try:
-        reports_cursor = db_model.find().sort("timestamp", DESCENDING).limit(10)
-        reports = [serialize_report(doc) for doc in reports_cursor]
-        return reports
+        return FastJSONResponse(content=await recent_reports(adb_model, limit, report_projection(fields)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
     
 @router.get("/dataset-drift")
-def get_datadrift(admin = Depends(require_admin)):
+async def get_datadrift(
+    fields: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    admin = Depends(require_admin)
+):
     try:
-        reports_cursor = db_datadrift.find().sort("timestamp", DESCENDING).limit(10)
-        reports = [serialize_report(doc) for doc in reports_cursor]
-        return reports
+        return FastJSONResponse(content=await recent_reports(adb_datadrift, limit, report_projection(fields)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @router.get("/dataset-summary")
-def get_datasummary(admin = Depends(require_admin)):
+async def get_datasummary(
+    fields: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    admin = Depends(require_admin)
+):
     try:
-        reports_cursor = db_datasummary.find().sort("timestamp", DESCENDING).limit(10)
-        reports = [serialize_report(doc) for doc in reports_cursor]
-        return reports
+        return FastJSONResponse(content=await recent_reports(adb_datasummary, limit, report_projection(fields)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
 @router.get("/alerts")
-def get_alerts(admin = Depends(require_admin)):
+async def get_alerts(admin = Depends(require_admin)):
     try:
-        reports_cursor = db_alert.find().sort("timestamp", DESCENDING).limit(20)
-        reports = [serialize_report(doc) for doc in reports_cursor]
-        return reports
+        return FastJSONResponse(content=await recent_reports(adb_alert, 20))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ETag over the newest (_id, timestamp) of every collection in the snapshot,
+# one indexed lookup each. The drift list comes from the parsed reports, which
+# lag the raw ones until the next sync. CompressionMiddleware makes it weak on
+# gzip and brotli bodies.
+async def snapshot_etag() -> str:
+    sources = ((adb_model, {}), (adb_parsed_reports, {"kind": "data-drift"}), (adb_alert, {}), (adb_datasummary, {}))
+    newest = await asyncio.gather(*(
+        collection.find_one(query, {"_id": 1, "timestamp": 1}, sort=[("timestamp", DESCENDING), ("_id", DESCENDING)])
+        for collection, query in sources
+    ))
+    state = "|".join(f"{doc['_id']}:{doc.get('timestamp')}" if doc else "-" for doc in newest)
+    return '"' + hashlib.sha1(state.encode()).hexdigest() + '"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+# Everything the Monitor page shows, fetched concurrently. Answers 304 when
+# the If-None-Match ETag still matches.
+@router.get("/snapshot")
+async def get_snapshot(
+    if_none_match: Optional[str] = Header(None),
+    admin = Depends(require_admin)
+):
+    etag = await snapshot_etag()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    model, dataset_drift, alerts, dataset_summary = await asyncio.gather(
+        recent_reports(adb_model, 10),
+        list_reports("data-drift", 10),
+        recent_reports(adb_alert, 20),
+        recent_reports(adb_datasummary, 10),
+    )
+    content = {
+        "model": model,
+        "dataset_drift": [serialize_report(doc) for doc in dataset_drift],
+        "alerts": alerts,
+        "dataset_summary": dataset_summary,
+    }
+    return FastJSONResponse(content=content, headers=headers)
+
+
+# Lightweight list of parsed reports: id, timestamp and summary counts only
+@router.get("/reports")
+async def get_parsed_reports(
+    kind: Literal["model", "data-drift", "dataset-summary"] = Query(...),
+    limit: int = Query(10, ge=1, le=100),
+    admin = Depends(require_admin)
+):
+    return FastJSONResponse(content=[serialize_report(doc) for doc in await list_reports(kind, limit)])
+
+
+# One parsed report, optionally only some of its fields (?fields=metrics,tests)
+@router.get("/reports/{report_id}")
+async def get_parsed_report(
+    report_id: str,
+    fields: Optional[str] = Query(None),
+    admin = Depends(require_admin)
+):
+    try:
+        object_id = ObjectId(report_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid report id")
+    selected = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    if selected and not set(selected) <= {"summary", "metrics", "tests"}:
+        raise HTTPException(status_code=400, detail="fields must be among summary, metrics, tests")
+    doc = await get_report(object_id, selected)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return FastJSONResponse(content=serialize_report(doc))
+
+
+# Series available to /metrics/series for one kind of report
+@router.get("/metrics")
+async def get_metric_names(
+    kind: Literal["model", "data-drift", "dataset-summary"] = Query(...),
+    admin = Depends(require_admin)
+):
+    return await list_series(kind)
+
+
+# Downsampled history of one metric (by metric_id) or one column's drift (by column)
+@router.get("/metrics/series")
+async def get_metric_series(
+    metric_id: Optional[str] = Query(None),
+    column: Optional[str] = Query(None),
+    name: Optional[str] = Query(None, description="Metric name for column series, ValueDrift by default"),
+    label: Optional[str] = Query(None, description="Key of dict-valued metrics, e.g. 1.Positive or share"),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    buckets: int = Query(100, ge=1, le=1000),
+    admin = Depends(require_admin)
+):
+    if bool(metric_id) == bool(column):
+        raise HTTPException(status_code=400, detail="Pass exactly one of metric_id or column")
+    # Reports are stored with naive UTC timestamps
+    date_to, date_from = (
+        d.astimezone(timezone.utc).replace(tzinfo=None) if d and d.tzinfo else d for d in (date_to, date_from)
+    )
+    date_to = date_to or datetime.utcnow()
+    date_from = date_from or date_to - timedelta(days=365)
+    if date_from >= date_to:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    points = await get_series(date_from, date_to, buckets, metric_id=metric_id, label=label, column=column, name=name)
+    for point in points:
+        point["start"] = point["start"].isoformat()
+    return {
+        "metric_id": metric_id,
+        "column": column,
+        "label": label,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "points": points,
+    }
+
+
+# Cache hit/miss/stale/coalesced counters of the worker serving the request
+@router.get("/cache-stats")
+async def get_cache_stats(admin = Depends(require_admin)):
+    return cache_stats()
@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+from database import aclient, db_comments, verify_indexes
+from sentiment.models import IngestComment
+from sentiment.rollups import SHARED_TENANT, RollupBusy, apply_comments, created_at, normalize_product, rollup_lock
+
+# NDJSON ingestion into the comments collection, for the shared tenant or one
+# user. Each comment is keyed by its tenant and a hash of what identifies it
+# (product, author, day, text), so re-crawled comments update their score
+# instead of being stored twice. Rollups for the newly inserted comments are
+# applied right away.
+
+INGEST_BATCH_SIZE = 2000
+MAX_REPORTED_ERRORS = 20
+# How long a batch waits for the rollup lock (held by the tailer for a pass,
+# or by a rebuild) before the ingest gives up
+INGEST_LOCK_WAIT = float(os.getenv("INGEST_LOCK_WAIT", "30"))
+
+def content_hash(product_key: str, author: str, created: str, text: str) -> str:
+    return hashlib.sha1("\x1f".join((product_key, author, created, text)).encode()).hexdigest()
+
+
+def to_document(tenant: str, comment: IngestComment) -> dict:
+    product_key = normalize_product(comment.product)
+    created = comment.created.isoformat()
+    return {
+        "tenant": tenant,
+        "product": comment.product.strip(),
+        "product_key": product_key,
+        "text": comment.text,
+        "author": comment.author,
+        "score": comment.score,
+        "created": created,
+        "created_at": created_at(created),
+        "inserted_at": datetime.now(timezone.utc),
+        "prediction": comment.prediction,
+        "content_hash": content_hash(product_key, comment.author, created, comment.text),
+    }
+
+
+def upsert_ops(docs: list[dict]) -> list[UpdateOne]:
+    ops = []
+    for doc in docs:
+        inserted = {k: v for k, v in doc.items() if k != "score"}
+        ops.append(UpdateOne(
+            {"tenant": doc["tenant"], "content_hash": doc["content_hash"]},
+            {"$setOnInsert": inserted, "$set": {"score": doc["score"]}},
+            upsert=True
+        ))
+    return ops
+
+
+class IngestResult:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+
+    def error(self, line: int, message: str):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "errors": self.errors,
+        }
+
+
+# The comments and their rollups are written under the rollup lock, so a
+# rebuild counts a comment either from `comments` or from its $inc, never
+# both or neither. Raises RollupBusy when the lock can't be had; batches
+# already written stay, and sending the same lines again is harmless.
+def write_and_roll_up(tenant: str, docs: list[dict]) -> list[dict]:
+    with rollup_lock(timeout=INGEST_LOCK_WAIT) as lock:
+        if not lock:
+            raise RollupBusy()
+        try:
+            upserted = db_comments.bulk_write(upsert_ops(docs), ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # Another writer inserted the same comment between our upsert's
+            # match and insert: it's a duplicate, the rest went through
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            upserted = {row["index"]: row["_id"] for row in e.details["upserted"]}
+        inserted = [docs[i] for i in sorted(upserted)]
+        # Rollups, cache invalidation and events for just the affected products
+        apply_comments(tenant, inserted)
+    return inserted
+
+
+async def write_batch(tenant: str, docs: list[dict], result: IngestResult):
+    # The same comment twice in one batch would race its own upsert
+    unique = list({doc["content_hash"]: doc for doc in docs}.values())
+    inserted = await run_in_threadpool(write_and_roll_up, tenant, unique)
+    result.inserted += len(inserted)
+    result.duplicates += len(docs) - len(inserted)
+
+
+async def ingest_lines(tenant: str, lines: AsyncIterator[bytes], batch_size: int = INGEST_BATCH_SIZE) -> dict:
+    result = IngestResult()
+    batch = []
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        result.received += 1
+        try:
+            batch.append(to_document(tenant, IngestComment.model_validate_json(line)))
+        except ValidationError as e:
+            error = e.errors()[0]
+            result.error(line_no, f"{'.'.join(str(p) for p in error['loc']) or 'line'}: {error['msg']}")
+            continue
+        if len(batch) >= batch_size:
+            await write_batch(tenant, batch, result)
+            batch = []
+    if batch:
+        await write_batch(tenant, batch, result)
+    return result.as_dict()
+
+
+# Split a byte stream (e.g. a request body) into lines
+async def split_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def iterate(lines: Iterable[bytes]) -> AsyncIterator[bytes]:
+    for line in lines:
+        yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest NDJSON comments into the comments collection")
+    parser.add_argument("file", help="NDJSON file, or - for stdin")
+    parser.add_argument("--tenant", default=SHARED_TENANT, help="shared or a user id")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    args = parser.parse_args()
+    verify_indexes(create=True)
+
+    async def run():
+        source = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+        with source:
+            return await ingest_lines(args.tenant, iterate(source), args.batch_size)
+
+    result = asyncio.run(run())
+    aclient.close()
+    print(f"{result['received']} received, {result['inserted']} inserted, "
+          f"{result['duplicates']} duplicates, {result['invalid']} invalid")
+    for error in result["errors"]:
+        print(f"  line {error['line']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
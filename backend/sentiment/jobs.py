@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from typing import Optional
+import httpx
+from starlette.concurrency import run_in_threadpool
+from cache import invalidate
+from database import aredis
+from events.utils import apublish_event, user_channel
+from sentiment.rollups import collection_for_tenant, normalize_product, tail_now
+
+# Crawl jobs live in Redis so any API worker can accept a submission and any
+# dispatcher can run it:
+#
+#   job:<id>         hash with the job's fields and status
+#   jobs:queue       list of job ids ready to run
+#   jobs:delayed     zset of job ids waiting out a retry backoff (score = run at)
+#   jobs:running     zset of job ids being crawled (score = lease deadline)
+#   jobs:dedup:<user>:<product_key>:<time_filter>   id of the open identical job
+#
+# A job whose dispatcher dies mid-crawl is put back on the queue once its
+# lease expires. Every API worker runs a dispatcher; jobs:running doubles as
+# the semaphore that keeps CRAWL_MAX_RUNNING crawls in flight across all of
+# them.
+
+CRAWL_API = os.getenv("CRAWL_API", "http://localhost:8090")
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "30"))
+# Crawls in flight per dispatcher process
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))
+# Crawls in flight across all dispatchers, 0 for no limit
+CRAWL_MAX_RUNNING = int(os.getenv("CRAWL_MAX_RUNNING", "8"))
+# How often an idle dispatcher looks for queued jobs
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_BACKOFF = float(os.getenv("JOB_BACKOFF", "5"))
+JOB_LEASE = CRAWL_TIMEOUT + 30
+# Finished jobs stay queryable this long
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+
+QUEUE_KEY = "jobs:queue"
+DELAYED_KEY = "jobs:delayed"
+RUNNING_KEY = "jobs:running"
+
+QUEUED, RUNNING, RETRYING, DONE, FAILED = "queued", "running", "retrying", "done", "failed"
+
+# Point the dedup key at a new job unless it names a job that is still open.
+# Returns the id the key ends up naming.
+CLAIM_DEDUP = """
+local current = redis.call("GET", KEYS[1])
+if current then
+    local status = redis.call("HGET", "job:" .. current, "status")
+    if status and status ~= "done" and status ~= "failed" then
+        return current
+    end
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+return ARGV[1]
+"""
+
+# Pop the next queued job and lease it, unless max_running jobs already hold
+# a lease. Returns the job id, or nil.
+CLAIM_NEXT = """
+local max_running = tonumber(ARGV[1])
+if max_running > 0 and redis.call("ZCARD", KEYS[2]) >= max_running then
+    return false
+end
+local job_id = redis.call("LPOP", KEYS[1])
+if job_id then
+    redis.call("ZADD", KEYS[2], ARGV[2], job_id)
+end
+return job_id
+"""
+
+
+class PermanentCrawlError(Exception):
+    pass
+
+
+def job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def dedup_key(user_id: str, product_key: str, time_filter: str) -> str:
+    return f"jobs:dedup:{user_id}:{product_key}:{time_filter}"
+
+
+def public_job(job: dict) -> dict:
+    return {
+        "id": job["id"],
+        "product": job["product"],
+        "time_filter": job["time_filter"],
+        "status": job["status"],
+        "attempts": int(job.get("attempts", 0)),
+        "error": job.get("error") or None,
+        "created": float(job["created"]),
+        "updated": float(job["updated"]),
+    }
+
+
+async def get_job(job_id: str) -> Optional[dict]:
+    job = await aredis.hgetall(job_key(job_id))
+    return job or None
+
+
+# Queue a crawl, or return the open job for the same (user, product, time_filter).
+# The job is written before the dedup key points at it, so a concurrent
+# submitter that finds the key always finds the job too.
+async def submit_job(user_id: str, product: str, time_filter: str) -> tuple[dict, bool]:
+    product_key = normalize_product(product)
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    job = {
+        "id": job_id,
+        "user_id": user_id,
+        "product": product,
+        "product_key": product_key,
+        "time_filter": time_filter,
+        "status": QUEUED,
+        "attempts": 0,
+        "error": "",
+        "created": now,
+        "updated": now,
+    }
+    await aredis.hset(job_key(job_id), mapping=job)
+    await aredis.expire(job_key(job_id), JOB_RETENTION)
+
+    claimed = await aredis.eval(CLAIM_DEDUP, 1, dedup_key(user_id, product_key, time_filter), job_id, JOB_RETENTION)
+    if claimed != job_id:
+        await aredis.delete(job_key(job_id))
+        existing = await get_job(claimed)
+        if existing:
+            return existing, False
+        # Finished and expired in the meantime
+        return await submit_job(user_id, product, time_filter)
+
+    await aredis.rpush(QUEUE_KEY, job_id)
+    return job, True
+
+
+async def _update(job_id: str, **fields):
+    fields["updated"] = time.time()
+    await aredis.hset(job_key(job_id), mapping=fields)
+
+
+async def _finish(job: dict, status: str, error: str = ""):
+    await _update(job["id"], status=status, error=error)
+    await aredis.expire(job_key(job["id"]), JOB_RETENTION)
+    await aredis.zrem(RUNNING_KEY, job["id"])
+    dedup = dedup_key(job["user_id"], job["product_key"], job["time_filter"])
+    if await aredis.get(dedup) == job["id"]:
+        await aredis.delete(dedup)
+    job = await get_job(job["id"])
+    await apublish_event(user_channel(job["user_id"]), {"type": "job", "job": public_job(job)})
+
+
+async def crawl(http: httpx.AsyncClient, job: dict):
+    res = await http.post(f"{CRAWL_API}/crawl", json={
+        "requester_id": job["user_id"],
+        "keyword": job["product"],
+        "subreddits": ["technology", "gadgets"],
+        "limit": 30,
+        "time_filter": job["time_filter"]
+    })
+    # The crawler rejected the request itself, retrying won't help
+    if 400 <= res.status_code < 500:
+        raise PermanentCrawlError(f"Crawl server returned {res.status_code}")
+    if res.status_code != 200:
+        raise RuntimeError(f"Crawl server returned {res.status_code}")
+
+
+async def run_job(http: httpx.AsyncClient, job_id: str):
+    job = await get_job(job_id)
+    if not job or job["status"] in (DONE, FAILED):
+        await aredis.zrem(RUNNING_KEY, job_id)
+        return
+
+    attempts = int(job["attempts"]) + 1
+    await _update(job_id, status=RUNNING, attempts=attempts)
+    try:
+        await crawl(http, job)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        if isinstance(e, PermanentCrawlError) or attempts >= JOB_MAX_ATTEMPTS:
+            print(f"Crawl job {job_id} failed: {error}")
+            await _finish(job, FAILED, error)
+            return
+        delay = JOB_BACKOFF * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+        print(f"Crawl job {job_id} attempt {attempts} failed, retrying in {delay:.1f}s: {error}")
+        await _update(job_id, status=RETRYING, error=error)
+        await aredis.zadd(DELAYED_KEY, {job_id: time.time() + delay})
+        await aredis.zrem(RUNNING_KEY, job_id)
+        return
+
+    # Copy the crawled comments into `comments` now rather than on the
+    # watcher's next pass, then drop what was cached before them
+    try:
+        await run_in_threadpool(tail_now, collection_for_tenant(job["user_id"]))
+    except Exception as e:
+        print(f"Copying the comments of crawl job {job_id} failed, left to the watcher: {e}")
+    await invalidate(job["product_key"], tenant=job["user_id"])
+    await _finish(job, DONE)
+
+
+# Move due retries and expired leases back onto the queue. ZREM decides which
+# dispatcher gets to requeue a job when several run this concurrently.
+async def requeue_due():
+    now = time.time()
+    for key in (DELAYED_KEY, RUNNING_KEY):
+        for job_id in await aredis.zrangebyscore(key, 0, now):
+            if await aredis.zrem(key, job_id):
+                await aredis.rpush(QUEUE_KEY, job_id)
+
+
+async def claim_next() -> Optional[str]:
+    return await aredis.eval(CLAIM_NEXT, 2, QUEUE_KEY, RUNNING_KEY, CRAWL_MAX_RUNNING, time.time() + JOB_LEASE)
+
+
+async def dispatch(stop: asyncio.Event, concurrency: int = CRAWL_CONCURRENCY):
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def run(http, job_id):
+        try:
+            await run_job(http, job_id)
+        except Exception as e:
+            print(f"Crawl job {job_id} errored: {e}")
+        finally:
+            slots.release()
+
+    print(f"Crawl dispatcher started ({concurrency} slots, {CRAWL_MAX_RUNNING or 'unlimited'} across dispatchers)")
+    async with httpx.AsyncClient(timeout=CRAWL_TIMEOUT) as http:
+        while not stop.is_set():
+            await slots.acquire()
+            try:
+                await requeue_due()
+                job_id = await claim_next()
+                if not job_id:
+                    slots.release()
+                    await asyncio.sleep(JOB_POLL_INTERVAL)
+                    continue
+            except Exception as e:
+                slots.release()
+                print(f"Crawl dispatcher error: {e}")
+                await asyncio.sleep(1)
+                continue
+            task = asyncio.create_task(run(http, job_id))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Let crawls in flight finish, unfinished ones are requeued by their lease
+        if tasks:
+            await asyncio.wait(tasks, timeout=CRAWL_TIMEOUT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the crawl job dispatcher outside the API process")
+    parser.add_argument("--concurrency", type=int, default=CRAWL_CONCURRENCY)
+    args = parser.parse_args()
+
+    async def run():
+        stop = asyncio.Event()
+        try:
+            await dispatch(stop, args.concurrency)
+        finally:
+            await aredis.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+from pymongo import ASCENDING, UpdateOne
+from database import db, db_comments, db_rollup_state, legacy_comment_collections, verify_indexes
+from sentiment.rollups import RollupLock, copy_and_roll_up, created_at, rollup_lock, tenant_for_collection
+
+
+# Copy a reddits / reddits_<user_id> collection into `comments` under its
+# tenant, in _id order and keeping the _ids, so it can be restarted at will.
+# Like the tailer, it rolls up only the comments it copies itself.
+def partition_collection(
+    collection_name: str, batch_size: int = 1000, drop: bool = False, lock: RollupLock | None = None
+) -> int:
+    collection = db[collection_name]
+    tenant = tenant_for_collection(collection_name)
+    copied = 0
+    scanned = 0
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = list(collection.find(query).sort("_id", ASCENDING).limit(batch_size))
+        if not docs:
+            break
+        if lock:
+            lock.renew()
+        copied += copy_and_roll_up(tenant, docs)
+        scanned += len(docs)
+        last_id = docs[-1]["_id"]
+
+    if drop and last_id is not None:
+        present = db_comments.count_documents({"tenant": tenant, "_id": {"$lte": last_id}})
+        if present < scanned:
+            print(f"{collection_name}: only {present}/{scanned} comments copied, not dropping")
+        else:
+            collection.drop()
+            db_rollup_state.delete_one({"_id": collection_name})
+            print(f"{collection_name}: dropped")
+    return copied
+
+
+# Give comments copied before created_at existed their Date-typed created_at
+def backfill_created_at(batch_size: int = 1000) -> int:
+    updated = 0
+    last_id = None
+    while True:
+        query = {"created_at": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = list(db_comments.find(query, {"_id": 1, "created": 1}).sort("_id", ASCENDING).limit(batch_size))
+        if not docs:
+            return updated
+        ops = [UpdateOne({"_id": doc["_id"]}, {"$set": {"created_at": created_at(doc.get("created"))}}) for doc in docs]
+        db_comments.bulk_write(ops, ordered=False)
+        updated += len(ops)
+        last_id = docs[-1]["_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="One-off data migrations for the comment collections")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_partition = sub.add_parser("partition", help="Copy reddits / reddits_<user_id> into the comments collection")
+    p_partition.add_argument("--collection", help="Only migrate this collection (e.g. reddits_<user_id>)")
+    p_partition.add_argument("--batch-size", type=int, default=1000)
+    p_partition.add_argument("--drop", action="store_true", help="Drop each legacy collection once it is copied and rolled up")
+
+    p_created = sub.add_parser("created-at", help="Backfill the Date-typed created_at of the comments collection")
+    p_created.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+
+    if args.command == "created-at":
+        print(f"comments: {backfill_created_at(args.batch_size)} comments updated")
+        verify_indexes(create=True)
+
+    if args.command == "partition":
+        verify_indexes(create=True)
+        collections = [args.collection] if args.collection else legacy_comment_collections()
+        # Rollups are written too, so the tailer waits meanwhile
+        with rollup_lock(ttl=600) as lock:
+            for name in collections:
+                print(f"{name}: {partition_collection(name, args.batch_size, args.drop, lock)} comments copied")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from datetime import date
+from typing import Literal
 
 class SentimentSummary(BaseModel):
     product: str
@@ -7,3 +9,13 @@ class SentimentSummary(BaseModel):
     neutral: int = 0
     negative: int = 0
     irrelevant: int = 0
+
+
+# One line of a /sentiment/ingest NDJSON batch
+class IngestComment(BaseModel):
+    product: str = Field(min_length=1, max_length=200)
+    text: str = Field(min_length=1, max_length=40000)
+    author: str = Field(default="", max_length=100)
+    score: int = 0
+    created: date
+    prediction: Literal["Positive", "Neutral", "Negative", "Irrelevant"]
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter
+from cache import accesses, refresh, tenant_of
+from database import adb_users, aredis, close_async_clients
+from sentiment.rollups import normalize_product
+from sentiment.utils import get_summary, get_weekly, get_monthly, get_dashboard
+
+# Keeps enterprise dashboards warm: every PREWARM_INTERVAL seconds the cached
+# summary/weekly/monthly/dashboard entries of every enterprise user's tracked
+# products are recomputed when missing or about to go stale, most read first.
+#
+#   prewarm:accesses   zset of "<tenant>:<product_key>" -> decayed read count
+#   prewarm:lock       held by the worker running this interval's pass
+#
+# Each API worker adds its reads to prewarm:accesses once per interval, also
+# with PREWARM=0 (flush_loop); one process per interval does the
+# recomputing. A pass stops starting new aggregations once they have taken
+# PREWARM_BUDGET seconds, and runs at most PREWARM_CONCURRENCY at a time,
+# which bounds the extra Mongo load.
+
+PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", "300"))
+# Seconds of aggregation per pass
+PREWARM_BUDGET = float(os.getenv("PREWARM_BUDGET", "30"))
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "2"))
+# Refresh entries that go stale within this many seconds
+PREWARM_AHEAD = int(os.getenv("PREWARM_AHEAD", str(2 * PREWARM_INTERVAL)))
+# Read counts are multiplied by this after every pass, so old reads fade
+PREWARM_DECAY = float(os.getenv("PREWARM_DECAY", "0.5"))
+
+ACCESS_KEY = "prewarm:accesses"
+LOCK_KEY = "prewarm:lock"
+
+
+def user_id_of(user: dict) -> str:
+    return f"reddits_{user['_id']}"
+
+
+# Family -> compute, the same ones the routes cache
+FAMILIES = {
+    "summary": lambda product, user: get_summary(product, user_id_of(user)),
+    "weekly": lambda product, user: get_weekly(product, user_id_of(user)),
+    "monthly": lambda product, user: get_monthly(product, user_id_of(user)),
+    "dashboard": lambda product, user: get_dashboard(normalize_product(product), user_id_of(user)),
+}
+
+
+# Add this worker's reads since the last flush to the shared counts
+async def flush_accesses():
+    counts = Counter(accesses)
+    accesses.clear()
+    for (tenant, product_key), n in counts.items():
+        await aredis.zincrby(ACCESS_KEY, n, f"{tenant}:{product_key}")
+
+
+async def tracked_users() -> list[dict]:
+    cursor = adb_users.find(
+        {"role": {"$in": ["enterprise", "admin"]}, "tracked_products.0": {"$exists": True}},
+        {"_id": 1, "role": 1, "tracked_products": 1},
+    )
+    return await cursor.to_list(None)
+
+
+# (score, user, product) for every tracked product, most read first
+async def ranked_products(users: list[dict]) -> list[tuple[float, dict, str]]:
+    scores = dict(await aredis.zrange(ACCESS_KEY, 0, -1, withscores=True))
+    items = []
+    for user in users:
+        tenant = tenant_of(user)
+        products = {normalize_product(p): p for p in reversed(user["tracked_products"]) if p.strip()}
+        for product_key, product in products.items():
+            items.append((scores.get(f"{tenant}:{product_key}", 0.0), user, product))
+    items.sort(key=lambda item: -item[0])
+    return items
+
+
+async def warm(
+    items: list[tuple[dict, str]], budget: float = PREWARM_BUDGET, concurrency: int = PREWARM_CONCURRENCY
+) -> Counter:
+    slots = asyncio.Semaphore(concurrency)
+    result = Counter()
+    spent = 0.0
+
+    async def one(user: dict, product: str, family: str):
+        nonlocal spent
+        async with slots:
+            if spent >= budget:
+                result["over_budget"] += 1
+                return
+            start = time.perf_counter()
+            try:
+                refreshed = await refresh(
+                    family, normalize_product(product), user, lambda: FAMILIES[family](product, user), PREWARM_AHEAD
+                )
+            except Exception as e:
+                print(f"Prewarm of {family} for '{product}' failed: {e}")
+                result["failed"] += 1
+                return
+            if refreshed:
+                spent += time.perf_counter() - start
+            result["refreshed" if refreshed else "fresh"] += 1
+
+    # The semaphore hands out slots in order, so the most read go first
+    await asyncio.gather(*(one(user, product, family) for user, product in items for family in FAMILIES))
+    result["seconds"] = round(spent, 2)
+    return result
+
+
+async def run_once() -> Counter:
+    items = await ranked_products(await tracked_users())
+    result = await warm([(user, product) for _, user, product in items])
+    if PREWARM_DECAY < 1:
+        await aredis.zunionstore(ACCESS_KEY, {ACCESS_KEY: PREWARM_DECAY})
+        await aredis.zremrangebyscore(ACCESS_KEY, 0, 0.01)
+    print(f"Prewarmed {len(items)} tracked products: {dict(result)}")
+    return result
+
+
+# Warm one product right away, e.g. when it was just tracked
+async def warm_product(user: dict, product: str):
+    await warm([(user, product)], budget=float("inf"))
+
+
+async def schedule(stop: asyncio.Event, interval: int = PREWARM_INTERVAL):
+    print(f"Prewarm scheduler started (every {interval}s, {PREWARM_BUDGET}s budget)")
+    while not stop.is_set():
+        try:
+            await flush_accesses()
+            # Held for the whole interval: one pass per interval across workers
+            if await aredis.set(LOCK_KEY, uuid.uuid4().hex, nx=True, ex=interval):
+                await run_once()
+        except Exception as e:
+            print(f"Prewarm scheduler error: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+# For workers that leave the passes to another process: keep handing it
+# their reads, which would otherwise pile up here
+async def flush_loop(stop: asyncio.Event, interval: int = PREWARM_INTERVAL):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await flush_accesses()
+        except Exception as e:
+            print(f"Prewarm access flush error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cache prewarm scheduler outside the API process")
+    parser.add_argument("--interval", type=int, default=PREWARM_INTERVAL)
+    parser.add_argument("--once", action="store_true", help="Run a single pass, ignoring the lock")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.once:
+                await run_once()
+            else:
+                await schedule(asyncio.Event(), args.interval)
+        finally:
+            await close_async_clients()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
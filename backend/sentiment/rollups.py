@@ -0,0 +1,584 @@
+import argparse
+import os
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import (
+    db, db_comments, db_rollups, db_rollup_state, redis, adb_rollups, legacy_comment_collections, verify_indexes
+)
+from cache import SHARED_TENANT, invalidate_sync
+from events.utils import publish_event, product_channel, user_channel
+
+# Rollup rows look like
+#   {"tenant": "shared" | <user_id>, "product_key": "switch 2",
+#    "day": "2025-04-23" | None, "prediction": "Positive", "count": 42}
+# counted from the `comments` collection, whose documents carry the same
+# tenant field. The crawler still writes to `reddits` / `reddits_<user_id>`;
+# the tailer copies new comments from there into `comments` and rolls them up
+# in the same pass.
+# Comments without a parsable `created` are kept under day=None so the
+# summary still counts them while the weekly/monthly views skip them.
+
+SENTIMENTS = ["Positive", "Neutral", "Negative"]
+GRANULARITIES = ("day", "week", "month", "quarter")
+LOCK_KEY = "rollup:lock"
+# Each tailer pass re-reads this many seconds of legacy comments before its
+# checkpoint, for comments committed out of _id order (concurrent crawlers,
+# slow inserts)
+TAIL_RESCAN = int(os.getenv("TAIL_RESCAN", "300"))
+# The tailer also looks this far back for legacy comments that never made it
+# into `comments`, every RECONCILE_INTERVAL seconds
+RECONCILE_WINDOW = int(os.getenv("RECONCILE_WINDOW", str(24 * 3600)))
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "3600"))
+
+
+def normalize_product(product: str) -> str:
+    return product.strip().lower()
+
+
+def tenant_for_collection(name: str) -> str:
+    if name == "reddits":
+        return SHARED_TENANT
+    return name[len("reddits_"):]
+
+
+def collection_for_tenant(tenant: str) -> str:
+    if tenant == SHARED_TENANT:
+        return "reddits"
+    return f"reddits_{tenant}"
+
+
+def comment_day(created) -> str | None:
+    if not isinstance(created, str):
+        return None
+    try:
+        return datetime.strptime(created[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+# Date-typed copy of `created` (midnight UTC of that day) for range queries
+def created_at(created) -> datetime | None:
+    day = comment_day(created)
+    return datetime.strptime(day, "%Y-%m-%d") if day else None
+
+
+def rollup_key(doc: dict):
+    product = doc.get("product")
+    prediction = doc.get("prediction")
+    if not isinstance(product, str) or not prediction:
+        return None
+    return normalize_product(product), comment_day(doc.get("created")), prediction
+
+
+def count_comments(docs) -> Counter:
+    counts = Counter()
+    for doc in docs:
+        key = rollup_key(doc)
+        if key:
+            counts[key] += 1
+    return counts
+
+
+def rollup_ops(tenant: str, counts: Counter, sign: int = 1) -> list[UpdateOne]:
+    return [
+        UpdateOne(
+            {"tenant": tenant, "product_key": product_key, "day": day, "prediction": prediction},
+            {"$inc": {"count": sign * n}},
+            upsert=True,
+        )
+        for (product_key, day, prediction), n in counts.items()
+    ]
+
+
+def comment_document(tenant: str, doc: dict) -> dict:
+    doc = {k: v for k, v in doc.items() if k != "_id"}
+    doc["tenant"] = tenant
+    doc["created_at"] = created_at(doc.get("created"))
+    # When it reached `comments`; crawled comments keep their older _id
+    doc["inserted_at"] = datetime.now(timezone.utc)
+    if isinstance(doc.get("product"), str):
+        doc["product_key"] = normalize_product(doc["product"])
+    return doc
+
+
+# Copy legacy comments into `comments` under their original _id. Comments
+# already there are left alone, so copying the same range twice is harmless.
+# Returns the comments that were not there yet.
+def copy_comments(tenant: str, docs) -> list[dict]:
+    docs = list(docs)
+    ops = [
+        UpdateOne({"_id": doc["_id"]}, {"$setOnInsert": comment_document(tenant, doc)}, upsert=True)
+        for doc in docs
+    ]
+    if not ops:
+        return []
+    try:
+        upserted = db_comments.bulk_write(ops, ordered=False).upserted_ids
+    except BulkWriteError as e:
+        # An ingested comment that was also ingested again after the switch
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        upserted = {row["index"]: row["_id"] for row in e.details["upserted"]}
+    return [docs[i] for i in sorted(upserted)]
+
+
+# Legacy comments are rolled up when they are first copied into `comments`,
+# so copying a range again never counts anything twice. Returns how many were copied.
+def copy_and_roll_up(tenant: str, docs) -> int:
+    inserted = copy_comments(tenant, docs)
+    apply_comments(tenant, inserted)
+    return len(inserted)
+
+
+def apply_comments(tenant: str, docs) -> int:
+    counts = count_comments(docs)
+    if counts:
+        db_rollups.bulk_write(rollup_ops(tenant, counts), ordered=False)
+        # New data for these products: orphan their cached aggregates and
+        # tell whoever is watching them
+        for product_key in {product_key for product_key, _, _ in counts}:
+            invalidate_sync(product_key, tenant)
+            channel = product_channel(product_key) if tenant == SHARED_TENANT else user_channel(tenant)
+            publish_event(channel, {"type": "sentiment", "product_key": product_key})
+    return sum(counts.values())
+
+
+# Only one process may write rollups at a time, otherwise a rebuild and the
+# tailer (or an ingest) could both count the same comments. Holders renew the
+# lock before each batch of writes, and stop if it was lost meanwhile.
+RENEW_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LockLost(Exception):
+    pass
+
+
+class RollupBusy(Exception):
+    pass
+
+
+class RollupLock:
+    def __init__(self, token: str, ttl: int):
+        self.token = token
+        self.ttl = ttl
+
+    def renew(self):
+        if not redis.eval(RENEW_LOCK, 1, LOCK_KEY, self.token, self.ttl):
+            raise LockLost("The rollup lock expired and may be held by another process")
+
+
+# Yields a RollupLock, or None when wait=False (or timeout seconds went by)
+# and another process holds the lock
+@contextmanager
+def rollup_lock(ttl: int = 60, wait: bool = True, timeout: float | None = None):
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while not redis.set(LOCK_KEY, token, nx=True, ex=ttl):
+        if not wait or (deadline is not None and time.monotonic() >= deadline):
+            yield None
+            return
+        time.sleep(1 if deadline is None else max(0.05, min(1, deadline - time.monotonic())))
+    try:
+        yield RollupLock(token, ttl)
+    finally:
+        redis.eval(RELEASE_LOCK, 1, LOCK_KEY, token)
+
+
+# ---- Read side (used by the sentiment routes) ----
+
+async def summary_counts(product: str, tenant: str) -> Counter:
+    pipeline = [
+        {"$match": {
+            "tenant": tenant,
+            "product_key": normalize_product(product),
+            "prediction": {"$in": SENTIMENTS},
+        }},
+        {"$group": {"_id": "$prediction", "count": {"$sum": "$count"}}},
+    ]
+    rows = await adb_rollups.aggregate(pipeline).to_list(None)
+    return Counter({row["_id"]: row["count"] for row in rows if row["count"] > 0})
+
+
+# Per-(day, prediction) counts summed over the given tenants, so shared and
+# private comments of the same day end up in the same bucket. A date range
+# is a range scan on the (tenant, product_key, day) index.
+async def daily_counts(
+    product: str, tenants: list[str], date_from: date | None = None, date_to: date | None = None
+) -> list[dict]:
+    days = {"$ne": None}
+    if date_from:
+        days["$gte"] = date_from.isoformat()
+    if date_to:
+        days["$lte"] = date_to.isoformat()
+    pipeline = [
+        {"$match": {
+            "tenant": {"$in": tenants},
+            "product_key": normalize_product(product),
+            "day": days,
+            "prediction": {"$in": SENTIMENTS},
+            "count": {"$gt": 0},
+        }},
+        {"$group": {"_id": {"day": "$day", "prediction": "$prediction"}, "count": {"$sum": "$count"}}},
+    ]
+    rows = await adb_rollups.aggregate(pipeline).to_list(None)
+    return [{"day": r["_id"]["day"], "prediction": r["_id"]["prediction"], "count": r["count"]} for r in rows]
+
+
+# Counts for a whole portfolio in one aggregation: per-(product, tenant)
+# totals for the summaries, and per-(product, day) counts within the range
+# summed over the tenants for the time series
+async def portfolio_counts(
+    product_keys: list[str], tenants: list[str], date_from: date, date_to: date
+) -> tuple[list[dict], list[dict]]:
+    pipeline = [
+        {"$match": {
+            "tenant": {"$in": tenants},
+            "product_key": {"$in": product_keys},
+            "prediction": {"$in": SENTIMENTS},
+            "count": {"$gt": 0},
+        }},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": {"product_key": "$product_key", "tenant": "$tenant", "prediction": "$prediction"},
+                    "count": {"$sum": "$count"},
+                }},
+            ],
+            "days": [
+                {"$match": {"day": {"$gte": date_from.isoformat(), "$lte": date_to.isoformat()}}},
+                {"$group": {
+                    "_id": {"product_key": "$product_key", "day": "$day", "prediction": "$prediction"},
+                    "count": {"$sum": "$count"},
+                }},
+            ],
+        }},
+    ]
+    result = (await adb_rollups.aggregate(pipeline).to_list(None))[0]
+    totals = [{**row["_id"], "count": row["count"]} for row in result["totals"]]
+    days = [{**row["_id"], "count": row["count"]} for row in result["days"]]
+    return totals, days
+
+
+# Weeks start on Monday, quarters on Jan/Apr/Jul/Oct 1st
+def bucket_start(d: date, granularity: str) -> date:
+    if granularity == "week":
+        return d - timedelta(days=d.weekday())
+    if granularity == "month":
+        return d.replace(day=1)
+    if granularity == "quarter":
+        return d.replace(month=(d.month - 1) // 3 * 3 + 1, day=1)
+    return d
+
+
+def next_bucket(start: date, granularity: str) -> date:
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(days=7)
+    months = 3 if granularity == "quarter" else 1
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+def bucket_label(start: date, granularity: str) -> str:
+    if granularity == "week":
+        iso_year, iso_week, _ = start.isocalendar()
+        return f"{iso_year}-W{iso_week:02}"
+    if granularity == "month":
+        return f"{start.year}-{start.month:02}"
+    if granularity == "quarter":
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    return start.isoformat()
+
+
+# Number of buckets bucket_starts returns, without building them
+def bucket_count(date_from: date, date_to: date, granularity: str) -> int:
+    if date_from > date_to:
+        return 0
+    if granularity == "day":
+        return (date_to - date_from).days + 1
+    if granularity == "week":
+        return (bucket_start(date_to, "week") - bucket_start(date_from, "week")).days // 7 + 1
+    months = (date_to.year - date_from.year) * 12 + date_to.month - date_from.month
+    if granularity == "quarter":
+        return ((date_to.year * 12 + date_to.month - 1) // 3) - ((date_from.year * 12 + date_from.month - 1) // 3) + 1
+    return months + 1
+
+
+def bucket_starts(date_from: date, date_to: date, granularity: str) -> list[date]:
+    starts = []
+    start = bucket_start(date_from, granularity)
+    while start <= date_to:
+        starts.append(start)
+        start = next_bucket(start, granularity)
+    return starts
+
+
+def bucket_counts(rows: list[dict], granularity: str) -> dict[date, Counter]:
+    buckets = {}
+    for row in rows:
+        start = bucket_start(date.fromisoformat(row["day"]), granularity)
+        buckets.setdefault(start, Counter())[row["prediction"]] += row["count"]
+    return buckets
+
+
+def bucket_row(label_field: str, label: str, counts: Counter) -> dict:
+    data = {label_field: label}
+    data.update({sentiment: counts[sentiment] for sentiment in SENTIMENTS})
+    return data
+
+
+# One row per bucket between date_from and date_to, empty buckets included
+def histogram(rows: list[dict], granularity: str, date_from: date, date_to: date) -> list[dict]:
+    buckets = bucket_counts(rows, granularity)
+    output = []
+    for start in bucket_starts(date_from, date_to, granularity):
+        data = bucket_row("label", bucket_label(start, granularity), buckets.get(start, Counter()))
+        data["start"] = start.isoformat()
+        data["total"] = sum(data[sentiment] for sentiment in SENTIMENTS)
+        output.append(data)
+    return output
+
+
+def weekly_buckets(rows: list[dict]) -> list[dict]:
+    buckets = bucket_counts(rows, "week")
+    return [bucket_row("week", bucket_label(start, "week"), buckets[start]) for start in sorted(buckets)]
+
+
+def monthly_buckets(rows: list[dict]) -> list[dict]:
+    buckets = bucket_counts(rows, "month")
+    return [bucket_row("month", bucket_label(start, "month"), buckets[start]) for start in sorted(buckets)]
+
+
+# ---- Write side (backfill, incremental tailer, consistency check) ----
+
+def raw_counts(tenant: str) -> Counter:
+    cursor = db_comments.find({"tenant": tenant}, {"_id": 0, "product": 1, "created": 1, "prediction": 1})
+    return count_comments(cursor)
+
+
+def stored_counts(tenant: str) -> Counter:
+    cursor = db_rollups.find({"tenant": tenant}, {"_id": 0, "product_key": 1, "day": 1, "prediction": 1, "count": 1})
+    return Counter({(r["product_key"], r["day"], r["prediction"]): r["count"] for r in cursor if r["count"]})
+
+
+def tenants() -> list[str]:
+    return sorted(set(db_comments.distinct("tenant")) | set(db_rollups.distinct("tenant")))
+
+
+# Call with the rollup lock held and the legacy collections caught up
+# (catch_up()), otherwise comments still waiting to be copied are counted twice
+def rebuild(tenant: str, lock: RollupLock | None = None) -> int:
+    counts = raw_counts(tenant)
+    build = uuid.uuid4().hex
+    ops = [
+        UpdateOne(
+            {"tenant": tenant, "product_key": product_key, "day": day, "prediction": prediction},
+            {"$set": {"count": n, "build": build}},
+            upsert=True,
+        )
+        for (product_key, day, prediction), n in counts.items()
+    ]
+    previous = set(db_rollups.distinct("product_key", {"tenant": tenant}))
+    for i in range(0, len(ops), 1000):
+        if lock:
+            lock.renew()
+        db_rollups.bulk_write(ops[i:i + 1000], ordered=False)
+    db_rollups.delete_many({"tenant": tenant, "build": {"$ne": build}})
+    for product_key in previous | {product_key for product_key, _, _ in counts}:
+        invalidate_sync(product_key, tenant)
+    return sum(counts.values())
+
+
+def check(tenant: str) -> list[str]:
+    raw = raw_counts(tenant)
+    stored = stored_counts(tenant)
+
+    problems = []
+    for key in sorted(set(raw) | set(stored), key=lambda k: tuple(str(x) for x in k)):
+        if raw[key] != stored[key]:
+            product_key, day, prediction = key
+            problems.append(f"{tenant}: {product_key} {day} {prediction}: raw={raw[key]} rollup={stored[key]}")
+    return problems
+
+
+def tail_state(collection_name: str) -> dict:
+    return db_rollup_state.find_one({"_id": collection_name}) or {}
+
+
+# Copy and roll up the comments the crawler inserted since the last pass,
+# re-reading the TAIL_RESCAN seconds before the checkpoint. Returns how many
+# legacy comments past the checkpoint were read.
+def tail_collection(
+    collection_name: str, lock: RollupLock | None = None, batch_size: int = 1000, max_batches: int = 20
+) -> int:
+    state = tail_state(collection_name)
+    last_id = state.get("last_id")
+    tenant = tenant_for_collection(collection_name)
+    after = None
+    if last_id is not None:
+        after = ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=TAIL_RESCAN))
+
+    read = 0
+    for _ in range(max_batches):
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        docs = list(db[collection_name].find(query).sort("_id", ASCENDING).limit(batch_size))
+        if not docs:
+            break
+        if lock:
+            lock.renew()
+        copy_and_roll_up(tenant, docs)
+        after = docs[-1]["_id"]
+        read += sum(1 for doc in docs if last_id is None or doc["_id"] > last_id)
+        if last_id is None or after > last_id:
+            last_id = after
+            db_rollup_state.update_one(
+                {"_id": collection_name},
+                {"$set": {"last_id": last_id}},
+                upsert=True,
+            )
+        if len(docs) < batch_size:
+            break
+    return read
+
+
+# Copy one legacy collection right away, e.g. once a crawl into it finished.
+# Skipped while another process holds the lock, its watcher gets there anyway.
+def tail_now(collection_name: str) -> int:
+    with rollup_lock(ttl=60, wait=False) as lock:
+        return tail_collection(collection_name, lock) if lock else 0
+
+
+def tail_once(lock: RollupLock | None = None, batch_size: int = 1000) -> int:
+    return sum(tail_collection(name, lock, batch_size) for name in legacy_comment_collections())
+
+
+# Legacy comments (optionally only those after `since`) that are missing from
+# `comments`, which is also what is missing from the rollups. With fix=True
+# they are copied and rolled up.
+def reconcile(
+    collection_name: str, since: ObjectId | None = None, fix: bool = False,
+    lock: RollupLock | None = None, batch_size: int = 1000
+) -> int:
+    tenant = tenant_for_collection(collection_name)
+    missing = 0
+    after = since
+    while True:
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        docs = list(db[collection_name].find(query).sort("_id", ASCENDING).limit(batch_size))
+        if not docs:
+            return missing
+        present = {doc["_id"] for doc in db_comments.find({"_id": {"$in": [d["_id"] for d in docs]}}, {"_id": 1})}
+        absent = [doc for doc in docs if doc["_id"] not in present]
+        missing += len(absent)
+        if fix and absent:
+            if lock:
+                lock.renew()
+            copy_and_roll_up(tenant, absent)
+        after = docs[-1]["_id"]
+
+
+def catch_up(lock: RollupLock | None = None):
+    while tail_once(lock):
+        pass
+
+
+def reconcile_recent(window: int = RECONCILE_WINDOW, lock: RollupLock | None = None) -> int:
+    since = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=window))
+    return sum(reconcile(name, since, fix=True, lock=lock) for name in legacy_comment_collections())
+
+
+def watch(interval: float = 5.0, stop=None):
+    next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+    while stop is None or not stop.is_set():
+        try:
+            with rollup_lock(ttl=60, wait=False) as lock:
+                applied = tail_once(lock) if lock else 0
+                if lock and time.monotonic() >= next_reconcile:
+                    next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+                    recovered = reconcile_recent(lock=lock)
+                    if recovered:
+                        print(f"Recovered {recovered} legacy comments the tailer had skipped")
+        except Exception as e:
+            print(f"Rollup tailer error: {e}")
+            applied = 0
+        if applied:
+            print(f"Copied and rolled up {applied} new comments")
+            continue
+        if stop is not None:
+            stop.wait(interval)
+        else:
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the sentiment rollup collection")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_rebuild = sub.add_parser("rebuild", help="Recount rollups from the comments collection")
+    p_rebuild.add_argument("--tenant", help="Only rebuild this tenant (shared or a user id)")
+
+    p_check = sub.add_parser("check", help="Compare the legacy collections and rollups against the comments collection")
+    p_check.add_argument("--tenant", help="Only check this tenant")
+    p_check.add_argument("--fix", action="store_true", help="Rebuild tenants that do not match")
+
+    p_watch = sub.add_parser("watch", help="Keep rollups up to date as new comments arrive")
+    p_watch.add_argument("--interval", type=float, default=5.0)
+
+    args = parser.parse_args()
+    verify_indexes(create=True)
+
+    if args.command == "watch":
+        watch(args.interval)
+        return
+
+    if args.command == "rebuild":
+        with rollup_lock(ttl=600) as lock:
+            catch_up(lock)
+            for tenant in [args.tenant] if args.tenant else tenants():
+                print(f"{tenant}: {rebuild(tenant, lock)} comments rolled up")
+        return
+
+    failed = set()
+    with rollup_lock(ttl=600) as lock:
+        catch_up(lock)
+        for name in legacy_comment_collections():
+            if args.tenant and tenant_for_collection(name) != args.tenant:
+                continue
+            missing = reconcile(name, fix=args.fix, lock=lock)
+            if missing:
+                print(f"{name}: {missing} comments missing from comments/rollups" + (", copied" if args.fix else ""))
+                failed.add(tenant_for_collection(name))
+        checked = [args.tenant] if args.tenant else tenants()
+        for tenant in checked:
+            problems = check(tenant)
+            for line in problems:
+                print(line)
+            if problems:
+                failed.add(tenant)
+                if args.fix:
+                    print(f"{tenant}: {rebuild(tenant, lock)} comments rolled up")
+    print(f"{len(checked) - len(failed)}/{len(checked)} tenants consistent")
+    if failed and not args.fix:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,309 +1,347 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from database import db_reddits, db_users, db
+from fastapi import APIRouter, Query, Depends, HTTPException, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from codec import FastJSONResponse
+from database import adb_users, adb_comments
 from sentiment.models import SentimentSummary
-from sentiment.utils import get_new_sentiments, capitalize_product_name, get_comments
+from sentiment.utils import (
+    get_summary, get_comments, get_weekly, get_monthly, get_dashboard,
+    get_comment_page, stream_comments, decode_cursor, get_timeseries, get_comparison
+)
+from sentiment.rollups import SHARED_TENANT, RollupBusy, normalize_product, bucket_count
+from sentiment.jobs import get_job, public_job, submit_job
+from sentiment.ingest import ingest_lines, split_lines
+from sentiment.prewarm import warm_product
+from sentiment.trending import TRENDING_TOP_K, get_trending
+from sentiment.search import search_comments
 from auth.utils import get_current_user, require_enterprise
-from bson.son import SON
-import requests
-import os
-import json
-import re
+from cache import cached, cached_many, cached_portfolio, invalidate, invalidate_user
+from datetime import datetime, date, timedelta
+from typing import Literal, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import hashlib
 
 # Import redis
-from database import redis
 
 router = APIRouter()
 
-CRAWL_API = os.getenv("CRAWL_API", "http://localhost:8090")
+MAX_DASHBOARD_PRODUCTS = 50
+MAX_COMPARE_PRODUCTS = 100
+MAX_TIMESERIES_BUCKETS = 1000
+# How far back /timeseries goes when `from` is not given, in days
+DEFAULT_TIMESERIES_SPAN = {"day": 30, "week": 7 * 12, "month": 365, "quarter": 2 * 365}
 
 
 # Fetch sentiment summary for a product
 @router.get("/summary", response_model=SentimentSummary)
-def get_sentiment_summary(
+async def get_sentiment_summary(
     product: str = Query(..., min_length=1),
     current_user: str = Depends(get_current_user)
 ):
-    cache_key = f"summary:{product.lower()}"
-    cached = redis.get(cache_key)
-    if cached:
-        return SentimentSummary(**json.loads(cached))
-
-    user_id = f"reddits_{current_user["_id"]}"
-    summary = get_new_sentiments(product, user_id)
-    if summary:
-        redis.set(cache_key, json.dumps(summary.dict()), ex=3600)
-        return summary
-    else:
-        return SentimentSummary(
-            product=capitalize_product_name(product),
-            total=0,
-            positive=0,
-            neutral=0,
-            negative=0,
-            irrelevant=0,
-        )
+    user_id = f"reddits_{current_user['_id']}"
+    # Sent as cached, it was a SentimentSummary when it was computed
+    output = await cached("summary", normalize_product(product), current_user, lambda: get_summary(product, user_id), raw=True)
+    return FastJSONResponse(content=output)
             
 
 # Fetch most popular comments for a product
 @router.get("/top-comments")
-def get_top_comments(
+async def get_top_comments(
     product: str = Query(..., min_length=1), 
-    limit: int = 10,
+    limit: int = Query(10, ge=1, le=100),
     current_user: str = Depends(get_current_user)
 ):    
     user_id = f"reddits_{current_user['_id']}"
-    comments = get_comments(product, user_id, limit)
-    return JSONResponse(content=comments)
+    comments = await get_comments(product, user_id, limit)
+    return FastJSONResponse(content=comments)
+
+
+# Page through a product's comments by score, or stream all of them as NDJSON
+@router.get("/comments")
+async def list_comments(
+    product: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    prediction: Optional[Literal["Positive", "Neutral", "Negative", "Irrelevant"]] = None,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    current_user: str = Depends(get_current_user)
+):
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    user_id = f"reddits_{current_user['_id']}"
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_comments(product, user_id, prediction, date_from, date_to, cursor),
+            media_type="application/x-ndjson"
+        )
+
+    page = await get_comment_page(product, user_id, limit, prediction, date_from, date_to, cursor)
+    return FastJSONResponse(content=page)
 
 
 # Aggreggate weekly sentiment data
 @router.get("/weekly")
-def get_weekly_sentiment(
+async def get_weekly_sentiment(
     product: str = Query(..., min_length=1),
     current_user: str = Depends(get_current_user)
 ):
-    cache_key = f"weekly:{product.lower()}"
-    cached = redis.get(cache_key)
-    if cached:
-        return JSONResponse(content=json.loads(cached))
-
-    pipeline = [
-        {"$match": {
-            "product": {"$regex": f"^{product}$", "$options": "i"},
-            "prediction": {"$in": ["Positive", "Neutral", "Negative"]},
-            "created": {"$type": "string"}
-        }},
-        {"$addFields": {
-            "created_date": {
-                "$dateFromString": {
-                    "dateString": "$created",
-                    "format": "%Y-%m-%d"
-                }
-            }
-        }},
-        {"$addFields": {
-            "week": {"$isoWeek": "$created_date"},
-            "year": {"$isoWeekYear": "$created_date"},
-            "month": {"$month": "$created_date"}
-        }},
-        {"$group": {
-            "_id": {
-                "year": "$year",
-                "month": "$month",
-                "week": "$week",
-                "prediction": "$prediction"
-            },
-            "count": {"$sum": 1}
-        }},
-        {"$group": {
-            "_id": {
-                "year": "$_id.year",
-                "month": "$_id.month",
-                "week": "$_id.week"
-            },
-            "counts": {
-                "$push": {
-                    "sentiment": "$_id.prediction",
-                    "count": "$count"
-                }
-            }
-        }},
-        {"$sort": SON([("_id.year", 1), ("_id.month", 1), ("_id.week", 1)])}
-    ]
-    results = db_reddits.aggregate(pipeline)
-    private_db = db[f"reddits_{current_user['_id']}"]
-    results_2 = private_db.aggregate(pipeline)
-    output = []
-    for item in results:
-        week_label = f"{item['_id']['year']}-{item['_id']['month']}-W{item['_id']['week']%4+1}"
-        data = {"week": week_label, "Positive": 0, "Neutral": 0, "Negative": 0}
-        for entry in item["counts"]:
-            data[entry["sentiment"]] = entry["count"]
-        output.append(data)
-    
-    for item in results_2:
-        week_label = f"{item['_id']['year']}-{item['_id']['month']}-W{item['_id']['week']%4+1}"
-        data = {"week": week_label, "Positive": 0, "Neutral": 0, "Negative": 0}
-        for entry in item["counts"]:
-            data[entry["sentiment"]] = entry["count"]
-        output.append(data)          
-    
-    redis.set(cache_key, json.dumps(output), ex=3600)
-    return JSONResponse(content=output)
+    user_id = f"reddits_{current_user['_id']}"
+    output = await cached("weekly", normalize_product(product), current_user, lambda: get_weekly(product, user_id), raw=True)
+    return FastJSONResponse(content=output)
 
 
 # Aggreggate monthly sentiment data
 @router.get("/monthly")
-def get_monthly_sentiment(
+async def get_monthly_sentiment(
     product: str = Query(..., min_length=1), 
     current_user: str = Depends(get_current_user)
 ):
-    cache_key = f"monthly:{product.lower()}"
-    cached = redis.get(cache_key)
-    if cached:
-        return JSONResponse(content=json.loads(cached))
-
-    pipeline = [
-        {"$match": {
-            "product": {"$regex": f"^{product}$", "$options": "i"},
-            "prediction": {"$in": ["Positive", "Neutral", "Negative"]},
-            "created": {"$type": "string"}
-        }},
-        {"$addFields": {
-            "created_date": {
-                "$dateFromString": {
-                    "dateString": "$created",
-                    "format": "%Y-%m-%d"
-                }
-            }
-        }},
-        {"$addFields": {
-            "year": {"$year": "$created_date"},
-            "month": {"$month": "$created_date"}
-        }},
-        {"$group": {
-            "_id": {
-                "year": "$year",
-                "month": "$month",
-                "prediction": "$prediction"
-            },
-            "count": {"$sum": 1}
-        }},
-        {"$group": {
-            "_id": {
-                "year": "$_id.year",
-                "month": "$_id.month"
-            },
-            "counts": {
-                "$push": {
-                    "sentiment": "$_id.prediction",
-                    "count": "$count"
-                }
-            }
-        }},
-        {"$sort": SON([("_id.year", 1), ("_id.month", 1)])}
-    ]
-    
-    results = db_reddits.aggregate(pipeline)
-    private_db = db[f"reddits_{current_user['_id']}"]
-    results_2 = private_db.aggregate(pipeline)
-    
-    output = []
-    for item in results:
-        month_label = f"{item['_id']['year']}-{item['_id']['month']:02}"
-        data = {"month": month_label, "Positive": 0, "Neutral": 0, "Negative": 0}
-        for entry in item["counts"]:
-            data[entry["sentiment"]] = entry["count"]
-        output.append(data)
-        
-    for item in results_2:
-        month_label = f"{item['_id']['year']}-{item['_id']['month']:02}"
-        data = {"month": month_label, "Positive": 0, "Neutral": 0, "Negative": 0}
-        for entry in item["counts"]:
-            data[entry["sentiment"]] = entry["count"]
-        output.append(data)
-
-    redis.set(cache_key, json.dumps(output), ex=3600) 
-    return JSONResponse(content=output)
+    user_id = f"reddits_{current_user['_id']}"
+    output = await cached("monthly", normalize_product(product), current_user, lambda: get_monthly(product, user_id), raw=True)
+    return FastJSONResponse(content=output)
+
 
+# Comments are dated by calendar day, so the timezone only decides what
+# "today" is when `to` is left out
+def resolve_range(granularity: str, date_from: Optional[date], date_to: Optional[date], tz: str) -> tuple[date, date]:
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz}")
+    date_to = date_to or datetime.now(zone).date()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_TIMESERIES_SPAN[granularity])
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if bucket_count(date_from, date_to, granularity) > MAX_TIMESERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TIMESERIES_BUCKETS} buckets per request")
+    return date_from, date_to
+
+
+# Sentiment counts per day/week/month/quarter, with a zero row for every
+# bucket that has no comments
+@router.get("/timeseries")
+async def get_sentiment_timeseries(
+    product: str = Query(..., min_length=1),
+    granularity: Literal["day", "week", "month", "quarter"] = "day",
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    tz: str = "UTC",
+    current_user: str = Depends(get_current_user)
+):
+    date_from, date_to = resolve_range(granularity, date_from, date_to, tz)
+    user_id = f"reddits_{current_user['_id']}"
+    output = await cached(
+        "timeseries", normalize_product(product), current_user,
+        lambda: get_timeseries(product, user_id, granularity, date_from, date_to),
+        variant=f"{granularity}:{date_from}:{date_to}",
+        raw=True,
+    )
+    return FastJSONResponse(content={
+        "product": product,
+        "granularity": granularity,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "buckets": output,
+    })
+
+
+# Comments of a product matching a full-text query, by relevance, with
+# highlighted snippets and match counts by prediction and month
+@router.get("/search")
+async def search_product_comments(
+    product: str = Query(..., min_length=1),
+    q: str = Query(..., min_length=2, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    prediction: Optional[Literal["Positive", "Neutral", "Negative", "Irrelevant"]] = None,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    user_id = f"reddits_{current_user['_id']}"
+    variant = hashlib.sha1("\x1f".join(map(str, (q, limit, prediction, date_from, date_to, cursor))).encode()).hexdigest()
+    output = await cached(
+        "search", normalize_product(product), current_user,
+        lambda: search_comments(product, user_id, q, limit, prediction, date_from, date_to, cursor),
+        variant=variant,
+        raw=True,
+    )
+    return FastJSONResponse(content=output)
+
+# Summaries and aligned time series for a set of products, by default the
+# caller's tracked products. Computed in one aggregation and cached per set.
+@router.get("/compare")
+async def compare_products(
+    products: Optional[list[str]] = Query(None, max_length=MAX_COMPARE_PRODUCTS),
+    granularity: Literal["day", "week", "month", "quarter"] = "week",
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    tz: str = "UTC",
+    current_user: str = Depends(get_current_user)
+):
+    # One entry per product key, in the order they were given
+    unique = {}
+    for product in products or current_user.get("tracked_products") or []:
+        if product.strip():
+            unique.setdefault(normalize_product(product), product.strip())
+    products = list(unique.values())
+    if not products:
+        raise HTTPException(status_code=400, detail="No products to compare")
+    if len(products) > MAX_COMPARE_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COMPARE_PRODUCTS} products per comparison")
+    date_from, date_to = resolve_range(granularity, date_from, date_to, tz)
+
+    user_id = f"reddits_{current_user['_id']}"
+    output = await cached_portfolio(
+        "compare", [normalize_product(p) for p in products], current_user,
+        lambda: get_comparison(products, user_id, granularity, date_from, date_to),
+        variant=f"{granularity}:{date_from}:{date_to}:" + "\x1f".join(products),
+        raw=True,
+    )
+    return FastJSONResponse(content={
+        "granularity": granularity,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "products": output,
+    })
+
+
+# Summary, top comments, weekly and monthly data for one or more products
+# in a single request
+@router.get("/dashboard")
+async def get_dashboard_batch(
+    products: list[str] = Query(..., min_length=1, max_length=MAX_DASHBOARD_PRODUCTS),
+    current_user: str = Depends(get_current_user)
+):
+    user_id = f"reddits_{current_user['_id']}"
+    product_keys = list(dict.fromkeys(normalize_product(product) for product in products))
+    results = await cached_many(
+        "dashboard", product_keys, current_user, lambda product_key: get_dashboard(product_key, user_id), raw=True
+    )
+    output = dict(zip(product_keys, results))
+    return FastJSONResponse(content={product: output[normalize_product(product)] for product in products})
+
+
+# Trending public products over the last TRENDING_BUCKETS hours, ranked by
+# volume, growth or rise in negative share (see sentiment/trending.py)
+@router.get("/trending")
+async def get_trending_products(
+    by: Literal["top", "rising", "negative"] = "top",
+    limit: int = Query(10, ge=1, le=TRENDING_TOP_K),
+    current_user: str = Depends(get_current_user)
+):
+    return FastJSONResponse(content={"by": by, **await get_trending(by, limit)})
 
 # Add a new tracked product to the user's list
 @router.post("/track-product")
-def add_tracked_product(product: str = Query(...), user=Depends(require_enterprise)):
+async def add_tracked_product(background: BackgroundTasks, product: str = Query(...), user=Depends(require_enterprise)):
     if product not in user["tracked_products"]:
-        db_users.update_one(
+        await adb_users.update_one(
             {"email": user["email"]},
             {"$addToSet": {"tracked_products": product}}
         )
-        redis.delete(f"user:{user['email'].lower()}")
+        await invalidate_user(user["email"])
+        # Have its dashboard cached before the user opens it
+        background.add_task(warm_product, user, product)
     return {"msg": f"Tracking {product}"}
 
 
 # Remove a tracked product from the user's list
 @router.post("/untrack-product")
-def untrack_product(product: str = Query(...), user=Depends(require_enterprise)):
-    db_users.update_one(
+async def untrack_product(product: str = Query(...), user=Depends(require_enterprise)):
+    await adb_users.update_one(
         {"email": user["email"]},
         {"$pull": {"tracked_products": product}}
     )
-    redis.delete(f"user:{user['email'].lower()}")
+    await invalidate_user(user["email"])
     return {"msg": f"Stopped tracking '{product}'"}
 
 
 # Fetch all tracked products for the user
 @router.get("/tracked-products")
-def get_tracked_products(user=Depends(require_enterprise)):
+async def get_tracked_products(user=Depends(require_enterprise)):
     return {"tracked_products": user.get("tracked_products", [])}
 
 
 # Submit analysis request for a product
 @router.post("/submit-analysis")
-def submit_analysis(
+async def submit_analysis(
     product: str = Query(...),
     time_filter: str = Query(...),  # "week", "month", "year"
     requester = Depends(require_enterprise)
 ):
-    premium_id = f"reddits_{requester["_id"]}"
-    exclusive_db = db[premium_id]
     # Validate time_filter choice
     if time_filter not in ["week", "month", "year"]:
         raise HTTPException(status_code=400, detail="Invalid time_filter")
 
     # Check if product exists in DB
-    latest_doc = exclusive_db.find_one(
-        {"product": {"$regex": f"^{product}$", "$options": "i"}},
-        sort=[("created", -1)]
+    latest_doc = await adb_comments.find_one(
+        {"tenant": str(requester["_id"]), "product_key": normalize_product(product)},
+        {"created_at": 1},
+        sort=[("created_at", -1)]
     )
 
-    if latest_doc and "created" in latest_doc:
-        try:
-            last_date = datetime.strptime(latest_doc["created"], "%Y-%m-%d")
-            now = datetime.utcnow()
-            delta_days = (now - last_date).days
-
-            if delta_days < 7:
-                raise HTTPException(status_code=400, detail="Product was crawled recently (less than 7 days ago).")
-            elif delta_days < 30 and time_filter in ["month", "year"]:
-                raise HTTPException(status_code=400, detail="Only 'week' is allowed. Too soon for 'month/year'.")
-            elif delta_days < 365 and time_filter == "year":
-                raise HTTPException(status_code=400, detail="Only 'week' or 'month' allowed. Too soon for 'year'.")
-        except ValueError:
-            raise HTTPException(status_code=500, detail="Invalid 'created' date format in DB.")
-
-    # Trigger the crawl
-    try:
-        res = requests.post(f"{CRAWL_API}/crawl", json={
-            "requester_id": str(requester["_id"]),
-            "keyword": product,
-            "subreddits": ["technology", "gadgets"],
-            "limit": 30,
-            "time_filter": time_filter
-        })
-        if res.status_code != 200:
-            raise HTTPException(status_code=500, detail="Crawl server failed")
+    if latest_doc and latest_doc.get("created_at"):
+        delta_days = (datetime.utcnow() - latest_doc["created_at"]).days
 
-        # Normalize the product name for consistent cache key casing
-        normalized_product = product.lower()
+        if delta_days < 7:
+            raise HTTPException(status_code=400, detail="Product was crawled recently (less than 7 days ago).")
+        elif delta_days < 30 and time_filter in ["month", "year"]:
+            raise HTTPException(status_code=400, detail="Only 'week' is allowed. Too soon for 'month/year'.")
+        elif delta_days < 365 and time_filter == "year":
+            raise HTTPException(status_code=400, detail="Only 'week' or 'month' allowed. Too soon for 'year'.")
+
+    # Queue the crawl, the dispatcher runs it and invalidates the caches once it's done
+    job, created = await submit_job(str(requester["_id"]), product, time_filter)
+    message = "Crawl queued" if created else "An identical crawl is already queued"
+    return JSONResponse(
+        status_code=202 if created else 200,
+        content={"message": message, "job": public_job(job)}
+    )
+
+
+# Status of a crawl job submitted by this user
+@router.get("/jobs/{job_id}")
+async def get_crawl_job(job_id: str, requester = Depends(require_enterprise)):
+    job = await get_job(job_id)
+    if not job or (job["user_id"] != str(requester["_id"]) and requester.get("role") != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(job)
 
-        # Remove stale cache entries
-        redis.delete(f"summary:{normalized_product}")
-        redis.delete(f"weekly:{normalized_product}")
-        redis.delete(f"monthly:{normalized_product}")
 
-        return {"message": "Crawl triggered successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+# Bulk-load NDJSON comments (one IngestComment per line) as the caller's
+# private comments, or as shared ones for admins
+@router.post("/ingest")
+async def ingest_comments(
+    request: Request,
+    target: Literal["private", "shared"] = Query("private"),
+    requester = Depends(require_enterprise)
+):
+    if target == "shared" and requester.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required to ingest shared comments")
+    tenant = SHARED_TENANT if target == "shared" else str(requester["_id"])
+    try:
+        return await ingest_lines(tenant, split_lines(request.stream()))
+    except RollupBusy:
+        raise HTTPException(status_code=503, detail="Rollups are being rebuilt, retry later", headers={"Retry-After": "60"})
 
 
 # Refresh and remove cache
 @router.post("/refresh-cache")
-def refresh_cache(
+async def refresh_cache(
     product: str = Query(..., min_length=1)
 ):
-    normalized_product = product.lower()
-    redis.delete(f"summary:{normalized_product}")
-    redis.delete(f"weekly:{normalized_product}")
-    redis.delete(f"monthly:{normalized_product}")
+    await invalidate(normalize_product(product))
     print(f"Cache for '{product}' refreshed successfully")
     return {"message": f"Cache for '{product}' refreshed successfully"}
\ No newline at end of file
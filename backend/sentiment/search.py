@@ -0,0 +1,149 @@
+import re
+from datetime import date
+from typing import Optional
+from database import adb_comments
+from sentiment.utils import COMMENT_FIELDS, after_position, comment_filter, decode_cursor, encode_cursor, public_comment
+
+# Full-text search over one product's comments, served by the
+# product_text index (product_key, then the comment text). Matches come back
+# by relevance with a highlighted snippet each, and the same aggregation
+# counts every match by prediction and by month for the facets.
+#
+# Queries use MongoDB's $text syntax: words are OR-ed and stemmed
+# ("batteries" finds "battery"), "quoted phrases" must appear as is and
+# -word excludes comments containing it.
+
+SNIPPET_CHARS = 160
+# Whole words shorter than this are highlighted, longer ones by their stem
+STEM_MIN = 4
+SUFFIXES = ("ing", "ies", "ied", "es", "ed", "ly", "s")
+
+# Words the index drops, so they are not highlighted either
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its my of on or so than that the this to was were with"
+    .split()
+)
+
+TERM_RE = re.compile(r'(-?)"([^"]+)"|(-?)(\S+)')
+
+
+# Phrases and words to highlight, leaving out negated ones
+def search_terms(query: str) -> list[str]:
+    terms = []
+    for negated_phrase, phrase, negated_word, word in TERM_RE.findall(query):
+        if phrase and not negated_phrase:
+            terms.append(phrase.strip())
+        elif word and not negated_word:
+            word = word.strip("\"'.,;:!?()")
+            if word:
+                terms.append(word)
+    return [t for t in terms if t.lower() not in STOPWORDS]
+
+
+# A rough stem, enough to find the forms of a word that $text matched
+def stem(word: str) -> str:
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= STEM_MIN:
+            return word[:-len(suffix)]
+    return word[:-1]
+
+
+def highlight_pattern(terms: list[str]) -> Optional[re.Pattern]:
+    parts = []
+    for term in sorted(set(t.lower() for t in terms), key=len, reverse=True):
+        if " " in term or len(term) <= STEM_MIN:
+            parts.append(r"\b" + re.escape(term) + r"\b")
+        else:
+            # Cover the stemmed forms the index matched: price, pricing -> priced, prices
+            parts.append(r"\b" + re.escape(stem(term)) + r"\w*")
+    return re.compile("|".join(parts), re.IGNORECASE) if parts else None
+
+
+# Up to SNIPPET_CHARS of text around the first match, with the (start, end)
+# of every match inside it. Offsets rather than markup, the text is user
+# content and is rendered as such.
+def snippet(text: str, pattern: Optional[re.Pattern], size: int = SNIPPET_CHARS) -> dict:
+    text = text or ""
+    first = pattern.search(text) if pattern else None
+    start = 0
+    if first and len(text) > size:
+        start = max(0, min(first.start() - size // 3, len(text) - size))
+        # Don't cut a word in half
+        if start:
+            space = text.find(" ", start, first.start())
+            start = space + 1 if space != -1 else start
+    end = min(len(text), start + size)
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > (first.end() if first else start) else end
+
+    prefix = "…" if start else ""
+    suffix = "…" if end < len(text) else ""
+    body = text[start:end]
+    highlights = []
+    if pattern:
+        highlights = [[m.start() + len(prefix), m.end() + len(prefix)] for m in pattern.finditer(body)]
+    return {"text": prefix + body + suffix, "highlights": highlights}
+
+
+def search_pipeline(query: dict, limit: int, cursor: Optional[str]) -> list[dict]:
+    page = [{"$sort": {"relevance": -1, "_id": -1}}, {"$limit": limit + 1}]
+    if cursor:
+        page.insert(0, {"$match": after_position({}, decode_cursor(cursor), "relevance")})
+    return [
+        {"$match": query},
+        {"$project": {**COMMENT_FIELDS, "created_at": 1, "relevance": {"$meta": "textScore"}}},
+        {"$facet": {
+            "comments": page,
+            "predictions": [{"$group": {"_id": "$prediction", "count": {"$sum": 1}}}],
+            "months": [
+                {"$match": {"created_at": {"$type": "date"}}},
+                {"$group": {"_id": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}}, "count": {"$sum": 1}}},
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+
+
+# One page of matches ordered by (relevance, _id) descending, keyset
+# paginated like get_comment_page. The facets always cover every match.
+async def search_comments(
+    product: str,
+    user_id: str,
+    query: str,
+    limit: int = 20,
+    prediction: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    match = {**comment_filter(product, user_id, prediction, date_from, date_to), "$text": {"$search": query}}
+    rows = await adb_comments.aggregate(search_pipeline(match, limit, cursor), allowDiskUse=True).to_list(None)
+    result = rows[0] if rows else {"comments": [], "predictions": [], "months": []}
+
+    docs = result["comments"]
+    next_cursor = None
+    if len(docs) > limit:
+        last = docs[limit - 1]
+        next_cursor = encode_cursor({"score": last["relevance"], "_id": last["_id"]})
+
+    pattern = highlight_pattern(search_terms(query))
+    comments = []
+    for doc in docs[:limit]:
+        comment = public_comment(doc)
+        comment.pop("created_at", None)
+        comment["relevance"] = round(comment["relevance"], 4)
+        comment["snippet"] = snippet(doc.get("text"), pattern)
+        comments.append(comment)
+
+    predictions = {row["_id"]: row["count"] for row in result["predictions"] if row["_id"]}
+    return {
+        "query": query,
+        "total": sum(row["count"] for row in result["predictions"]),
+        "comments": comments,
+        "next_cursor": next_cursor,
+        "facets": {
+            "prediction": predictions,
+            "month": [{"month": row["_id"], "count": row["count"]} for row in result["months"]],
+        },
+    }
@@ -0,0 +1,353 @@
+import hashlib
+import heapq
+import os
+import time
+import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from database import db_comments, db_alert, redis, aredis
+from codec import dumps, loads
+from sentiment.rollups import SENTIMENTS, SHARED_TENANT, normalize_product
+
+# Trending products over the shared comments, kept in bounded memory by one
+# consumer process:
+#
+#   - comments are bucketed by the time they reached `comments` (inserted_at,
+#     set by the tailer and by ingestion; crawled comments keep the older _id
+#     of their legacy copy), one bucket per TRENDING_BUCKET seconds, and the
+#     last 2 * TRENDING_BUCKETS buckets are kept: the current window and the
+#     one before it. Comments created before that (a backfill) are skipped.
+#   - per bucket and sentiment, a count-min sketch estimates each product's
+#     count and a space-saving table keeps the TRENDING_CAPACITY heaviest
+#     products, which are the candidates when ranking
+#
+# Every TRENDING_PUBLISH seconds the consumer ranks the candidates and stores
+# the top TRENDING_TOP_K of each list in Redis (trending:snapshot), which
+# /sentiment/trending serves as is:
+#
+#   top        most comments in the current window
+#   rising     biggest growth over the previous window
+#   negative   biggest rise in the share of negative comments
+#
+# New comments come from a change stream on `comments` when MongoDB runs as
+# a replica set, otherwise from polling on (inserted_at, _id). Private
+# tenants' comments are left out.
+
+TRENDING_BUCKET = int(os.getenv("TRENDING_BUCKET", "3600"))
+TRENDING_BUCKETS = int(os.getenv("TRENDING_BUCKETS", "24"))
+TRENDING_CAPACITY = int(os.getenv("TRENDING_CAPACITY", "200"))
+TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "50"))
+TRENDING_PUBLISH = float(os.getenv("TRENDING_PUBLISH", "60"))
+# Products with fewer comments in the current window are not ranked
+TRENDING_MIN_COUNT = int(os.getenv("TRENDING_MIN_COUNT", "20"))
+# "auto" (change stream, polling if unavailable), "changestream" or "poll"
+TRENDING_SOURCE = os.getenv("TRENDING_SOURCE", "auto")
+# Write a monitor alert when a product's negative share rises by this much
+# (0.2 = 20 points) over the previous window; 0 turns alerts off
+TRENDING_ALERT_JUMP = float(os.getenv("TRENDING_ALERT_JUMP", "0.2"))
+TRENDING_ALERT_MIN_COUNT = int(os.getenv("TRENDING_ALERT_MIN_COUNT", "50"))
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+# Comments stamped this recently are left for the next poll, so a batch that
+# is still being written, or a writer whose clock is a little behind, is not
+# skipped
+POLL_LAG = float(os.getenv("TRENDING_POLL_LAG", "10"))
+POLL_INTERVAL = 2.0
+
+SNAPSHOT_KEY = "trending:snapshot"
+LOCK_KEY = "trending:lock"
+LISTS = ("top", "rising", "negative")
+
+
+def cells(key: str, width: int = CMS_WIDTH, depth: int = CMS_DEPTH) -> list[int]:
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % width for i in range(depth)]
+
+
+class CountMinSketch:
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.rows = [array("I", bytes(4 * width)) for _ in range(depth)]
+
+    def add(self, positions: list[int], n: int = 1):
+        for row, i in zip(self.rows, positions):
+            row[i] += n
+
+    def estimate(self, positions: list[int]) -> int:
+        return min(row[i] for row, i in zip(self.rows, positions))
+
+
+# Space-saving: exact for products that stay in the table, and any product
+# with more than total / capacity comments is guaranteed to be in it
+class SpaceSaving:
+    def __init__(self, capacity: int = TRENDING_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key: str, n: int = 1):
+        if key in self.counts:
+            self.counts[key] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = n
+        else:
+            smallest = min(self.counts, key=self.counts.get)
+            self.counts[key] = self.counts.pop(smallest) + n
+
+
+class Bucket:
+    def __init__(self, start: int):
+        self.start = start
+        self.counts = {s: CountMinSketch() for s in SENTIMENTS}
+        self.heavy = {s: SpaceSaving() for s in SENTIMENTS}
+
+    def add(self, product_key: str, prediction: str):
+        self.counts[prediction].add(cells(product_key))
+        self.heavy[prediction].add(product_key)
+
+
+# pymongo returns naive UTC datetimes
+def timestamp(value: datetime) -> float:
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def utc_ago(seconds: float) -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=seconds)
+
+
+class TrendingWindow:
+    def __init__(self, bucket_seconds: int = TRENDING_BUCKET, buckets: int = TRENDING_BUCKETS):
+        self.bucket_seconds = bucket_seconds
+        self.window = buckets
+        self.buckets = {}
+        self.names = {}
+
+    def bucket_of(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds) * self.bucket_seconds
+
+    def add(self, doc: dict, now: float):
+        prediction = doc.get("prediction")
+        product_key = doc.get("product_key") or normalize_product(doc.get("product") or "")
+        if prediction not in SENTIMENTS or not product_key or doc.get("inserted_at") is None:
+            return
+        oldest = self.bucket_of(now) - 2 * self.window * self.bucket_seconds
+        # created_at is the day the comment was written
+        if doc.get("created_at") and timestamp(doc["created_at"]) + 86400 <= oldest:
+            return
+        start = self.bucket_of(timestamp(doc["inserted_at"]))
+        if start <= oldest:
+            return
+        if start not in self.buckets:
+            self.buckets[start] = Bucket(start)
+        self.buckets[start].add(product_key, prediction)
+        self.names.setdefault(product_key, doc.get("product") or product_key)
+
+    def expire(self, now: float):
+        oldest = self.bucket_of(now) - 2 * self.window * self.bucket_seconds
+        for start in [s for s in self.buckets if s <= oldest]:
+            del self.buckets[start]
+
+    def counts(self, buckets: list[Bucket], positions: list[int]) -> dict:
+        return {s: sum(b.counts[s].estimate(positions) for b in buckets) for s in SENTIMENTS}
+
+    def rank(self, now: float, top_k: int = TRENDING_TOP_K, min_count: int = TRENDING_MIN_COUNT) -> dict:
+        self.expire(now)
+        boundary = self.bucket_of(now) - (self.window - 1) * self.bucket_seconds
+        current = [b for b in self.buckets.values() if b.start >= boundary]
+        previous = [b for b in self.buckets.values() if b.start < boundary]
+        candidates = {key for b in current for table in b.heavy.values() for key in table.counts}
+
+        rows = []
+        for product_key in candidates:
+            positions = cells(product_key)
+            now_counts = self.counts(current, positions)
+            before_counts = self.counts(previous, positions)
+            count, before = sum(now_counts.values()), sum(before_counts.values())
+            if count < min_count:
+                continue
+            negative_share = now_counts["Negative"] / count
+            previous_share = before_counts["Negative"] / before if before else None
+            rows.append({
+                "product": self.names.get(product_key, product_key),
+                "product_key": product_key,
+                "count": count,
+                "previous_count": before,
+                "growth": round(count / max(before, 1), 3),
+                **now_counts,
+                "negative_share": round(negative_share, 3),
+                "previous_negative_share": round(previous_share, 3) if previous_share is not None else None,
+                "negative_jump": round(negative_share - previous_share, 3) if previous_share is not None else None,
+            })
+
+        # Keep display names only for products that can still be ranked
+        self.names = {key: name for key, name in self.names.items() if key in candidates}
+        return {
+            "top": heapq.nlargest(top_k, rows, key=lambda r: r["count"]),
+            "rising": heapq.nlargest(top_k, rows, key=lambda r: (r["growth"], r["count"])),
+            "negative": heapq.nlargest(
+                top_k, [r for r in rows if r["negative_jump"] is not None], key=lambda r: (r["negative_jump"], r["count"])
+            ),
+        }
+
+
+# ---- Consumer ----
+
+FIELDS = {"product": 1, "product_key": 1, "prediction": 1, "created_at": 1, "inserted_at": 1}
+
+
+# Reads the comments after `position`, an (inserted_at, _id) pair, and
+# returns the position of the last one read
+def poll(window: TrendingWindow, position: tuple, batch_size: int = 5000) -> tuple:
+    inserted_at, last_id = position
+    query = {
+        "tenant": SHARED_TENANT,
+        "inserted_at": {"$gte": inserted_at, "$lt": utc_ago(POLL_LAG)},
+        "$or": [{"inserted_at": {"$gt": inserted_at}}, {"_id": {"$gt": last_id}}],
+    }
+    now = time.time()
+    cursor = db_comments.find(query, FIELDS).sort([("inserted_at", ASCENDING), ("_id", ASCENDING)]).limit(batch_size)
+    for doc in cursor:
+        window.add(doc, now)
+        position = (doc["inserted_at"], doc["_id"])
+    return position
+
+
+def open_change_stream():
+    if TRENDING_SOURCE == "poll":
+        return None
+    pipeline = [{"$match": {"operationType": "insert", "fullDocument.tenant": SHARED_TENANT}}]
+    try:
+        return db_comments.watch(pipeline)
+    except (OperationFailure, NotImplementedError) as e:
+        if TRENDING_SOURCE == "changestream":
+            raise
+        print(f"Change streams unavailable ({e}), polling comments instead")
+        return None
+
+
+def publish(window: TrendingWindow):
+    now = time.time()
+    ranked = window.rank(now)
+    snapshot = {
+        "updated": datetime.now(timezone.utc).isoformat(),
+        "window_hours": round(window.window * window.bucket_seconds / 3600, 2),
+        **ranked,
+    }
+    redis.set(SNAPSHOT_KEY, dumps(snapshot), ex=int(10 * TRENDING_PUBLISH))
+    if TRENDING_ALERT_JUMP:
+        emit_alerts(ranked["negative"], window.window * window.bucket_seconds)
+
+
+# One alert per product per window
+def emit_alerts(rows: list[dict], window_seconds: int):
+    for row in rows:
+        if row["negative_jump"] < TRENDING_ALERT_JUMP or row["count"] < TRENDING_ALERT_MIN_COUNT:
+            continue
+        if not redis.set(f"trending:alerted:{row['product_key']}", 1, nx=True, ex=window_seconds):
+            continue
+        db_alert.insert_one({
+            "timestamp": datetime.utcnow(),
+            "type": "negative_spike",
+            "test_case": f"Negative share of {row['product']}",
+            "description": (
+                f"{row['negative_share']:.0%} of {row['count']} comments are negative, "
+                f"up from {row['previous_negative_share']:.0%} in the previous window"
+            ),
+            "status": "WARNING",
+        })
+
+
+def renew_lock(token: str, ttl: int) -> bool:
+    if redis.get(LOCK_KEY) != token:
+        return False
+    redis.expire(LOCK_KEY, ttl)
+    return True
+
+
+# Rebuild the window from the last two windows of comments, then follow new
+# ones until stopped or the lock is lost
+def consume(stop, token: str, lock_ttl: int):
+    window = TrendingWindow()
+    stream = open_change_stream()
+    position = (utc_ago(2 * window.window * window.bucket_seconds), ObjectId("0" * 24))
+    while True:
+        newest = poll(window, position)
+        if newest == position:
+            break
+        position = newest
+    print(f"Trending: replayed the last {2 * window.window} buckets, following "
+          f"{'the change stream' if stream else 'comments by polling'}")
+
+    next_publish = 0.0
+    try:
+        while stop is None or not stop.is_set():
+            if time.monotonic() >= next_publish:
+                if not renew_lock(token, lock_ttl):
+                    print("Trending: lost the consumer lock")
+                    return
+                publish(window)
+                next_publish = time.monotonic() + TRENDING_PUBLISH
+            if stream is not None:
+                change = stream.try_next()
+                if change is None:
+                    time.sleep(0.2)
+                    continue
+                doc = change["fullDocument"]
+                # Already counted by the replay
+                if doc.get("inserted_at") and (doc["inserted_at"], doc["_id"]) > position:
+                    window.add(doc, time.time())
+            else:
+                newest = poll(window, position)
+                if newest == position:
+                    if stop is not None:
+                        stop.wait(POLL_INTERVAL)
+                    else:
+                        time.sleep(POLL_INTERVAL)
+                position = newest
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+# Runs in a thread of one API worker (TRENDING_WATCH=1) or as a sidecar; the
+# Redis lock keeps a single consumer across them
+def watch(stop=None):
+    token = uuid.uuid4().hex
+    lock_ttl = int(3 * TRENDING_PUBLISH)
+    while stop is None or not stop.is_set():
+        try:
+            if redis.set(LOCK_KEY, token, nx=True, ex=lock_ttl):
+                try:
+                    consume(stop, token, lock_ttl)
+                finally:
+                    if redis.get(LOCK_KEY) == token:
+                        redis.delete(LOCK_KEY)
+        except Exception as e:
+            print(f"Trending consumer error: {e}")
+        if stop is not None:
+            stop.wait(TRENDING_PUBLISH)
+        else:
+            time.sleep(TRENDING_PUBLISH)
+
+
+# ---- Read side ----
+
+async def get_trending(by: str, limit: int) -> dict:
+    raw = await aredis.get(SNAPSHOT_KEY)
+    if raw is None:
+        return {"updated": None, "window_hours": None, "products": []}
+    snapshot = loads(raw)
+    return {"updated": snapshot["updated"], "window_hours": snapshot["window_hours"], "products": snapshot[by][:limit]}
+
+
+def main():
+    try:
+        watch()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
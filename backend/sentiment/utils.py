@@ -1,30 +1,38 @@
+import asyncio
+import base64
+import json
 from collections import Counter
+from datetime import date, datetime, timedelta
 from typing import Optional
+from bson import ObjectId
 from fastapi.responses import JSONResponse
 from sentiment.models import SentimentSummary
-from database import db_reddits, db
+from database import adb_comments
+from codec import dumps
+from sentiment.rollups import (
+    SHARED_TENANT, normalize_product, summary_counts, tenant_for_collection,
+    daily_counts, weekly_buckets, monthly_buckets, histogram, portfolio_counts
+)
 
 def capitalize_product_name(product: str) -> str:
     # Capitalize the first letter of each word in the product name
     return ' '.join(word.capitalize() for word in product.split())
 
 
-def get_new_sentiments(product: str, user_id: str) -> Optional[SentimentSummary]:
-    def query_sentiments(collection, product: str):
-        cursor = collection.find({"product": {"$regex": f"^{product}$", "$options": "i"}})
-        return [doc.get("prediction") for doc in cursor if doc.get("prediction") in ["Positive", "Neutral", "Negative"]]
-
+async def get_new_sentiments(product: str, user_id: str) -> Optional[SentimentSummary]:
     # Thử tìm trong db_reddits
-    sentiments = query_sentiments(db_reddits, product)
+    counts = await summary_counts(product, SHARED_TENANT)
 
     # Nếu không có kết quả, thử private db
-    db_private = db[user_id]
-    if not sentiments:
-        sentiments = query_sentiments(db_private, product)
-        if not sentiments:
+    if not counts:
+        counts = await summary_counts(product, tenant_for_collection(user_id))
+        if not counts:
             return None  # Không có dữ liệu ở cả 2 nơi
 
-    counts = Counter(sentiments)
+    return summary_from_counts(product, counts)
+
+
+def summary_from_counts(product: str, counts: Counter) -> SentimentSummary:
     total = sum(counts.values())
     
     product_name = capitalize_product_name(product)
@@ -39,22 +47,187 @@ def get_new_sentiments(product: str, user_id: str) -> Optional[SentimentSummary]
     return summary
 
 
-def get_comments(product: str, user_id: str, limit=10):
-    def query_comments(collection, product: str, limit=10):
-        cursor = collection.find(
-            {"product": {"$regex": f"^{product}$", "$options": "i"}},
-            {"_id": 0, "text": 1, "author": 1, "score": 1, "created": 1, "prediction": 1}
-        ).sort("score", -1).limit(limit)
-        return list(cursor)
+def empty_summary(product: str) -> SentimentSummary:
+    return SentimentSummary(
+        product=capitalize_product_name(product),
+        total=0,
+        positive=0,
+        neutral=0,
+        negative=0,
+        irrelevant=0,
+    )
 
-    # Thử tìm trong db_reddits
-    comments = query_comments(db_reddits, product)
 
-    # Nếu không có kết quả, thử private db
-    db_private = db[user_id]
-    if not comments:
-        comments = query_comments(db_private, product)
-        if not comments:
-            return []
+# What /summary caches: the summary as a dict, zeros when there is no data
+async def get_summary(product: str, user_id: str) -> dict:
+    summary = await get_new_sentiments(product, user_id)
+    return (summary or empty_summary(product)).dict()
+
+
+# Shared and private comments are counted together, one bucket per period
+def visible_tenants(user_id: str) -> list[str]:
+    return [SHARED_TENANT, tenant_for_collection(user_id)]
+
+
+async def get_weekly(product: str, user_id: str) -> list[dict]:
+    return weekly_buckets(await daily_counts(product, visible_tenants(user_id)))
+
+
+async def get_monthly(product: str, user_id: str) -> list[dict]:
+    return monthly_buckets(await daily_counts(product, visible_tenants(user_id)))
+
+
+# Sentiment counts per day/week/month/quarter between two dates (inclusive)
+async def get_timeseries(product: str, user_id: str, granularity: str, date_from: date, date_to: date) -> list[dict]:
+    rows = await daily_counts(product, visible_tenants(user_id), date_from, date_to)
+    return histogram(rows, granularity, date_from, date_to)
+
+
+# Summaries and aligned time series for several products from one
+# aggregation. Summaries prefer shared data like get_new_sentiments, the
+# series merge shared and private comments like get_timeseries.
+async def get_comparison(
+    products: list[str], user_id: str, granularity: str, date_from: date, date_to: date
+) -> list[dict]:
+    keys = [normalize_product(product) for product in products]
+    totals, days = await portfolio_counts(keys, visible_tenants(user_id), date_from, date_to)
+
+    by_tenant = {}
+    for row in totals:
+        by_tenant.setdefault((row["product_key"], row["tenant"]), Counter())[row["prediction"]] += row["count"]
+    by_product = {}
+    for row in days:
+        by_product.setdefault(row["product_key"], []).append(row)
+
+    output = []
+    for product, key in zip(products, keys):
+        counts = by_tenant.get((key, SHARED_TENANT)) or by_tenant.get((key, tenant_for_collection(user_id)))
+        summary = summary_from_counts(product, counts) if counts else empty_summary(product)
+        output.append({
+            "product": product,
+            "summary": summary.dict(),
+            "series": histogram(by_product.get(key, []), granularity, date_from, date_to),
+        })
+    return output
+
+
+# Everything the dashboard shows for one product. The sub-queries run
+# concurrently and the daily rollup rows are read once for both trend views.
+async def get_dashboard(product: str, user_id: str) -> dict:
+    summary, comments, days = await asyncio.gather(
+        get_new_sentiments(product, user_id),
+        get_comments(product, user_id),
+        daily_counts(product, visible_tenants(user_id)),
+    )
+    return {
+        "summary": (summary or empty_summary(product)).dict(),
+        "top_comments": comments,
+        "weekly": weekly_buckets(days),
+        "monthly": monthly_buckets(days),
+    }
+
+
+COMMENT_FIELDS = {"_id": 1, "text": 1, "author": 1, "score": 1, "created": 1, "prediction": 1}
+
+
+# Continuation tokens are opaque to clients: base64 of the (score, _id) of
+# the last comment returned
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps({"score": doc.get("score"), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        position["id"] = ObjectId(position["id"])
+        return position
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def comment_filter(
+    product: str,
+    user_id: str,
+    prediction: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+) -> dict:
+    query = {"tenant": {"$in": visible_tenants(user_id)}, "product_key": normalize_product(product)}
+    if prediction:
+        query["prediction"] = prediction
+    if date_from or date_to:
+        query["created_at"] = {}
+        if date_from:
+            query["created_at"]["$gte"] = datetime.combine(date_from, datetime.min.time())
+        if date_to:
+            query["created_at"]["$lt"] = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    return query
+
+
+# Comments without a score sort last in descending order, after every scored
+# one, and by _id among themselves
+def after_position(query: dict, position: dict, field: str = "score") -> dict:
+    if position["score"] is None:
+        return {**query, field: None, "_id": {"$lt": position["id"]}}
+    return {**query, "$or": [
+        {field: {"$lt": position["score"]}},
+        {field: position["score"], "_id": {"$lt": position["id"]}},
+        {field: None},
+    ]}
+
+
+# Shared and private comments come out of one query, merged by (score, _id)
+def comment_query(product: str, user_id: str, prediction, date_from, date_to, cursor: Optional[str]) -> dict:
+    query = comment_filter(product, user_id, prediction, date_from, date_to)
+    if cursor:
+        query = after_position(query, decode_cursor(cursor))
+    return query
+
+
+def public_comment(doc: dict) -> dict:
+    doc = dict(doc)
+    doc.pop("_id", None)
+    return doc
+
+
+# One page of comments ordered by (score, _id) descending, keyset paginated
+async def get_comment_page(
+    product: str,
+    user_id: str,
+    limit: int = 10,
+    prediction: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    query = comment_query(product, user_id, prediction, date_from, date_to, cursor)
+    docs = await (
+        adb_comments.find(query, COMMENT_FIELDS)
+        .sort([("score", -1), ("_id", -1)])
+        .limit(limit + 1)
+        .to_list(None)
+    )
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return {"comments": [public_comment(doc) for doc in docs[:limit]], "next_cursor": next_cursor}
+
+
+# Same ordering as get_comment_page, yielded one NDJSON line at a time
+# straight from the Mongo cursor
+async def stream_comments(
+    product: str,
+    user_id: str,
+    prediction: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    cursor: Optional[str] = None,
+):
+    query = comment_query(product, user_id, prediction, date_from, date_to, cursor)
+    docs = adb_comments.find(query, COMMENT_FIELDS).sort([("score", -1), ("_id", -1)]).batch_size(1000)
+    async for doc in docs:
+        yield dumps(public_comment(doc)) + b"\n"
+
 
-    return comments
\ No newline at end of file
+async def get_comments(product: str, user_id: str, limit=10):
+    page = await get_comment_page(product, user_id, limit)
+    return page["comments"]
@@ -0,0 +1,84 @@
+import os
+
+# Blocking clients behind the aio facades, so the routes run unchanged on
+# the in-memory Mongo and Redis below
+os.environ["ASYNC_IO"] = "0"
+
+import asyncio
+import fakeredis
+import mongomock
+import pytest
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.collection import Collection
+
+import database
+from aio import ThreadedClient, ThreadedCollection, ThreadedRedis
+
+
+# mongomock's bulk_write does not accept the operations of pymongo >= 4.9
+class BulkWriteResult:
+    def __init__(self):
+        self.upserted_ids = {}
+        self.inserted_count = self.matched_count = self.modified_count = self.deleted_count = 0
+
+    @property
+    def upserted_count(self):
+        return len(self.upserted_ids)
+
+
+def bulk_write(self, requests, ordered=True, **kwargs):
+    result = BulkWriteResult()
+    for i, op in enumerate(requests):
+        if isinstance(op, InsertOne):
+            self.insert_one(op._doc)
+            result.inserted_count += 1
+        elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+            method = {UpdateOne: self.update_one, UpdateMany: self.update_many, ReplaceOne: self.replace_one}[type(op)]
+            res = method(op._filter, op._doc, upsert=op._upsert)
+            if res.upserted_id is not None:
+                result.upserted_ids[i] = res.upserted_id
+            else:
+                result.matched_count += res.matched_count
+                result.modified_count += res.modified_count
+        elif isinstance(op, (DeleteOne, DeleteMany)):
+            method = self.delete_one if isinstance(op, DeleteOne) else self.delete_many
+            result.deleted_count += method(op._filter).deleted_count
+    return result
+
+
+mongomock.collection.Collection.bulk_write = bulk_write
+
+mongo = mongomock.MongoClient()
+redis_server = fakeredis.FakeServer()
+
+database.client = mongo
+database.aclient = ThreadedClient(mongo)
+for name, value in list(vars(database).items()):
+    if isinstance(value, Collection):
+        setattr(database, name, mongo[value.database.name][value.name])
+    elif isinstance(value, ThreadedCollection):
+        setattr(database, name, database.aclient[value._collection.database.name][value._collection.name])
+database.db, database.dbr = mongo["main"], mongo["reports"]
+database.adb, database.adbr = database.aclient["main"], database.aclient["reports"]
+database.redis = fakeredis.FakeRedis(server=redis_server, decode_responses=True)
+database.redis_raw = fakeredis.FakeRedis(server=redis_server)
+database.aredis = ThreadedRedis(database.redis)
+database.aredis_raw = ThreadedRedis(database.redis_raw)
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    import cache
+    for name in mongo.list_database_names():
+        mongo.drop_database(name)
+    database.redis.flushall()
+    cache.local_cache.clear()
+    cache.stats.clear()
+    cache.accesses.clear()
+    yield
+
+
+# Runs a coroutine to completion, for tests of the async helpers
+@pytest.fixture
+def run():
+    return asyncio.run
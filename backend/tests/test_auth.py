@@ -0,0 +1,111 @@
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from passlib.context import CryptContext
+import database
+import main
+from auth import hashing, utils
+from cache import local_cache
+
+USER = {"email": "a@example.com", "username": "a", "password": "old-password"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_WORKERS", 0)
+    monkeypatch.setattr(hashing, "pwd_context", CryptContext(schemes=["bcrypt"], bcrypt__rounds=4))
+    client = TestClient(main.app)
+    assert client.post("/auth/register", json=USER).status_code == 200
+    return client
+
+
+def login(client, password: str = USER["password"]) -> dict:
+    response = client.post("/auth/login", json={"email": USER["email"], "password": password})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_verified_claims_are_cached(client, monkeypatch):
+    headers = login(client)
+    assert client.get("/auth/me", headers=headers).status_code == 200
+    token = headers["Authorization"].removeprefix("Bearer ")
+    assert local_cache.get(f"token:{utils.token_hash(token)}")["sub"] == USER["email"]
+
+    def fail(token):
+        raise AssertionError("decoded again")
+    monkeypatch.setattr(utils, "decode_access_token", fail)
+    assert client.get("/auth/me", headers=headers).json()["email"] == USER["email"]
+
+
+def test_logout_revokes_a_cached_token(client):
+    headers, other = login(client), login(client)
+    assert client.get("/auth/me", headers=headers).status_code == 200
+    assert client.post("/auth/logout", headers=headers).status_code == 200
+    assert client.get("/auth/me", headers=headers).status_code == 401
+    assert client.get("/auth/me", headers=other).status_code == 200
+
+
+def test_password_change_signs_out_every_session(client):
+    headers, other = login(client), login(client)
+    for h in (headers, other):
+        assert client.get("/auth/me", headers=h).status_code == 200
+    change = {"old_password": USER["password"], "new_password": "new-password"}
+    assert client.post("/auth/change-password", json=change, headers=headers).status_code == 200
+
+    assert client.get("/auth/me", headers=headers).status_code == 401
+    assert client.get("/auth/me", headers=other).status_code == 401
+    # Within the same second as the change
+    fresh = login(client, "new-password")
+    assert client.get("/auth/me", headers=fresh).status_code == 200
+
+
+def test_failed_logins_are_throttled(client, monkeypatch):
+    monkeypatch.setattr(utils, "LOGIN_EMAIL_FAILURES", 3)
+    for _ in range(3):
+        assert client.post("/auth/login", json={"email": USER["email"], "password": "wrong"}).status_code == 401
+    # Blocked before the password is checked, even the right one
+    blocked = client.post("/auth/login", json={"email": USER["email"], "password": USER["password"]})
+    assert blocked.status_code == 429
+    assert 0 < int(blocked.headers["retry-after"]) <= utils.LOGIN_WINDOW
+
+    database.redis.delete(f"login:failures:email:{USER['email']}")
+    login(client)
+    assert database.redis.get(f"login:failures:email:{USER['email']}") is None
+
+
+def test_failures_are_counted_per_ip(run, monkeypatch):
+    monkeypatch.setattr(utils, "LOGIN_IP_FAILURES", 2)
+    run(utils.record_login_failure("a@example.com", "10.0.0.1"))
+    run(utils.record_login_failure("b@example.com", "10.0.0.1"))
+    with pytest.raises(HTTPException) as e:
+        run(utils.check_login_throttle("c@example.com", "10.0.0.1"))
+    assert e.value.status_code == 429
+    run(utils.check_login_throttle("c@example.com", "10.0.0.2"))
+
+
+def test_hashing_is_refused_when_the_queue_is_full(client, monkeypatch):
+    monkeypatch.setattr(hashing, "HASH_QUEUE_SIZE", 0)
+    response = client.post("/auth/login", json={"email": USER["email"], "password": USER["password"]})
+    assert response.status_code == 503 and response.headers["retry-after"] == "1"
+
+
+def test_broken_pool_is_shut_down_and_replaced(run, monkeypatch):
+    class BrokenPool(Executor):
+        shut_down = False
+
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_exception(BrokenProcessPool())
+            return future
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.shut_down = True
+
+    broken = BrokenPool()
+    monkeypatch.setattr(hashing, "_pool", broken)
+    with pytest.raises(HTTPException) as e:
+        run(hashing.verify_password_async("x", "y"))
+    assert e.value.status_code == 503
+    assert broken.shut_down and hashing._pool is None and hashing._in_flight == 0
@@ -0,0 +1,118 @@
+import asyncio
+import time
+import pytest
+import cache
+import database
+from codec import Entry, pack_entry
+
+USER = {"_id": "t1", "role": "enterprise"}
+
+
+@pytest.fixture
+def counted():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"n": len(calls)}
+
+    compute.calls = calls
+    return compute
+
+
+def store_stale(key: str, value):
+    database.redis_raw.set(key, pack_entry(Entry.of(value, -1)))
+
+
+def test_concurrent_misses_compute_once(run, counted):
+    async def go():
+        return await asyncio.gather(*(cache.cached("summary", "switch 2", None, counted) for _ in range(5)))
+
+    assert run(go()) == [{"n": 1}] * 5
+    assert len(counted.calls) == 1
+    # Served from the local tier afterwards
+    assert run(cache.cached("summary", "switch 2", None, counted)) == {"n": 1}
+    assert cache.stats[("summary", "local_hits")] == 1
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(run, counted):
+    [key] = run(cache.entry_keys("summary", ["switch 2"], None))
+    store_stale(key, {"n": 0})
+
+    async def go():
+        values = await asyncio.gather(*(cache.cached("summary", "switch 2", None, counted) for _ in range(3)))
+        await asyncio.sleep(0.05)
+        return values
+
+    assert run(go()) == [{"n": 0}] * 3
+    assert len(counted.calls) == 1
+    assert run(cache.cached("summary", "switch 2", None, counted)) == {"n": 1}
+
+
+def test_miss_during_background_refresh_held_elsewhere(run, counted, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_WAIT_TIMEOUT", 2)
+    [key] = run(cache.entry_keys("summary", ["switch 2"], None))
+    # Another worker is refreshing this key
+    database.redis.set(f"lock:{key}", "other")
+
+    async def other_worker():
+        await asyncio.sleep(0.1)
+        database.redis_raw.set(key, pack_entry(Entry.of({"n": "other"}, 60)))
+        database.redis.delete(f"lock:{key}")
+
+    async def go():
+        background = cache._single_flight("summary", key, counted, 60, wait=False)
+        writer = asyncio.create_task(other_worker())
+        value = await cache.cached("summary", "switch 2", None, counted)
+        await writer
+        return await background, value
+
+    background, value = run(go())
+    assert background is None
+    assert value == {"n": "other"}
+    assert not counted.calls
+
+
+def test_invalidation_bumps_the_generation(run, counted):
+    assert run(cache.cached("summary", "switch 2", USER, counted)) == {"n": 1}
+    # Another product's or tenant's changes leave the entry alone
+    run(cache.invalidate("switch", "t1"))
+    run(cache.invalidate("switch 2", "t2"))
+    assert run(cache.cached("summary", "switch 2", USER, counted)) == {"n": 1}
+
+    run(cache.invalidate("switch 2", "t1"))
+    assert run(cache.cached("summary", "switch 2", USER, counted)) == {"n": 2}
+    cache.invalidate_sync("switch 2")
+    # invalidate_sync only publishes; the listener drops the local copy
+    cache.local_cache.delete(cache.generation_key("switch 2"))
+    assert run(cache.cached("summary", "switch 2", USER, counted)) == {"n": 3}
+    assert len(counted.calls) == 3
+
+
+def test_local_cache_evicts_least_recently_used():
+    local = cache.LocalCache(max_entries=2, max_bytes=10, ttl=60)
+    local.set("a", 1)
+    local.set("b", 2)
+    local.get("a")
+    local.set("c", 3)
+    assert local.get("b") is None and local.get("a") == 1 and local.get("c") == 3
+
+    local.set("big", 4, size=9)
+    assert local.size <= 10 and local.get("big") == 4
+    local.set("huge", 5, size=11)
+    assert local.get("huge") is None
+
+    local.set("short", 6, ttl=0.01)
+    time.sleep(0.02)
+    assert local.get("short") is None
+
+
+def test_drop_local_publishes_the_key(run):
+    pubsub = database.redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(cache.INVALIDATION_CHANNEL)
+    cache.local_cache.set("user:a@b.c", {"email": "a@b.c"})
+    run(cache.drop_local("user:a@b.c"))
+    assert cache.local_cache.get("user:a@b.c") is None
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(3)]
+    assert [m["data"] for m in messages if m] == ["user:a@b.c"]
@@ -0,0 +1,63 @@
+import json
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+import database
+import main
+from auth.utils import get_current_user
+from sentiment.utils import decode_cursor, encode_cursor, get_comment_page
+
+USER_ID = ObjectId()
+
+
+@pytest.fixture
+def comments():
+    scores = [5, 3, 3, 3, None, 8, 0, None, 3, -2]
+    docs = []
+    for i, score in enumerate(scores):
+        doc = {"_id": ObjectId(), "tenant": "shared" if i % 2 else str(USER_ID), "product": "Switch 2",
+               "product_key": "switch 2", "prediction": "Positive", "text": f"comment {i}", "author": "a"}
+        if score is not None or i == 4:
+            doc["score"] = score
+        docs.append(doc)
+    # Neither another tenant's nor another product's comments show up
+    docs.append({**docs[0], "_id": ObjectId(), "tenant": "someone-else"})
+    docs.append({**docs[0], "_id": ObjectId(), "product_key": "switch"})
+    database.db_comments.insert_many(docs)
+    visible = docs[:len(scores)]
+    # (score, _id) descending, unscored comments last
+    return sorted(visible, key=lambda d: (d.get("score") is not None, d.get("score") or 0, d["_id"]), reverse=True)
+
+
+def test_cursor_round_trip():
+    doc = {"_id": ObjectId(), "score": None}
+    assert decode_cursor(encode_cursor(doc)) == {"score": None, "id": doc["_id"]}
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_pages_cover_every_comment_once(run, comments):
+    texts, cursor = [], None
+    while True:
+        page = run(get_comment_page("Switch 2", f"reddits_{USER_ID}", limit=3, cursor=cursor))
+        texts += [c["text"] for c in page["comments"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert texts == [d["text"] for d in comments]
+
+
+def test_comments_route_pages_and_streams(comments):
+    main.app.dependency_overrides[get_current_user] = lambda: {"_id": USER_ID, "role": "enterprise"}
+    try:
+        client = TestClient(main.app)
+        first = client.get("/sentiment/comments", params={"product": "switch 2", "limit": 4}).json()
+        second = client.get("/sentiment/comments", params={"product": "switch 2", "limit": 4, "cursor": first["next_cursor"]}).json()
+        assert [c["text"] for c in first["comments"] + second["comments"]] == [d["text"] for d in comments[:8]]
+
+        lines = client.get("/sentiment/comments", params={"product": "switch 2", "format": "ndjson"}).text.splitlines()
+        assert [json.loads(line)["text"] for line in lines] == [d["text"] for d in comments]
+
+        assert client.get("/sentiment/comments", params={"product": "switch 2", "cursor": "bad"}).status_code == 400
+    finally:
+        main.app.dependency_overrides.clear()
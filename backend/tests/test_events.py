@@ -0,0 +1,61 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import database
+import main
+from auth.utils import get_current_user
+from events import routes
+from events.utils import hub
+
+USER = {"_id": ObjectId(), "email": "a@example.com", "role": "user", "tracked_products": ["Switch 2"]}
+
+
+class Request:
+    async def is_disconnected(self):
+        return False
+
+
+@pytest.fixture
+def client():
+    database.db_users.insert_one(dict(USER))
+    main.app.dependency_overrides[get_current_user] = lambda: USER
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def test_tickets_open_one_stream(client, run):
+    ticket = client.post("/events/ticket").json()["ticket"]
+    assert 0 < database.redis.ttl(routes.ticket_key(ticket)) <= routes.STREAM_TICKET_TTL
+    assert run(routes.get_stream_user(None, ticket))["email"] == USER["email"]
+    with pytest.raises(HTTPException) as error:
+        run(routes.get_stream_user(None, ticket))
+    assert error.value.status_code == 401
+
+
+def test_stream_rejects_bearer_tokens_in_the_url(client):
+    assert client.get("/events/stream", params={"token": "anything"}).status_code == 401
+    assert client.get("/events/stream", params={"ticket": "unknown"}).status_code == 401
+
+
+def test_subscribes_only_while_the_body_runs(run):
+    async def go():
+        response = await routes.stream_events(Request(), ["Mario Kart"], USER)
+        # A response that is never sent holds no subscriber
+        assert not hub.subscribers
+
+        body = response.body_iterator
+        ready = await anext(body)
+        assert "switch 2" in ready and "mario kart" in ready
+        assert len(hub.subscribers) == 1
+        await body.aclose()
+        assert not hub.subscribers
+
+    run(go())
+
+
+def test_full_hub_answers_503(monkeypatch, run):
+    monkeypatch.setattr(hub, "max_connections", 0)
+    with pytest.raises(HTTPException) as error:
+        run(routes.stream_events(Request(), [], USER))
+    assert error.value.status_code == 503
@@ -0,0 +1,104 @@
+import json
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from pymongo.errors import BulkWriteError
+import database
+import main
+from auth.utils import get_current_user
+from sentiment import ingest, rollups
+
+USER_ID = ObjectId()
+
+
+def line(**fields) -> bytes:
+    comment = {"product": "Switch 2", "text": "great", "author": "a", "score": 3,
+               "created": "2026-05-01", "prediction": "Positive"}
+    comment.update(fields)
+    return json.dumps({k: v for k, v in comment.items() if v is not None}).encode()
+
+
+def test_invalid_lines_are_reported_and_skipped(run):
+    lines = [
+        line(),
+        b"",
+        b"{not json",
+        line(prediction="Happy"),
+        line(created=None),
+        line(product=""),
+        line(text="fine", score=1),
+    ]
+    result = run(ingest.ingest_lines("shared", ingest.iterate(lines)))
+    assert result["received"] == 6 and result["inserted"] == 2 and result["invalid"] == 4
+    assert [e["line"] for e in result["errors"]] == [3, 4, 5, 6]
+    assert result["errors"][1]["error"].startswith("prediction:")
+    assert result["errors"][2]["error"].startswith("created:")
+    assert database.db_comments.count_documents({}) == 2
+
+
+def test_reported_errors_are_capped(run):
+    result = run(ingest.ingest_lines("shared", ingest.iterate([b"{}"] * (ingest.MAX_REPORTED_ERRORS + 5))))
+    assert result["invalid"] == ingest.MAX_REPORTED_ERRORS + 5
+    assert len(result["errors"]) == ingest.MAX_REPORTED_ERRORS
+
+
+def test_duplicates_refresh_the_score_only(run):
+    first = run(ingest.ingest_lines("shared", ingest.iterate([line(), line(score=4)]), batch_size=1))
+    again = run(ingest.ingest_lines("shared", ingest.iterate([line(score=9, product=" switch 2 ")])))
+    assert (first["inserted"], first["duplicates"]) == (1, 1)
+    assert (again["inserted"], again["duplicates"]) == (0, 1)
+    [doc] = database.db_comments.find()
+    assert doc["score"] == 9 and doc["product"] == "Switch 2" and doc["product_key"] == "switch 2"
+    # Counted once in the rollups
+    assert sum(rollups.stored_counts("shared").values()) == 1
+
+
+def test_duplicate_key_races_count_as_duplicates(run, monkeypatch):
+    run(ingest.ingest_lines("shared", ingest.iterate([line()])))
+
+    # The first upsert lost a race with another writer of the same comment
+    class Racing:
+        def bulk_write(self, ops, ordered=True):
+            res = database.db_comments.bulk_write(ops[1:], ordered=False)
+            raise BulkWriteError({
+                "writeErrors": [{"index": 0, "code": 11000, "errmsg": "duplicate key"}],
+                "upserted": [{"index": i + 1, "_id": _id} for i, _id in res.upserted_ids.items()],
+            })
+    monkeypatch.setattr(ingest, "db_comments", Racing())
+
+    result = run(ingest.ingest_lines("shared", ingest.iterate([line(), line(text="ok"), line(text="fine")])))
+    assert (result["inserted"], result["duplicates"]) == (2, 1)
+    assert database.db_comments.count_documents({}) == 3
+    assert sum(rollups.stored_counts("shared").values()) == 3
+
+
+def test_split_lines_across_chunks(run):
+    async def chunks():
+        for chunk in (b'{"a"', b': 1}\n{"b": 2}\n', b'{"c": 3}'):
+            yield chunk
+
+    async def collect():
+        return [line async for line in ingest.split_lines(chunks())]
+
+    assert run(collect()) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+@pytest.mark.parametrize("role,target,status", [
+    ("user", "private", 403),
+    ("enterprise", "private", 200),
+    ("enterprise", "shared", 403),
+    ("admin", "shared", 200),
+])
+def test_ingest_route_permissions(role, target, status):
+    main.app.dependency_overrides[get_current_user] = lambda: {"_id": USER_ID, "role": role}
+    try:
+        response = TestClient(main.app).post(
+            "/sentiment/ingest", params={"target": target}, content=b"\n".join([line(), line(text="ok")])
+        )
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.status_code == status
+    if status == 200:
+        assert response.json()["inserted"] == 2
+        tenant = "shared" if target == "shared" else str(USER_ID)
+        assert database.db_comments.count_documents({"tenant": tenant}) == 2
@@ -0,0 +1,133 @@
+import asyncio
+import time
+import httpx
+import pytest
+import database
+from bench import fake_crawler
+from sentiment import jobs, rollups
+
+
+@pytest.fixture
+def crawler(monkeypatch):
+    monkeypatch.setattr(fake_crawler, "FAKE_CRAWL_DELAY", 0)
+    monkeypatch.setattr(jobs, "JOB_BACKOFF", 0)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_crawler.app))
+
+
+def test_submit_queues_and_dedups(run):
+    async def go():
+        job, created = await jobs.submit_job("u1", "Switch 2", "week")
+        same, created_again = await jobs.submit_job("u1", "  switch 2 ", "week")
+        other, created_other = await jobs.submit_job("u1", "Switch 2", "month")
+        return job, created, same, created_again, other, created_other
+
+    job, created, same, created_again, other, created_other = run(go())
+    assert created and not created_again and created_other
+    assert same["id"] == job["id"]
+    assert other["id"] != job["id"]
+    assert database.redis.lrange(jobs.QUEUE_KEY, 0, -1) == [job["id"], other["id"]]
+
+
+def test_concurrent_submits_queue_one_job(run):
+    async def go():
+        return await asyncio.gather(*(jobs.submit_job("u1", "Switch 2", "week") for _ in range(10)))
+
+    results = run(go())
+    assert sum(created for _, created in results) == 1
+    assert len({job["id"] for job, _ in results}) == 1
+    assert database.redis.llen(jobs.QUEUE_KEY) == 1
+    # Losing submissions leave no job behind
+    assert len(database.redis.keys("job:*")) == 1
+
+
+def test_dedup_key_of_expired_job_is_taken_over(run):
+    database.redis.set(jobs.dedup_key("u1", "switch 2", "week"), "gone")
+    job, created = run(jobs.submit_job("u1", "Switch 2", "week"))
+    assert created
+    assert database.redis.get(jobs.dedup_key("u1", "switch 2", "week")) == job["id"]
+
+
+def test_finished_job_copies_comments_and_clears_dedup(run, crawler):
+    async def go():
+        job, _ = await jobs.submit_job("u1", "Switch 2", "week")
+        assert await jobs.claim_next() == job["id"]
+        await jobs.run_job(crawler, job["id"])
+        return await jobs.get_job(job["id"])
+
+    job = run(go())
+    assert job["status"] == jobs.DONE and job["attempts"] == "1"
+    assert database.db_comments.count_documents({"tenant": "u1", "product_key": "switch 2"}) == 30
+    counted = sum(n for (_, _, prediction), n in rollups.stored_counts("u1").items() if prediction in rollups.SENTIMENTS)
+    assert counted == database.db_comments.count_documents({"tenant": "u1", "prediction": {"$in": rollups.SENTIMENTS}})
+    assert not database.redis.zscore(jobs.RUNNING_KEY, job["id"])
+    assert database.redis.get(jobs.dedup_key("u1", "switch 2", "week")) is None
+    # A finished job no longer blocks a new identical one
+    assert run(jobs.submit_job("u1", "Switch 2", "week"))[1]
+
+
+def test_failed_crawls_are_retried_then_fail(run, crawler, monkeypatch):
+    monkeypatch.setattr(fake_crawler, "FAKE_CRAWL_FAILURE_RATE", 1)
+
+    async def go():
+        job, _ = await jobs.submit_job("u1", "Switch 2", "week")
+        statuses = []
+        for _ in range(jobs.JOB_MAX_ATTEMPTS):
+            await jobs.requeue_due()
+            assert await jobs.claim_next() == job["id"]
+            await jobs.run_job(crawler, job["id"])
+            statuses.append((await jobs.get_job(job["id"]))["status"])
+        return job, statuses
+
+    job, statuses = run(go())
+    assert statuses == [jobs.RETRYING] * (jobs.JOB_MAX_ATTEMPTS - 1) + [jobs.FAILED]
+    assert "503" in database.redis.hget(jobs.job_key(job["id"]), "error")
+    assert database.redis.zcard(jobs.DELAYED_KEY) == 0
+    assert database.redis.get(jobs.dedup_key("u1", "switch 2", "week")) is None
+
+
+def test_rejected_crawls_fail_without_retry(run):
+    http = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(400)))
+
+    async def go():
+        job, _ = await jobs.submit_job("u1", "Switch 2", "week")
+        await jobs.claim_next()
+        await jobs.run_job(http, job["id"])
+        return await jobs.get_job(job["id"])
+
+    job = run(go())
+    assert job["status"] == jobs.FAILED and job["attempts"] == "1"
+
+
+def test_running_crawls_are_capped_across_dispatchers(run, monkeypatch):
+    monkeypatch.setattr(jobs, "CRAWL_MAX_RUNNING", 2)
+
+    async def go():
+        for product in ("a", "b", "c"):
+            await jobs.submit_job("u1", product, "week")
+        return [await jobs.claim_next() for _ in range(3)]
+
+    claimed = run(go())
+    assert claimed[0] and claimed[1] and claimed[2] is None
+    # An expired lease frees its slot and puts the job back on the queue
+    database.redis.zadd(jobs.RUNNING_KEY, {claimed[0]: time.time() - 1})
+    run(jobs.requeue_due())
+    assert run(jobs.claim_next()) is not None
+
+
+def test_dispatcher_runs_queued_jobs(run, crawler, monkeypatch):
+    monkeypatch.setattr(jobs.httpx, "AsyncClient", lambda **kwargs: crawler)
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.01)
+
+    async def go():
+        job, _ = await jobs.submit_job("u1", "Switch 2", "week")
+        stop = asyncio.Event()
+        dispatcher = asyncio.create_task(jobs.dispatch(stop, concurrency=2))
+        for _ in range(500):
+            if (await jobs.get_job(job["id"]))["status"] == jobs.DONE:
+                break
+            await asyncio.sleep(0.01)
+        stop.set()
+        await dispatcher
+        return await jobs.get_job(job["id"])
+
+    assert run(go())["status"] == jobs.DONE
@@ -0,0 +1,30 @@
+import pytest
+from fastapi.testclient import TestClient
+import main
+import metrics
+from auth.utils import get_current_user
+
+
+@pytest.fixture
+def client():
+    main.app.dependency_overrides[get_current_user] = lambda: {"_id": "u1", "role": "user"}
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def stage_count(stage: str) -> float:
+    return metrics.REGISTRY.get_sample_value("stage_duration_seconds_count", {"stage": stage}) or 0
+
+
+def test_profiled_request_writes_a_report(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILE_REQUESTS", True)
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path))
+    serialized = stage_count("serialize")
+
+    assert client.get("/sentiment/trending", headers={"X-Profile": "1"}).status_code == 200
+    [report] = tmp_path.iterdir()
+    assert report.name.startswith("sentiment_trending-") and report.suffix == ".html"
+    assert stage_count("serialize") > serialized
+
+    client.get("/sentiment/trending")
+    assert len(list(tmp_path.iterdir())) == 1
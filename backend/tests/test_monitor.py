@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi.testclient import TestClient
+import database
+import main
+from auth.utils import get_current_user
+
+
+def varies_on_encoding(response) -> bool:
+    return [v.strip().lower() for v in response.headers["vary"].split(",")].count("accept-encoding") == 1
+
+
+@pytest.fixture
+def client():
+    database.dbr["model_drift"].insert_many([
+        {"timestamp": datetime(2026, 1, day, tzinfo=timezone.utc), "metrics": {"f1": 0.9, "notes": "x" * 500}}
+        for day in range(1, 11)
+    ])
+    main.app.dependency_overrides[get_current_user] = lambda: {"_id": "admin", "role": "admin"}
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def test_snapshot_etag_depends_on_encoding(client):
+    plain = client.get("/monitor/snapshot", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/monitor/snapshot", headers={"Accept-Encoding": "gzip"})
+    brotli = client.get("/monitor/snapshot", headers={"Accept-Encoding": "br"})
+
+    assert "content-encoding" not in plain.headers
+    assert gzipped.headers["content-encoding"] == "gzip" and brotli.headers["content-encoding"] == "br"
+    etag = plain.headers["etag"]
+    assert not etag.startswith("W/")
+    assert gzipped.headers["etag"] == brotli.headers["etag"] == "W/" + etag
+    for response in (plain, gzipped, brotli):
+        assert varies_on_encoding(response)
+        assert response.json() == plain.json()
+
+
+def test_snapshot_revalidates_with_either_etag(client):
+    first = client.get("/monitor/snapshot", headers={"Accept-Encoding": "gzip"})
+    for etag in (first.headers["etag"], first.headers["etag"].removeprefix("W/")):
+        again = client.get("/monitor/snapshot", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert again.status_code == 304 and not again.content
+        assert varies_on_encoding(again)
+
+    database.dbr["model_drift"].insert_one({"timestamp": datetime(2026, 2, 1, tzinfo=timezone.utc)})
+    changed = client.get("/monitor/snapshot", headers={"If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200
+
+
+def test_report_reads_wait_for_the_sync(client, run):
+    from monitor import reports
+    database.dbr["data_drift"].insert_one({
+        "timestamp": datetime(2026, 1, 1),
+        "metrics": [{"id": "m", "metric_id": "ValueDrift(column=text_length,method=K-S p_value,threshold=0.05)", "value": 0.2}],
+    })
+    assert client.get("/monitor/reports", params={"kind": "data-drift"}).json() == []
+    assert client.get("/monitor/metrics", params={"kind": "data-drift"}).json() == []
+    before = client.get("/monitor/snapshot").headers["etag"]
+    assert database.dbr["parsed_reports"].count_documents({}) == 0
+
+    assert run(reports.sync_reports("data-drift")) == 1
+    [report] = client.get("/monitor/reports", params={"kind": "data-drift"}).json()
+    assert report["summary"]["drifted_columns"] == 1
+    assert [s["column"] for s in client.get("/monitor/metrics", params={"kind": "data-drift"}).json()] == ["text_length"]
+    assert client.get("/monitor/snapshot").headers["etag"] != before
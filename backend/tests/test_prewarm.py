@@ -0,0 +1,36 @@
+import asyncio
+import cache
+import database
+from sentiment import prewarm
+
+USER = {"_id": "t1", "role": "enterprise"}
+
+
+async def value():
+    return 1
+
+
+def test_reads_are_counted_up_to_the_cap(run, monkeypatch):
+    monkeypatch.setattr(cache, "MAX_ACCESS_KEYS", 2)
+    run(cache.cached_many("summary", ["a", "b", "c"], USER, lambda _: value()))
+    run(cache.cached_many("summary", ["a", "c"], USER, lambda _: value()))
+    assert cache.accesses == {("t1", "a"): 2, ("t1", "b"): 1}
+    # Shared-scope reads are not prewarmed, so not counted
+    run(cache.cached("summary", "a", None, value))
+    assert len(cache.accesses) == 2
+
+
+def test_flush_loop_hands_reads_to_the_scheduler(run):
+    cache.count_accesses("t1", ["a", "a", "b"])
+
+    async def go():
+        stop = asyncio.Event()
+        flusher = asyncio.create_task(prewarm.flush_loop(stop, interval=0.01))
+        await asyncio.sleep(0.05)
+        cache.count_accesses("t1", ["b"])
+        stop.set()
+        await flusher
+
+    run(go())
+    assert not cache.accesses
+    assert database.redis.zrange(prewarm.ACCESS_KEY, 0, -1, withscores=True) == [("t1:a", 2.0), ("t1:b", 2.0)]
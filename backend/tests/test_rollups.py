@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+import database
+from sentiment import ingest, rollups
+
+USER_ID = str(ObjectId())
+
+
+# A crawled comment whose _id was generated seconds_ago
+def legacy(seconds_ago: float = 0, product: str = "Switch 2", prediction: str = "Positive", day: str = "2026-05-01") -> dict:
+    when = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    _id = ObjectId(str(ObjectId.from_datetime(when))[:8] + str(ObjectId())[8:])
+    return {"_id": _id, "product": product, "prediction": prediction, "created": day, "text": "x", "author": "a"}
+
+
+def many(n: int, seconds_ago: float = 0) -> list[dict]:
+    return [
+        legacy(seconds_ago, f"Product {i % 3}", rollups.SENTIMENTS[i % 3], f"2026-05-{i % 28 + 1:02}")
+        for i in range(n)
+    ]
+
+
+def consistent(tenant: str) -> bool:
+    return rollups.check(tenant) == [] and rollups.raw_counts(tenant) == rollups.stored_counts(tenant)
+
+
+def test_lock_is_only_released_and_renewed_by_its_holder():
+    with rollups.rollup_lock() as lock:
+        with rollups.rollup_lock(wait=False) as other:
+            assert other is None
+        # Expired, then taken by someone else
+        database.redis.set(rollups.LOCK_KEY, "someone else")
+        with pytest.raises(rollups.LockLost):
+            lock.renew()
+    assert database.redis.get(rollups.LOCK_KEY) == "someone else"
+
+
+def test_lock_renewal_extends_the_ttl():
+    with rollups.rollup_lock(ttl=5) as lock:
+        database.redis.expire(rollups.LOCK_KEY, 1)
+        lock.renew()
+        assert database.redis.ttl(rollups.LOCK_KEY) > 1
+    assert database.redis.get(rollups.LOCK_KEY) is None
+
+
+def test_lock_wait_gives_up_after_the_timeout():
+    database.redis.set(rollups.LOCK_KEY, "someone else")
+    with rollups.rollup_lock(timeout=0.1) as lock:
+        assert lock is None
+
+
+def test_tail_once_is_idempotent():
+    database.db["reddits"].insert_many(many(25))
+    database.db[f"reddits_{USER_ID}"].insert_many(many(10))
+    with rollups.rollup_lock() as lock:
+        assert rollups.tail_once(lock, batch_size=7) == 35
+        assert rollups.tail_once(lock, batch_size=7) == 0
+        assert rollups.tail_once(lock) == 0
+    assert database.db_comments.count_documents({}) == 35
+    assert consistent("shared") and consistent(USER_ID)
+
+    database.db["reddits"].insert_many(many(5, seconds_ago=-1))
+    rollups.tail_once()
+    assert database.db_comments.count_documents({"tenant": "shared"}) == 30
+    assert consistent("shared")
+
+
+def test_tail_rescans_comments_committed_behind_the_checkpoint():
+    database.db["reddits"].insert_one(legacy())
+    rollups.tail_once()
+    # Written by a slow crawler with an earlier _id, inside TAIL_RESCAN
+    database.db["reddits"].insert_one(legacy(seconds_ago=60, prediction="Negative"))
+    rollups.tail_once()
+    assert database.db_comments.count_documents({}) == 2
+    assert consistent("shared")
+
+
+def test_reconcile_recovers_comments_the_tailer_skipped():
+    database.db["reddits"].insert_one(legacy())
+    rollups.tail_once()
+    # Further behind than the tailer re-scans
+    database.db["reddits"].insert_many([legacy(seconds_ago=rollups.TAIL_RESCAN + 60, prediction="Negative")])
+    rollups.tail_once()
+    assert rollups.reconcile("reddits") == 1
+    assert database.db_comments.count_documents({}) == 1
+
+    since = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(hours=1))
+    assert rollups.reconcile("reddits", since, fix=True) == 1
+    assert rollups.reconcile("reddits") == 0
+    assert database.db_comments.count_documents({}) == 2
+    assert consistent("shared")
+
+
+def test_rebuild_matches_a_recount():
+    database.db["reddits"].insert_many(many(40))
+    rollups.tail_once()
+    # Drifted rollups: a lost $inc, a doubled one and a stale row
+    key = {"tenant": "shared", "product_key": "product 0"}
+    database.db_rollups.update_one(key, {"$inc": {"count": 5}})
+    database.db_rollups.delete_one({"tenant": "shared", "product_key": "product 1"})
+    database.db_rollups.insert_one({**key, "day": "1999-01-01", "prediction": "Positive", "count": 3})
+    assert rollups.check("shared")
+
+    with rollups.rollup_lock() as lock:
+        assert rollups.rebuild("shared", lock) == 40
+    assert consistent("shared")
+
+
+def test_ingest_waits_for_the_rollup_lock(run, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_LOCK_WAIT", 0.1)
+    line = b'{"product": "Switch 2", "text": "ok", "created": "2026-05-01", "prediction": "Positive"}'
+    database.redis.set(rollups.LOCK_KEY, "rebuild")
+    with pytest.raises(rollups.RollupBusy):
+        run(ingest.ingest_lines("shared", ingest.iterate([line])))
+    assert database.db_comments.count_documents({}) == 0
+
+    database.redis.delete(rollups.LOCK_KEY)
+    assert run(ingest.ingest_lines("shared", ingest.iterate([line])))["inserted"] == 1
+    assert consistent("shared")
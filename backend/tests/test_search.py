@@ -0,0 +1,60 @@
+from bson import ObjectId
+from sentiment.search import SNIPPET_CHARS, highlight_pattern, search_pipeline, search_terms, snippet
+from sentiment.utils import encode_cursor
+
+
+def highlighted(result: dict) -> list[str]:
+    return [result["text"][start:end] for start, end in result["highlights"]]
+
+
+def test_search_terms_keep_phrases_and_drop_negations_and_stopwords():
+    assert search_terms('"battery life" -drift the Prices, joy-con') == ["battery life", "Prices", "joy-con"]
+    assert search_terms('-"stick drift" and of') == []
+
+
+def test_highlight_covers_phrases_and_stems():
+    pattern = highlight_pattern(search_terms('"battery life" pricing fun'))
+    text = "Battery life is fine, but priced high. Pricing aside, it's funny and fun."
+    assert [m.group() for m in pattern.finditer(text)] == ["Battery life", "priced", "Pricing", "fun"]
+    assert highlight_pattern([]) is None
+
+
+def test_short_text_is_returned_whole():
+    result = snippet("Great battery, great screen", highlight_pattern(["great"]))
+    assert result["text"] == "Great battery, great screen"
+    assert highlighted(result) == ["Great", "great"]
+
+
+def test_snippet_is_centred_on_the_first_match_without_cutting_words():
+    text = " ".join(["filler"] * 60) + " the battery died fast " + " ".join(["more"] * 60)
+    result = snippet(text, highlight_pattern(["battery"]))
+    body = result["text"]
+    assert body.startswith("…") and body.endswith("…")
+    assert len(body) <= SNIPPET_CHARS + 2
+    assert highlighted(result) == ["battery"]
+    words = body.strip("…").split(" ")
+    assert set(words) <= {"filler", "more", "the", "battery", "died", "fast"}
+
+
+def test_snippet_without_a_match_starts_at_the_beginning():
+    text = "word " * 100
+    result = snippet(text, highlight_pattern(["missing"]))
+    assert result["text"].startswith("word") and result["text"].endswith("…")
+    assert result["highlights"] == []
+    assert snippet(None, None) == {"text": "", "highlights": []}
+
+
+def test_search_pipeline_pages_by_relevance():
+    query = {"product_key": "switch 2", "$text": {"$search": "battery"}}
+    [match, project, facet] = search_pipeline(query, 10, None)
+    assert match == {"$match": query}
+    assert facet["$facet"]["comments"] == [{"$sort": {"relevance": -1, "_id": -1}}, {"$limit": 11}]
+
+    last = ObjectId()
+    cursor = encode_cursor({"score": 1.5, "_id": last})
+    page = search_pipeline(query, 10, cursor)[2]["$facet"]["comments"]
+    assert page[0] == {"$match": {"$or": [
+        {"relevance": {"$lt": 1.5}},
+        {"relevance": 1.5, "_id": {"$lt": last}},
+        {"relevance": None},
+    ]}}
@@ -0,0 +1,26 @@
+from datetime import date, timedelta
+import pytest
+from fastapi import HTTPException
+from sentiment import routes
+from sentiment.rollups import bucket_count, bucket_starts
+
+
+@pytest.mark.parametrize("granularity", ["day", "week", "month", "quarter"])
+def test_bucket_count_matches_bucket_starts(granularity):
+    start = date(2023, 11, 27)
+    for offset in range(0, 800, 13):
+        for span in (0, 1, 6, 7, 31, 92, 400):
+            date_from = start + timedelta(days=offset)
+            date_to = date_from + timedelta(days=span)
+            assert bucket_count(date_from, date_to, granularity) == len(bucket_starts(date_from, date_to, granularity))
+    assert bucket_count(date(2024, 2, 1), date(2024, 1, 1), granularity) == 0
+
+
+def test_resolve_range_limits_the_bucket_count():
+    date_to = date(2026, 1, 1)
+    date_from = date_to - timedelta(days=routes.MAX_TIMESERIES_BUCKETS - 1)
+    assert routes.resolve_range("day", date_from, date_to, "UTC") == (date_from, date_to)
+    for date_from, date_to in ((date_from - timedelta(days=1), date_to), (date.min, date.max)):
+        with pytest.raises(HTTPException) as error:
+            routes.resolve_range("day", date_from, date_to, "UTC")
+        assert error.value.status_code == 400
@@ -0,0 +1,89 @@
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+import database
+from sentiment import ingest, rollups, trending
+
+
+def test_count_min_sketch_never_underestimates():
+    sketch = trending.CountMinSketch(width=64, depth=4)
+    counts = Counter(random.Random(1).choices([f"p{i}" for i in range(500)], k=5000))
+    for key, n in counts.items():
+        sketch.add(trending.cells(key, width=64), n)
+    assert all(sketch.estimate(trending.cells(key, width=64)) >= n for key, n in counts.items())
+    assert sketch.estimate(trending.cells("unseen", width=64)) >= 0
+
+
+def test_space_saving_keeps_heavy_hitters():
+    table = trending.SpaceSaving(capacity=10)
+    stream = ["heavy"] * 300 + ["also heavy"] * 200 + [f"p{i}" for i in range(500)]
+    random.Random(2).shuffle(stream)
+    for key in stream:
+        table.add(key)
+    assert len(table.counts) == 10
+    assert "heavy" in table.counts and "also heavy" in table.counts
+    assert table.counts["heavy"] >= 300
+
+
+def comment(product: str, prediction: str, inserted: float, created: datetime = None) -> dict:
+    return {"_id": ObjectId(), "product": product, "prediction": prediction,
+            "inserted_at": datetime.fromtimestamp(inserted, timezone.utc).replace(tzinfo=None),
+            "created_at": created}
+
+
+def test_window_ranks_top_rising_and_negative():
+    window = trending.TrendingWindow(bucket_seconds=60, buckets=2)
+    now = time.time()
+    before, current = now - 150, now - 10
+    for _ in range(30):
+        window.add(comment("Steady", "Positive", before), now)
+        window.add(comment("Steady", "Positive", current), now)
+        window.add(comment("Souring", "Positive", before), now)
+        window.add(comment("Souring", "Negative", current), now)
+    for _ in range(10):
+        window.add(comment("Steady", "Positive", current), now)
+    for _ in range(60):
+        window.add(comment("New", "Neutral", current), now)
+    # Too old for either window
+    window.add(comment("Gone", "Positive", now - 1000), now)
+
+    ranked = window.rank(now, top_k=3, min_count=20)
+    assert [r["product_key"] for r in ranked["top"]] == ["new", "steady", "souring"]
+    assert ranked["rising"][0]["product_key"] == "new" and ranked["rising"][0]["growth"] == 60
+    assert ranked["negative"][0]["product_key"] == "souring" and ranked["negative"][0]["negative_jump"] == 1
+    assert "gone" not in window.names
+
+
+def test_backfilled_comments_are_not_trends():
+    window = trending.TrendingWindow(bucket_seconds=60, buckets=2)
+    now = time.time()
+    window.add(comment("Old", "Positive", now, created=datetime(2020, 1, 1)), now)
+    window.add(comment("Today", "Positive", now, created=datetime.now(timezone.utc).replace(tzinfo=None)), now)
+    assert [r["product_key"] for r in window.rank(now, min_count=1)["top"]] == ["today"]
+
+
+def test_poll_counts_copied_and_ingested_comments(run, monkeypatch):
+    monkeypatch.setattr(trending, "POLL_LAG", 0)
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    # Legacy comments copied long after they were crawled keep their old _id
+    old_id = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(days=30))
+    rollups.copy_comments("shared", [
+        {"_id": old_id, "product": "Switch 2", "prediction": "Negative", "created": today, "text": "x"},
+    ])
+    rollups.copy_comments("u1", [
+        {"_id": ObjectId(), "product": "Private", "prediction": "Negative", "created": today, "text": "x"},
+    ])
+    line = f'{{"product": "Switch 2", "text": "fine", "created": "{today}", "prediction": "Positive"}}'.encode()
+    run(ingest.ingest_lines("shared", ingest.iterate([line])))
+
+    window = trending.TrendingWindow()
+    start = (trending.utc_ago(3600), ObjectId("0" * 24))
+    position = trending.poll(window, start, batch_size=1)
+    position = trending.poll(window, position, batch_size=1)
+    assert trending.poll(window, position) == position
+    ranked = window.rank(time.time(), min_count=1)
+    [row] = ranked["top"]
+    assert row["product_key"] == "switch 2" and row["Negative"] == 1 and row["Positive"] == 1
+    assert database.db_comments.count_documents({"inserted_at": {"$exists": True}}) == 3
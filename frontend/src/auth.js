@@ -34,3 +34,45 @@ export async function authFetch(url, options = {}) {
 
   return res;
 }
+
+// Opens /api/events/stream with a single-use ticket, since EventSource can't
+// send the bearer header. A ticket only opens one stream, so on any error the
+// stream is closed and reopened with a new ticket. Returns a function that
+// closes it for good.
+export function openEventStream(params, listeners, retryDelay = 5000) {
+  let events = null;
+  let timer = null;
+  let closed = false;
+
+  const connect = async () => {
+    try {
+      const res = await authFetch("/api/events/ticket", { method: "POST" });
+      if (!res.ok) throw new Error("Failed to get a stream ticket");
+      const { ticket } = await res.json();
+      if (closed) return;
+      const query = new URLSearchParams(params);
+      query.set("ticket", ticket);
+      events = new EventSource(`/api/events/stream?${query}`);
+      for (const [type, listener] of Object.entries(listeners))
+        events.addEventListener(type, listener);
+      events.onerror = () => {
+        events.close();
+        retry();
+      };
+    } catch (err) {
+      console.error(err);
+      retry();
+    }
+  };
+
+  const retry = () => {
+    if (!closed) timer = setTimeout(connect, retryDelay);
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(timer);
+    if (events) events.close();
+  };
+}
@@ -47,7 +47,19 @@ export default function OnDemandCrawl() {
         throw new Error(data.detail || "Failed to crawl");
       }
       const data = await res.json();
-      setMessage(data.message || "Analysis started successfully");
+
+      // Poll the crawl job until it finishes
+      let job = data.job;
+      while (job && !["done", "failed"].includes(job.status)) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const jobRes = await authFetch(`api/sentiment/jobs/${job.id}`);
+        if (!jobRes.ok) throw new Error("Failed to fetch analysis status");
+        job = await jobRes.json();
+      }
+      if (job && job.status === "failed") {
+        throw new Error(job.error || "Analysis failed");
+      }
+      setMessage(job ? "Analysis finished successfully" : data.message);
     } catch (err) {
       setError(err.message);
     } finally {
@@ -1,21 +1,101 @@
-export default function TopComments({ comments }) {
+import { useEffect, useState } from "react";
+import { authFetch } from "../auth";
+
+// Snippet text with the matched ranges wrapped in <mark>
+function Highlighted({ snippet }) {
+  const parts = [];
+  let last = 0;
+  snippet.highlights.forEach(([start, end], i) => {
+    parts.push(snippet.text.slice(last, start));
+    parts.push(<mark key={i} className="bg-yellow-200 dark:bg-yellow-600 rounded px-0.5">{snippet.text.slice(start, end)}</mark>);
+    last = end;
+  });
+  parts.push(snippet.text.slice(last));
+  return parts;
+}
+
+export default function TopComments({ comments, product }) {
+  const [query, setQuery] = useState("");
+  const [results, setResults] = useState(null);
+  const [searching, setSearching] = useState(false);
+
+  // A new product clears the previous search
+  useEffect(() => {
+    setQuery("");
+    setResults(null);
+  }, [product]);
+
+  const search = async (cursor) => {
+    if (!product || query.trim().length < 2)
+      return;
+    setSearching(true);
+    try {
+      const params = new URLSearchParams({ product, q: query.trim() });
+      if (cursor)
+        params.set("cursor", cursor);
+      const res = await authFetch(`/api/sentiment/search?${params}`);
+      if (!res.ok)
+        throw new Error("Search failed");
+      const page = await res.json();
+      setResults(cursor ? { ...page, comments: [...results.comments, ...page.comments] } : page);
+    } catch (err) {
+      console.error("Error searching comments:", err);
+    } finally {
+      setSearching(false);
+    }
+  };
+
+  const shown = results ? results.comments : comments;
+
   return (
     <div className="bg-white dark:bg-gray-800 rounded-xl p-4 text-center dark:text-gray-200">
-      <h3 className="text-md font-semibold mb-2">Top Comments</h3>
+      <h3 className="text-md font-semibold mb-2">{results ? `Comments mentioning "${results.query}"` : "Top Comments"}</h3>
+      {product && (
+        <form
+          className="flex gap-2 mb-3"
+          onSubmit={(e) => { e.preventDefault(); search(); }}
+        >
+          <input
+            type="search"
+            value={query}
+            onChange={(e) => { setQuery(e.target.value); if (!e.target.value) setResults(null); }}
+            placeholder="Search comments, e.g. battery"
+            className="flex-1 px-3 py-1 text-sm rounded-lg border border-gray-300 dark:border-gray-600 dark:bg-gray-700"
+          />
+          <button type="submit" disabled={searching} className="px-3 py-1 text-sm rounded-lg bg-blue-600 text-white disabled:opacity-50">
+            Search
+          </button>
+        </form>
+      )}
+      {results && (
+        <div className="text-xs text-gray-500 dark:text-gray-400 mb-2">
+          {results.total} matches
+          {Object.entries(results.facets.prediction).map(([prediction, count]) => (
+            <span key={prediction}> · {prediction} {count}</span>
+          ))}
+        </div>
+      )}
       <div className="max-h-[300px] overflow-y-auto pr-2 space-y-4">
-        {(comments === null || comments.length === 0) ? (
+        {(shown === null || shown.length === 0) ? (
           <p className="dark:text-gray-300">No comments found.</p>
         ) : (
-          comments.map((comment, index) => (
+          shown.map((comment, index) => (
             <div key={index} className="p-4 bg-white dark:bg-gray-700 rounded-xl shadow-sm">
-              <p className="text-sm italic text-gray-600 dark:text-gray-300 mb-1">"{comment.text}"</p>
+              <p className="text-sm italic text-gray-600 dark:text-gray-300 mb-1">
+                "{comment.snippet ? <Highlighted snippet={comment.snippet} /> : comment.text}"
+              </p>
               <div className="text-xs text-gray-500 dark:text-gray-400">
                 <span>By {comment.author}</span> | <span>{comment.score} upvotes</span>
               </div>
             </div>
           ))
         )}
+        {results?.next_cursor && (
+          <button onClick={() => search(results.next_cursor)} disabled={searching} className="text-sm text-blue-600 dark:text-blue-400">
+            Load more
+          </button>
+        )}
       </div>
     </div>
   );
-}
\ No newline at end of file
+}
@@ -1,6 +1,24 @@
-import { useState } from "react";
+import { useState, useEffect } from "react";
 import { authFetch } from "../auth";
 
+// Products per /compare request (MAX_COMPARE_PRODUCTS on the server)
+const COMPARE_BATCH = 100;
+
+// Same normalization as the server, which answers once per product key
+const productKey = (product) => product.trim().toLowerCase();
+
+function SummaryLine({ summary }) {
+  return (
+    <span className="block text-xs font-normal text-gray-500 dark:text-gray-400">
+      {summary.total} comments
+      {summary.total > 0 && (
+        <> · <span className="text-green-600 dark:text-green-400">{Math.round(summary.positive / summary.total * 100)}% positive</span>
+        {" "}· <span className="text-red-600 dark:text-red-400">{Math.round(summary.negative / summary.total * 100)}% negative</span></>
+      )}
+    </span>
+  );
+}
+
 export default function TrackedProductsPanel({ tracked, onProductClick }) {
   const [trackedProducts, setTrackedProducts] = useState(tracked);
   const [message, setMessage] = useState(null);
@@ -8,6 +26,35 @@ export default function TrackedProductsPanel({ tracked, onProductClick }) {
   const [loading, setLoading] = useState(false);
   const [pendingUntrack, setPendingUntrack] = useState(null);
   const [confirmDelete, setConfirmDelete] = useState(null);
+  const [summaries, setSummaries] = useState({});
+  const [summaryError, setSummaryError] = useState(null);
+
+  // Load the summaries of the tracked products from /compare, which answers
+  // for up to COMPARE_BATCH products per request. Its series are kept to a
+  // single bucket since only the summaries are shown here.
+  useEffect(() => {
+    if (tracked.length === 0) return;
+    const fetchSummaries = async () => {
+      const today = new Date().toISOString().slice(0, 10);
+      const batches = [];
+      for (let i = 0; i < tracked.length; i += COMPARE_BATCH)
+        batches.push(tracked.slice(i, i + COMPARE_BATCH));
+      try {
+        const results = await Promise.all(batches.map(async (batch) => {
+          const query = batch.map(p => `products=${encodeURIComponent(p)}`).join("&");
+          const res = await authFetch(`/api/sentiment/compare?${query}&granularity=quarter&from=${today}&to=${today}`);
+          if (!res.ok) throw new Error("Failed to fetch tracked product summaries");
+          return (await res.json()).products;
+        }));
+        setSummaries(Object.fromEntries(results.flat().map(({ product, summary }) => [productKey(product), summary])));
+        setSummaryError(null);
+      } catch (err) {
+        console.error(err);
+        setSummaryError("Couldn't load the sentiment of your tracked products.");
+      }
+    };
+    fetchSummaries();
+  }, [tracked]);
 
   // Check for dark mode
   if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {
@@ -102,6 +149,12 @@ export default function TrackedProductsPanel({ tracked, onProductClick }) {
         </div>
       )}
 
+      {summaryError && (
+        <div className="mb-4 p-3 bg-yellow-50 dark:bg-yellow-900/30 border border-yellow-200 dark:border-yellow-800 rounded-md text-sm text-yellow-700 dark:text-yellow-300">
+          {summaryError}
+        </div>
+      )}
+
       {/* Empty state */}
       {trackedProducts.length === 0 && (
         <div className="flex flex-col items-center justify-center py-8 text-center text-gray-500 dark:text-gray-400 border-2 border-dashed border-gray-200 dark:border-gray-700 rounded-lg animate-fadeIn">
@@ -155,6 +208,7 @@ export default function TrackedProductsPanel({ tracked, onProductClick }) {
                     disabled={loading && pendingUntrack === product}
                   >
                     {product}
+                    {summaries[productKey(product)] && <SummaryLine summary={summaries[productKey(product)]} />}
                   </button>
                   
                   <button
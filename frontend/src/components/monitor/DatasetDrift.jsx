@@ -1,4 +1,5 @@
-import { useState, useMemo } from 'react'
+import { useState, useMemo, useEffect } from 'react'
+import { authFetch } from '../../auth'
 
 
 const ReportSelector = ({ reports, selectedReport, onReportChange }) => {
@@ -47,34 +48,36 @@ export default function DatasetDrift({ reportArray }) {
   const reports = reportArray || [];
   const [selectedReportIndex, setSelectedReportIndex] = useState(0)
   
-  // Process the current report data
-  const currentReport = reportArray?.[selectedReportIndex]
-  
+  const [currentReport, setCurrentReport] = useState(null)
+
+  // The list only carries summaries, fetch the parsed metrics and tests of the selected report
+  const selectedId = reportArray?.[selectedReportIndex]?._id
+  useEffect(() => {
+    if (!selectedId) return
+    let cancelled = false
+    setCurrentReport(null)
+    authFetch(`/api/monitor/reports/${selectedId}?fields=metrics,tests`)
+      .then(res => res.ok ? res.json() : null)
+      .then(report => { if (!cancelled) setCurrentReport(report) })
+      .catch(err => console.error('Error fetching drift report:', err))
+    return () => { cancelled = true }
+  }, [selectedId])
+
   const processedData = useMemo(() => {
     if (!currentReport) return null
     
     // Extract overall drift summary
-    const driftedColumnsMetric = currentReport.metrics?.find(m => 
-      m.metric_id.includes('DriftedColumnsCount')
-    )
+    const driftedColumnsMetric = currentReport.metrics?.find(m => m.name === 'DriftedColumnsCount')
     
-    // Group metrics by column
-    const columnMetrics = currentReport.metrics?.filter(m => 
-      m.metric_id.includes('ValueDrift')
-    ).map(metric => {
-      const columnMatch = metric.metric_id.match(/column=([^,)]+)/)
-      const methodMatch = metric.metric_id.match(/method=([^,)]+)/)
-      const thresholdMatch = metric.metric_id.match(/threshold=([^)]+)/)
-      
-      return {
-        id: metric.id,
-        column: columnMatch?.[1] || 'Unknown',
-        method: methodMatch?.[1] || 'Unknown',
-        threshold: parseFloat(thresholdMatch?.[1]) || 0,
-        value: metric.value,
-        isDrifted: metric.value > (parseFloat(thresholdMatch?.[1]) || 0)
-      }
-    }) || []
+    // Column drift metrics, already parsed by the API
+    const columnMetrics = currentReport.metrics?.filter(m => m.name === 'ValueDrift').map(metric => ({
+      id: metric.id,
+      column: metric.column || 'Unknown',
+      method: metric.method || 'Unknown',
+      threshold: metric.threshold || 0,
+      value: metric.value,
+      isDrifted: Boolean(metric.drifted)
+    })) || []
     
     // Get test results
     const testResults = currentReport.tests?.map(test => ({
@@ -82,7 +85,7 @@ export default function DatasetDrift({ reportArray }) {
       name: test.name,
       description: test.description,
       status: test.status,
-      column: test.metric_config?.params?.column || 'Overall'
+      column: test.column || 'Overall'
     })) || []
     
     return {
@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { authFetch, clearToken, getToken } from "../auth";
+import { authFetch, clearToken, getToken, openEventStream } from "../auth";
 import { Pie } from "react-chartjs-2";
 import {
   Chart as ChartJS,
@@ -39,6 +39,7 @@ export default function Dashboard() {
   const [weeklyData, setWeeklyData] = useState([]);
   const [monthlyData, setMonthlyData] = useState([]);
   const [activeTab, setActiveTab] = useState("sentiment");
+  const [searchedProduct, setSearchedProduct] = useState("");
 
   // Track list feature
   const [trackedProducts, setTrackedProducts] = useState([]);
@@ -63,29 +64,16 @@ export default function Dashboard() {
         "Authorization": `Bearer ${token}`
       };
 
-      const res = await authFetch(`/api/sentiment/summary?product=${encodeURIComponent(productName)}`, { headers });
+      // Summary, top comments, weekly and monthly data in one round-trip
+      const res = await authFetch(`/api/sentiment/dashboard?products=${encodeURIComponent(productName)}`, { headers });
       if (!res.ok) 
         throw new Error("Failed to fetch data");
-      const result = await res.json();
-      setData(result);
-
-      const resComments = await authFetch(`/api/sentiment/top-comments?product=${encodeURIComponent(productName)}`, { headers });
-      if (!resComments.ok) 
-        throw new Error("Failed to fetch comments");
-      const commentData = await resComments.json();
-      setTopComments(commentData);
-
-      const resWeekly = await authFetch(`/api/sentiment/weekly?product=${encodeURIComponent(productName)}`, { headers });
-      if (!resWeekly.ok) 
-        throw new Error("Failed to fetch weekly sentiment");
-      const weekly = await resWeekly.json();
-      setWeeklyData(weekly);
-
-      const resMonthly = await authFetch(`/api/sentiment/monthly?product=${encodeURIComponent(productName)}`, { headers });
-      if (!resMonthly.ok) 
-        throw new Error("Failed to fetch weekly sentiment");
-      const monthly = await resMonthly.json();
-      setMonthlyData(monthly);
+      const result = (await res.json())[productName];
+      setData(result.summary);
+      setTopComments(result.top_comments);
+      setWeeklyData(result.weekly);
+      setMonthlyData(result.monthly);
+      setSearchedProduct(productName);
 
     } catch (err) {
       setError(err.message);
@@ -94,6 +82,23 @@ export default function Dashboard() {
     }
   };
 
+  // Reload the shown product when the server pushes new sentiment for it
+  useEffect(() => {
+    if (!searchedProduct || !token)
+      return;
+    const productKey = searchedProduct.trim().toLowerCase();
+    const reload = (e) => {
+      const event = JSON.parse(e.data);
+      const key = event.product_key || event.job?.product?.trim().toLowerCase();
+      if (event.type === "resync" || key === productKey)
+        handleSearch(searchedProduct);
+    };
+    return openEventStream(
+      { products: searchedProduct },
+      { sentiment: reload, job: reload, resync: reload }
+    );
+  }, [searchedProduct]);
+
   // Function to fetch tracked products
   const fetchTrackedProducts = async () => {
     try {
@@ -364,7 +369,7 @@ export default function Dashboard() {
 
                     {/* Top Comments Section */}
                     <div className="lg:col-span-2 bg-white dark:bg-gray-800 rounded-2xl shadow-md p-5 border border-gray-100 dark:border-gray-700 transition-all duration-300 hover:shadow-lg">
-                      <TopComments comments={topComments} />
+                      <TopComments comments={topComments} product={searchedProduct} />
                     </div>
                   </div>
                 </>
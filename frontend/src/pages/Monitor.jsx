@@ -1,5 +1,5 @@
-import { useState, useEffect } from 'react';
-import { authFetch } from "../auth";
+import { useState, useEffect, useRef } from 'react';
+import { authFetch, getToken, openEventStream } from "../auth";
 import { useNavigate } from "react-router-dom";
 
 import ModelDrift from '../components/monitor/ModelDrift';
@@ -110,6 +110,9 @@ export default function Monitor() {
   // Panel selection state
   const [selectedPanel, setSelectedPanel] = useState('model-drift');
 
+  // ETag of the last snapshot, unchanged refreshes come back as 304
+  const etagRef = useRef(null);
+
   // Misc stats
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -119,42 +122,26 @@ export default function Monitor() {
     navigate("/");
   };
 
-  const fetchData = async () => {
+  const fetchData = async (silent = false) => {
     try {
-      setLoading(true);
+      if (!silent) setLoading(true);
       setError(null);
       
-      // Load AI model drift reports from the API
-      const resModel = await authFetch('/api/monitor/model');
-      if (!resModel.ok) {
-        throw new Error(`HTTP error! status: ${resModel.status}`);
+      // Load everything in one request, revalidating with the last ETag
+      const headers = etagRef.current ? { 'If-None-Match': etagRef.current } : {};
+      const res = await authFetch('/api/monitor/snapshot', { headers });
+      if (res.status === 304) {
+        return;
       }
-      const modelDriftsArray = await resModel.json();
-      setModelDrifts(modelDriftsArray);
-
-      // Load dataset drift reports from the API
-      const resDataset = await authFetch('/api/monitor/dataset-drift');
-      if (!resDataset.ok) {
-        throw new Error(`HTTP error! status: ${resDataset.status}`);
+      if (!res.ok) {
+        throw new Error(`HTTP error! status: ${res.status}`);
       }
-      const datasetDriftsArray = await resDataset.json();
-      setDatasetDrifts(datasetDriftsArray);
-
-      // Load alerts from the API
-      const resAlerts = await authFetch('/api/monitor/alerts');
-      if (!resAlerts.ok) {
-        throw new Error(`HTTP error! status: ${resAlerts.status}`);
-      }
-      const alertsArray = await resAlerts.json();
-      setAlerts(alertsArray);
-
-      // Load summaries from the API
-      const resSummaries = await authFetch('/api/monitor/dataset-summary');
-      if (!resSummaries.ok) {
-        throw new Error(`HTTP error! status: ${resSummaries.status}`);
-      }
-      const summariesArray = await resSummaries.json();
-      setSummaries(summariesArray);
+      const snapshot = await res.json();
+      etagRef.current = res.headers.get('ETag');
+      setModelDrifts(snapshot.model);
+      setDatasetDrifts(snapshot.dataset_drift);
+      setAlerts(snapshot.alerts);
+      setSummaries(snapshot.dataset_summary);
 
     } catch (err) {
       setError(err.message || 'Failed to fetch data');
@@ -183,6 +170,13 @@ export default function Monitor() {
     fetchData();
   }, []);
 
+  // New alerts are pushed by the server, refetch the snapshot when one arrives
+  useEffect(() => {
+    if (!getToken()) return;
+    const refresh = () => fetchData(true);
+    return openEventStream({}, { alert: refresh, resync: refresh });
+  }, []);
+
   useEffect(() => {
     // Dark mode detection
     if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {
@@ -203,7 +197,7 @@ export default function Monitor() {
   }, []);
 
   if (loading) return <LoadingSpinner />;
-  if (error) return <ErrorState error={error} onRetry={fetchData} />;
+  if (error) return <ErrorState error={error} onRetry={() => fetchData()} />;
 
   return (
     <div className="flex min-h-screen bg-gray-50 dark:bg-gray-900 p-6">
@@ -232,7 +226,7 @@ export default function Monitor() {
                 Performance metrics and test results analysis
               </p>
               <button
-                onClick={fetchData}
+                onClick={() => fetchData()}
                 className="mt-4 bg-primary text-white px-4 py-2 rounded-lg hover:bg-primary/90 transition-colors text-sm"
               >
                 Refresh Data